@@ -24,24 +24,73 @@ RABBITMQ_PORT = int(os.environ.get('RABBITMQ_PORT', 5672))
 RABBITMQ_USER = os.environ.get('RABBITMQ_USER', 'guest')
 RABBITMQ_PASS = os.environ.get('RABBITMQ_PASS', 'guest')
 RABBITMQ_VHOST = os.environ.get('RABBITMQ_VHOST', '/')
+# A memory:// URL selects the in-process broker instead of RabbitMQ; the
+# workers must then run in the API process (RUN_WORKERS_IN_PROCESS)
 RABBITMQ_URL = os.environ.get(
     'RABBITMQ_URL', 
     f"amqp://{RABBITMQ_USER}:{RABBITMQ_PASS}@{RABBITMQ_HOST}:{RABBITMQ_PORT}/{RABBITMQ_VHOST}"
 )
 RABBITMQ_RECONNECT_ATTEMPTS = int(os.environ.get('RABBITMQ_RECONNECT_ATTEMPTS', 10))
 RABBITMQ_RECONNECT_DELAY = float(os.environ.get('RABBITMQ_RECONNECT_DELAY', 5.0))
+PUBLISHER_CHANNELS = int(os.environ.get('PUBLISHER_CHANNELS', 4))  # Confirm-mode channels used for publishing
+PUBLISHER_MAX_IN_FLIGHT = int(os.environ.get('PUBLISHER_MAX_IN_FLIGHT', 256))  # Unconfirmed publishes before publishers wait
+MESSAGE_CODEC = os.environ.get('MESSAGE_CODEC', 'json')  # Encoding of published messages: json or msgpack
+TASK_EXCHANGE = os.environ.get('TASK_EXCHANGE', 'video_tasks_routed')  # Direct exchange, routing key = stage
+RUN_WORKERS_IN_PROCESS = os.environ.get('RUN_WORKERS_IN_PROCESS', 'False').lower() in ('true', '1', 't')  # Single-node mode: API starts both workers
+
+# Processing stages; each name is the routing key of its worker's tasks
+PROCESSING_STAGES = ('video_enhancement', 'metadata_extraction')
+
+# Task priorities (0 = lowest). Worker queues are priority queues; uploads
+# without an explicit priority get one from their size, smaller is higher.
+TASK_MAX_PRIORITY = int(os.environ.get('TASK_MAX_PRIORITY', 10))
+TASK_PRIORITY_SIZE_BANDS_MB = [
+    (float(size_mb), int(priority))
+    for size_mb, priority in (
+        band.split(':') for band in os.environ.get('TASK_PRIORITY_SIZE_BANDS_MB', '10:8,50:6,200:4').split(',')
+    )
+]  # "max_size_mb:priority" bands; larger files get TASK_DEFAULT_PRIORITY
+TASK_DEFAULT_PRIORITY = int(os.environ.get('TASK_DEFAULT_PRIORITY', 2))
+
+# Admission control: uploads are refused with 503 and Retry-After while a
+# stage's queue is too deep or would take too long to work off
+ADMISSION_MAX_QUEUE_DEPTH = int(os.environ.get('ADMISSION_MAX_QUEUE_DEPTH', 1000))  # Queued tasks per stage (0 = no limit)
+ADMISSION_MAX_WAIT = float(os.environ.get('ADMISSION_MAX_WAIT', 1800))  # Seconds of queued work per stage (0 = no limit)
+ADMISSION_RATE_WINDOW = float(os.environ.get('ADMISSION_RATE_WINDOW', 300))  # Seconds of completions used to estimate throughput
+ADMISSION_DEPTH_CACHE_SECONDS = float(os.environ.get('ADMISSION_DEPTH_CACHE_SECONDS', 1.0))  # How long a queue depth reading is reused
+ADMISSION_DEFAULT_RETRY_AFTER = int(os.environ.get('ADMISSION_DEFAULT_RETRY_AFTER', 30))  # Retry-After while throughput is unknown
+ADMISSION_MAX_RETRY_AFTER = int(os.environ.get('ADMISSION_MAX_RETRY_AFTER', 600))  # Upper bound for Retry-After
 
 # File configuration
 MAX_FILE_SIZE_MB = int(os.environ.get('MAX_FILE_SIZE_MB', 500))  # 500MB default max file size
 MAX_UPLOAD_SIZE = MAX_FILE_SIZE_MB * 1024 * 1024  # Convert to bytes
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 1024 * 1024))  # Read size when serving files without sendfile
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))  # Bytes written to disk at a time while uploading
 SUPPORTED_VIDEO_FORMATS: List[str] = [
     'mp4', 'avi', 'mov', 'mkv', 'webm', 'wmv', 'flv', 'm4v', '3gp'
 ]
 
 # Processing configuration
+PROBE_ON_UPLOAD = os.environ.get('PROBE_ON_UPLOAD', 'True').lower() in ('true', '1', 't')  # ffprobe uploads once in the API and pass the result to workers
+PROBE_TIMEOUT = float(os.environ.get('PROBE_TIMEOUT', 30))  # Seconds allowed for the upload probe
 PROCESSING_TIMEOUT = int(os.environ.get('PROCESSING_TIMEOUT', 300))  # 5 minutes default
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'True').lower() in ('true', '1', 't')  # Reuse results of identical earlier uploads
+PIPELINE_VERSION = os.environ.get('PIPELINE_VERSION', '1')  # Bump when processing output changes; cached results of other versions are ignored
+COLOR_PROFILE_SAMPLES = int(os.environ.get('COLOR_PROFILE_SAMPLES', 8))  # Frames sampled across a video for its colour profile
+COLOR_PROFILE_SAMPLE_SIZE = int(os.environ.get('COLOR_PROFILE_SAMPLE_SIZE', 160))  # Longest side of a sampled frame in pixels
 MAX_PROCESSING_ATTEMPTS = int(os.environ.get('MAX_PROCESSING_ATTEMPTS', 3))
+RETRY_BASE_DELAY = float(os.environ.get('RETRY_BASE_DELAY', 10.0))  # Seconds before the first retry, doubled per attempt
+RETRY_MAX_DELAY = float(os.environ.get('RETRY_MAX_DELAY', 600.0))  # Upper bound for the retry delay
+STATUS_BATCH_SIZE = int(os.environ.get('STATUS_BATCH_SIZE', 500))  # Status messages the API applies in one batch
+STATUS_BATCH_WAIT = float(os.environ.get('STATUS_BATCH_WAIT', 0.05))  # Seconds a partial status batch waits for more messages
+PROGRESS_MIN_INTERVAL = float(os.environ.get('PROGRESS_MIN_INTERVAL', 1.0))  # Seconds between progress messages per job
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 1))  # Jobs processed at once per worker process
 STATE_RETENTION_DAYS = int(os.environ.get('STATE_RETENTION_DAYS', 7))  # How long to keep processing state
+ENHANCEMENT_THREADS = int(os.environ.get('ENHANCEMENT_THREADS', os.cpu_count() or 1))  # Frame enhancement threads per job
+ENHANCEMENT_MAX_FRAMES_IN_FLIGHT = int(os.environ.get('ENHANCEMENT_MAX_FRAMES_IN_FLIGHT', 32))  # Bounds pipeline memory per job
+SEGMENT_PARALLEL_PROCESSES = int(os.environ.get('SEGMENT_PARALLEL_PROCESSES', 0))  # Processes per job for segment mode (0/1 = disabled)
+SEGMENT_MIN_SECONDS = float(os.environ.get('SEGMENT_MIN_SECONDS', 10.0))  # Shortest segment worth splitting off
+FFMPEG_PIPE_OUTPUT = os.environ.get('FFMPEG_PIPE_OUTPUT', 'True').lower() in ('true', '1', 't')  # Encode once via an ffmpeg pipe
 
 # Server configuration
 API_HOST = os.environ.get('API_HOST', '0.0.0.0')
@@ -61,7 +110,9 @@ LOG_FORMAT = os.environ.get(
     '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-# State file
-PROCESSING_STATES_FILE = "processing_states.json"
+# State storage
+PROCESSING_STATES_FILE = "processing_states.json"  # Legacy JSON store, imported once into the database
+PROCESSING_STATES_DB = os.environ.get('PROCESSING_STATES_DB', os.path.join(STATE_DIR, 'processing_states.db'))
+STATE_FLUSH_INTERVAL = float(os.environ.get('STATE_FLUSH_INTERVAL', 1.0))  # Seconds between progress flushes (0 = write through)
 
 # CORS settings - Removed duplicate in favor of ALLOWED_ORIGINS above 
\ No newline at end of file
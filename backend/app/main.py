@@ -1,17 +1,37 @@
-from fastapi import FastAPI, WebSocket, UploadFile, File, HTTPException, Form, Query
+from fastapi import FastAPI, WebSocket, HTTPException, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse
 from starlette.requests import Request
 import json
 import os
-from typing import Dict, Set
+import asyncio
+from typing import Dict, List, Set
 import uuid
 from datetime import datetime
 import logging
 from .utils.rabbitmq import RabbitMQClient
-from .utils.state import processing_state
+from .utils.state import processing_state, APPLIED, STALE
+from .utils.uploads import stream_upload
+from .utils.range_response import RangeFileResponse
+from .utils.codec import decode_body
+from .utils.batching import MessageBatcher
+from .utils.admission import AdmissionController, Overloaded
+from .utils.probe import probe_video, InvalidVideo
+from .utils.capabilities import get_capabilities
+from .utils.result_cache import result_cache
+from .utils.executor import run_blocking
 import aio_pika
-from .config import ALLOWED_ORIGINS
+from .config import (
+    ALLOWED_ORIGINS,
+    MAX_UPLOAD_SIZE,
+    PROCESSING_STAGES,
+    TASK_MAX_PRIORITY,
+    TASK_PRIORITY_SIZE_BANDS_MB,
+    TASK_DEFAULT_PRIORITY,
+    RUN_WORKERS_IN_PROCESS,
+    PROBE_ON_UPLOAD,
+    RESULT_CACHE_ENABLED
+)
 import stat
 
 app = FastAPI(title="Distributed Video Processing API")
@@ -42,96 +62,130 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 # RabbitMQ client
 rabbitmq_client = RabbitMQClient()
 
+# Refuses uploads while the worker queues are overloaded
+admission = AdmissionController(rabbitmq_client.get_queue_depth)
+
+# Workers running inside this process in single-node mode
+embedded_workers: List[asyncio.Task] = []
+
+def start_embedded_workers():
+    """Run both workers in the API process, on the same broker URL"""
+    from .workers.video_enhancement_worker import VideoEnhancementWorker
+    from .workers.metadata_extraction_worker import MetadataExtractionWorker
+    
+    for worker in (VideoEnhancementWorker(rabbitmq_client.url), MetadataExtractionWorker(rabbitmq_client.url)):
+        embedded_workers.append(asyncio.create_task(worker.start()))
+    logger.info("Started video enhancement and metadata extraction workers in process")
+
+async def stop_embedded_workers():
+    """Stop the in-process workers; they close their connections on the way out"""
+    for task in embedded_workers:
+        task.cancel()
+    await asyncio.gather(*embedded_workers, return_exceptions=True)
+    embedded_workers.clear()
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize RabbitMQ connection and start consuming status messages"""
+    # Detect ffprobe once here rather than on the first upload
+    await run_blocking(get_capabilities)
     await rabbitmq_client.connect()
-    await rabbitmq_client.start_consuming_status(handle_status_message)
+    await rabbitmq_client.start_consuming_status(status_batcher.add)
+    if RUN_WORKERS_IN_PROCESS:
+        start_embedded_workers()
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Close RabbitMQ connection"""
+    """Close RabbitMQ connection and write buffered state updates"""
+    await stop_embedded_workers()
+    await status_batcher.close()
     await rabbitmq_client.close()
+    await run_blocking(processing_state.flush)
+
+# Status message type -> task it reports on
+STATUS_MESSAGE_TASKS = {
+    "video_enhancement_status": "video_enhancement",
+    "metadata_extraction_status": "metadata_extraction",
+}
 
-async def handle_status_message(message: aio_pika.IncomingMessage):
-    """Handle status messages from workers"""
-    async with message.process():
+async def handle_status_batch(messages: List[aio_pika.IncomingMessage]):
+    """Apply a batch of worker status messages and forward them to clients"""
+    # Only the latest update per file and task in the batch matters
+    latest: Dict[tuple, dict] = {}
+    for message in messages:
         try:
-            data = json.loads(message.body.decode())
-            logger.info(f"Received status update: {data}")
-            
-            if data["type"] == "video_enhancement_status":
-                file_id = data["file_id"]
-                status = data["status"]
-                progress = data.get("progress", 0)
-                error = data.get("error")
-                
-                # Update processing state
-                processing_state.update_state(file_id, status, progress, error, "video_enhancement")
-                
-                # Forward status to connected client if available
-                if file_id in processing_state.states:
-                    client_id = processing_state.states[file_id].get("client_id")
-                    logger.info(f"Found client_id {client_id} for file_id {file_id}")
-                    
-                    if client_id and client_id in active_connections:
-                        try:
-                            status_update = {
-                                "type": "status_update",
-                                "file_id": file_id,
-                                "process_type": "video_enhancement",
-                                "status": status,
-                                "progress": progress,
-                                "error": error,
-                                "timestamp": datetime.utcnow().isoformat()
-                            }
-                            logger.info(f"Sending video enhancement status update to client {client_id}: {status_update}")
-                            await active_connections[client_id].send_json(status_update)
-                            logger.info(f"Successfully sent video enhancement status update to client {client_id}")
-                        except Exception as e:
-                            logger.error(f"Error sending status to client {client_id}: {str(e)}")
-                    else:
-                        logger.warning(f"Client {client_id} not connected for file_id {file_id}. Active connections: {list(active_connections.keys())}")
-                else:
-                    logger.warning(f"No client found for file_id {file_id} in processing state")
-            
-            elif data["type"] == "metadata_extraction_status":
-                file_id = data["file_id"]
-                status = data["status"]
-                progress = data.get("progress", 0)
-                error = data.get("error")
-                
-                # Update processing state
-                processing_state.update_state(file_id, status, progress, error, "metadata_extraction")
-                
-                # Forward status to connected client if available
-                if file_id in processing_state.states:
-                    client_id = processing_state.states[file_id].get("client_id")
-                    logger.info(f"Found client_id {client_id} for file_id {file_id}")
-                    
-                    if client_id and client_id in active_connections:
-                        try:
-                            status_update = {
-                                "type": "status_update",
-                                "file_id": file_id,
-                                "process_type": "metadata_extraction",
-                                "status": status,
-                                "progress": progress,
-                                "error": error,
-                                "timestamp": datetime.utcnow().isoformat()
-                            }
-                            logger.info(f"Sending metadata extraction status update to client {client_id}: {status_update}")
-                            await active_connections[client_id].send_json(status_update)
-                            logger.info(f"Successfully sent metadata extraction status update to client {client_id}")
-                        except Exception as e:
-                            logger.error(f"Error sending status to client {client_id}: {str(e)}")
-                    else:
-                        logger.warning(f"Client {client_id} not connected for file_id {file_id}. Active connections: {list(active_connections.keys())}")
-                else:
-                    logger.warning(f"No client found for file_id {file_id} in processing state")
-                        
+            data = decode_body(message.body, message.content_type)
+            task_type = STATUS_MESSAGE_TASKS.get(data.get("type"))
+            if task_type is None:
+                logger.warning(f"Ignoring status message of unknown type {data.get('type')!r}")
+                continue
+            latest[(data["file_id"], task_type)] = data
         except Exception as e:
             logger.error(f"Error handling status message: {str(e)}")
+    if not latest:
+        return
+    
+    # Update processing state in one write. Every API process receives
+    # these messages; the worker's timestamp makes the writes idempotent.
+    states, outcomes = await run_blocking(processing_state.apply_updates, [
+        (file_id, task_type, data["status"], data.get("progress", 0), data.get("error"), data.get("timestamp"))
+        for (file_id, task_type), data in latest.items()
+    ])
+    
+    # Every process measures the completion rate, but stale updates and
+    # repeated messages are not new completions
+    for (file_id, task_type), data in latest.items():
+        if data["status"] in ("completed", "failed") and outcomes.get((file_id, task_type)) != STALE:
+            admission.record_completion(task_type, task_id=(file_id, data.get("timestamp")))
+    
+    # Index finished results so identical uploads can reuse them, once:
+    # only the process whose write applied the completion does it
+    completed = [
+        key for key, data in latest.items()
+        if data["status"] == "completed" and outcomes.get(key) == APPLIED
+    ]
+    if completed and RESULT_CACHE_ENABLED:
+        try:
+            await run_blocking(result_cache.record_completions, completed)
+        except Exception as e:
+            logger.error(f"Failed to index completed results: {str(e)}")
+    
+    # Forward to the clients connected to this process, one sender per client
+    updates_by_client: Dict[str, List[dict]] = {}
+    for (file_id, task_type), data in latest.items():
+        state = states.get(file_id)
+        client_id = state.get("client_id") if state else None
+        if client_id in active_connections:
+            updates_by_client.setdefault(client_id, []).append({
+                "type": "status_update",
+                "file_id": file_id,
+                "process_type": task_type,
+                "status": data["status"],
+                "progress": data.get("progress", 0),
+                "error": data.get("error"),
+                "timestamp": datetime.utcnow().isoformat()
+            })
+    await asyncio.gather(*(
+        send_status_updates(client_id, updates) for client_id, updates in updates_by_client.items()
+    ))
+    logger.debug(
+        f"Applied {len(messages)} status messages as {len(latest)} updates, "
+        f"forwarded to {len(updates_by_client)} clients"
+    )
+
+async def send_status_updates(client_id: str, updates: List[dict]):
+    """Send status updates to one client, in order"""
+    websocket = active_connections.get(client_id)
+    if websocket is None:
+        return
+    try:
+        for update in updates:
+            await websocket.send_json(update)
+    except Exception as e:
+        logger.error(f"Error sending status to client {client_id}: {str(e)}")
+
+# Status messages are consumed in micro-batches
+status_batcher = MessageBatcher(handle_status_batch)
 
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
@@ -166,38 +220,132 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
             logger.info(f"Removing WebSocket connection for client_id: {client_id}")
             del active_connections[client_id]
 
-@app.post("/upload")
+def parse_stages(stages: str = None):
+    """Parse the comma-separated stages query parameter, keeping pipeline order"""
+    if not stages:
+        return list(PROCESSING_STAGES)
+    requested = {stage.strip() for stage in stages.split(",") if stage.strip()}
+    unknown = requested - set(PROCESSING_STAGES)
+    if unknown or not requested:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown stages {sorted(unknown)}; choose from {list(PROCESSING_STAGES)}"
+        )
+    return [stage for stage in PROCESSING_STAGES if stage in requested]
+
+def resolve_priority(priority: int = None, size_bytes: int = 0) -> int:
+    """Use the requested priority, or derive one from the upload size"""
+    if priority is not None:
+        return priority
+    size_mb = size_bytes / (1024 * 1024)
+    for max_size_mb, band_priority in TASK_PRIORITY_SIZE_BANDS_MB:
+        if size_mb <= max_size_mb:
+            return band_priority
+    return TASK_DEFAULT_PRIORITY
+
+@app.post(
+    "/upload",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {"file": {"type": "string", "format": "binary"}},
+                        "required": ["file"]
+                    }
+                }
+            }
+        }
+    }
+)
 async def upload_video(
-    file: UploadFile = File(...),
-    client_id: str = None
+    request: Request,
+    client_id: str = None,
+    stages: str = Query(None, description="Comma-separated stages to run (default: all)"),
+    priority: int = Query(
+        None, ge=0, le=TASK_MAX_PRIORITY,
+        description="Task priority, higher runs first (default: derived from file size)"
+    )
 ):
     # Log the client_id to debug issues
     logger.info(f"Upload request received with client_id: '{client_id}'")
     
-    # Error if file is not a video
-    if not file.content_type.startswith('video/'):
-        raise HTTPException(status_code=400, detail="File must be a video")
+    # Work out which processing stages to run before accepting the file
+    selected_stages = parse_stages(stages)
+    
+    # Refuse new work while a stage's backlog is over its limit, before
+    # the file is read
+    try:
+        await admission.check(selected_stages)
+    except Overloaded as e:
+        logger.warning(f"Upload refused, {str(e)}; retry after {e.retry_after}s")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Processing queue is full ({str(e)}), please retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     
     # Generate unique filename
     file_id = str(uuid.uuid4())
-    file_extension = os.path.splitext(file.filename)[1]
-    filename = f"{file_id}{file_extension}"
-    filepath = os.path.join(UPLOAD_DIR, filename)
     
-    # Save the file
+    # Stream the file to disk; rejects non-video and oversized uploads
     try:
-        with open(filepath, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        upload = await stream_upload(request, UPLOAD_DIR, file_id, MAX_UPLOAD_SIZE)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
+    filename = upload.filename
+    filepath = upload.filepath
+    task_priority = resolve_priority(priority, upload.size)
+    
+    # Probe the file once here: invalid files never reach the queue and the
+    # workers reuse the result instead of running ffprobe themselves
+    probe = None
+    if PROBE_ON_UPLOAD:
+        try:
+            probe = await probe_video(filepath)
+        except InvalidVideo as e:
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
+            raise HTTPException(status_code=400, detail=f"Invalid video file: {str(e)}")
+        except Exception as e:
+            logger.warning(f"Could not probe {file_id}, the workers will probe it: {str(e)}")
+    
+    # Stages already processed for an identical upload get those results;
+    # only looked up once the file is known to be valid, so a rejected
+    # upload never has artifacts linked to it
+    cached_stages = {}
+    if RESULT_CACHE_ENABLED:
+        try:
+            cached_stages = await run_blocking(result_cache.reuse_results, upload.sha256, file_id, selected_stages)
+        except Exception as e:
+            logger.warning(f"Result cache lookup failed for {file_id}: {str(e)}")
+    pending_stages = [stage for stage in selected_stages if stage not in cached_stages]
+    if cached_stages:
+        logger.info(f"Reusing results for {file_id}: {cached_stages}")
+    if not pending_stages:
+        # Nothing left to process, the duplicate upload is not needed
+        await run_blocking(os.remove, filepath)
     
     # Make sure client_id is a string, not None
     effective_client_id = client_id if client_id else "unknown_client"
     logger.info(f"Creating processing state for file_id: {file_id} with client_id: '{effective_client_id}'")
     
     # Create processing state
-    state = processing_state.create_state(file_id, effective_client_id)
+    state = await run_blocking(processing_state.create_state, file_id, effective_client_id, selected_stages)
+    if cached_stages:
+        now = datetime.utcnow().isoformat()
+        await run_blocking(processing_state.update_states, [
+            (file_id, stage, "completed", 100, None, now) for stage in cached_stages
+        ])
+    if RESULT_CACHE_ENABLED and pending_stages:
+        # Index this upload's results once its stages complete
+        await run_blocking(result_cache.record_upload, file_id, upload.sha256)
     
     # Publish task to RabbitMQ
     message = {
@@ -205,12 +353,17 @@ async def upload_video(
         "filepath": filepath,
         "filename": filename,
         "client_id": effective_client_id,
+        "stages": pending_stages,
+        "priority": task_priority,
         "timestamp": datetime.utcnow().isoformat()
     }
+    if probe is not None:
+        message["probe"] = probe
     
     try:
-        await rabbitmq_client.publish_task(message)
-        logger.info(f"Published task for file {file_id} to RabbitMQ")
+        if pending_stages:
+            await rabbitmq_client.publish_task(message, pending_stages, task_priority)
+            logger.info(f"Published task for file {file_id} to RabbitMQ")
         
         # Send initial upload status to WebSocket if client is connected
         if effective_client_id in active_connections:
@@ -222,6 +375,18 @@ async def upload_video(
                 "message": "Video uploaded successfully",
                 "timestamp": datetime.utcnow().isoformat()
             })
+            await send_status_updates(effective_client_id, [
+                {
+                    "type": "status_update",
+                    "file_id": file_id,
+                    "process_type": stage,
+                    "status": "completed",
+                    "progress": 100,
+                    "error": None,
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+                for stage in cached_stages
+            ])
             logger.info(f"Successfully sent initial upload status to client {effective_client_id}")
         else:
             logger.warning(f"Client {effective_client_id} not connected. Active connections: {list(active_connections.keys())}")
@@ -229,26 +394,64 @@ async def upload_video(
         logger.error(f"Failed to publish task to RabbitMQ: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to queue video for processing")
     
-    return {"file_id": file_id, "message": "Video uploaded successfully"}
+    return {"file_id": file_id, "message": "Video uploaded successfully", "cached_stages": list(cached_stages)}
 
 @app.get("/internal/video-enhancement-status/{file_id}")
 async def get_video_enhancement_status(file_id: str):
-    state = processing_state.get_state(file_id)
+    state = await run_blocking(processing_state.get_state, file_id)
     if not state:
         raise HTTPException(status_code=404, detail="File not found")
     return state["video_enhancement"]
 
 @app.get("/internal/metadata-extraction-status/{file_id}")
 async def get_metadata_extraction_status(file_id: str):
-    state = processing_state.get_state(file_id)
+    state = await run_blocking(processing_state.get_state, file_id)
     if not state:
         raise HTTPException(status_code=404, detail="File not found")
     return state["metadata_extraction"]
 
+@app.get("/admin/dead-letters/{stage}")
+async def list_dead_letters(stage: str, limit: int = Query(50, ge=1, le=1000)):
+    """Inspect tasks that failed MAX_PROCESSING_ATTEMPTS times or could not be read"""
+    if stage not in PROCESSING_STAGES:
+        raise HTTPException(status_code=404, detail="Unknown stage")
+    return {"stage": stage, "messages": await rabbitmq_client.get_dead_letters(stage, limit)}
+
+@app.post("/admin/dead-letters/{stage}/requeue")
+async def requeue_dead_letters(stage: str, limit: int = Query(50, ge=1, le=1000), file_id: str = None):
+    """Send dead-lettered tasks back to their worker, optionally for one file only"""
+    if stage not in PROCESSING_STAGES:
+        raise HTTPException(status_code=404, detail="Unknown stage")
+    requeued = await rabbitmq_client.requeue_dead_letters(stage, limit, file_id)
+    for requeued_file_id in requeued:
+        if requeued_file_id:
+            await run_blocking(processing_state.update_processing_status, requeued_file_id, stage, "pending", 0, None)
+    return {"stage": stage, "requeued": requeued}
+
+@app.get("/internal/admission")
+async def get_admission_stats():
+    """Upload admission counters with the last queue depths and processing rates"""
+    return admission.get_stats()
+
+@app.get("/internal/result-cache")
+async def get_result_cache_stats():
+    """Uploads served from earlier results of identical content: hits, misses and hit rate"""
+    return await run_blocking(result_cache.get_stats)
+
+@app.get("/internal/capabilities")
+async def get_capabilities_info():
+    """Media tools, ffmpeg encoders and the OpenCV writer codec found by this process"""
+    return (await run_blocking(get_capabilities)).to_dict()
+
+@app.get("/internal/state-stats")
+async def get_state_stats():
+    """Counters of the buffered processing state writes"""
+    return processing_state.get_stats()
+
 # Add new endpoints to serve the processed files
 
 @app.get("/processed_videos/{file_id}")
-async def get_processed_video(file_id: str):
+async def get_processed_video(file_id: str, request: Request):
     """Serve a processed video file by file_id"""
     # Look for the file with the given ID
     processed_dir = os.environ.get('PROCESSED_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'processed_videos'))
@@ -296,56 +499,16 @@ async def get_processed_video(file_id: str):
     # Set the appropriate media type based on extension
     media_type = f"video/{file_extension[1:]}" if file_extension != ".mkv" else "video/x-matroska"
     
-    # Function to handle range requests properly
-    def send_file_partial(file_path: str, request: Request):
-        file_size = os.stat(file_path).st_size
-        
-        # Parse the Range header
-        range_header = request.headers.get("range")
-        
-        # Default values (no range specified - full file)
-        start = 0
-        end = file_size - 1
-        
-        # If a range is specified
-        if range_header:
-            range_match = range_header.strip().lower()
-            if range_match.startswith("bytes="):
-                ranges = range_match[6:].split(",")[0].split("-")
-                if ranges[0]:
-                    start = int(ranges[0])
-                if ranges[1]:
-                    end = min(int(ranges[1]), file_size - 1)
-        
-        # Calculate the chunk size
-        chunk_size = end - start + 1
-        
-        # Open file and seek to the right position
-        def iterfile():
-            with open(file_path, mode="rb") as f:
-                f.seek(start)
-                yield from iter(lambda: f.read(4096), b"")
-        
-        # Set appropriate headers
-        headers = {
-            "Content-Range": f"bytes {start}-{end}/{file_size}",
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(chunk_size),
-            "Content-Type": media_type,
-            "Content-Disposition": f'inline; filename="{os.path.basename(file_path)}"',
+    # Honour the client's Range header so seeking only fetches the bytes needed
+    return RangeFileResponse(
+        found_file,
+        request.headers,
+        media_type,
+        headers={
+            "Content-Disposition": f'inline; filename="{os.path.basename(found_file)}"',
             "Cache-Control": "max-age=86400",  # Cache for a day
         }
-        
-        # Return a partial response if a range was specified
-        if range_header:
-            return StreamingResponse(iterfile(), status_code=206, headers=headers)
-        else:
-            return StreamingResponse(iterfile(), headers=headers)
-    
-    from starlette.background import BackgroundTask
-    
-    # Return the file with proper headers and range support
-    return send_file_partial(found_file, Request(scope={"type": "http", "headers": []}))
+    )
 
 @app.get("/metadata/{file_id}.json")
 async def get_metadata(file_id: str):
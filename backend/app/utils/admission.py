@@ -0,0 +1,175 @@
+"""
+Admission control for new uploads.
+
+Before an upload is read, the backlog of every stage it needs is checked
+against two limits: the number of tasks waiting in the stage's queue, and
+the time the backlog is expected to take at the recently observed
+completion rate. When either is exceeded the upload is refused with a
+``Retry-After`` estimate instead of adding to a backlog that only grows.
+
+Queue depths come from passive queue declares and are cached briefly, so
+a burst of uploads costs one broker round trip per stage and interval.
+The completion rate is measured from the terminal status messages every
+API process receives.
+"""
+import math
+import time
+import logging
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Iterable, Optional, Tuple
+
+from ..config import (
+    ADMISSION_MAX_QUEUE_DEPTH,
+    ADMISSION_MAX_WAIT,
+    ADMISSION_RATE_WINDOW,
+    ADMISSION_DEPTH_CACHE_SECONDS,
+    ADMISSION_DEFAULT_RETRY_AFTER,
+    ADMISSION_MAX_RETRY_AFTER
+)
+
+logger = logging.getLogger(__name__)
+
+DepthProbe = Callable[[str], Awaitable[Optional[int]]]
+
+
+class Overloaded(Exception):
+    """A stage's backlog is over its limit"""
+
+    def __init__(self, stage: str, depth: int, retry_after: int, reason: str):
+        super().__init__(f"{stage} backlog is {reason}")
+        self.stage = stage
+        self.depth = depth
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Decide whether new work can be accepted.
+
+    Args:
+        get_depth: Coroutine returning the number of queued tasks of a
+            stage, or None when it cannot be determined
+        max_queue_depth: Queued tasks per stage above which uploads are refused (0 = no limit)
+        max_wait: Expected backlog time in seconds above which uploads are refused (0 = no limit)
+        rate_window: Seconds of completions used to estimate the processing rate
+        depth_cache_seconds: How long a measured queue depth is reused
+        default_retry_after: Retry-After in seconds while no rate is known
+        max_retry_after: Upper bound for the Retry-After estimate
+    """
+
+    def __init__(self, get_depth: DepthProbe, max_queue_depth: int = ADMISSION_MAX_QUEUE_DEPTH,
+                 max_wait: float = ADMISSION_MAX_WAIT, rate_window: float = ADMISSION_RATE_WINDOW,
+                 depth_cache_seconds: float = ADMISSION_DEPTH_CACHE_SECONDS,
+                 default_retry_after: int = ADMISSION_DEFAULT_RETRY_AFTER,
+                 max_retry_after: int = ADMISSION_MAX_RETRY_AFTER):
+        self.get_depth = get_depth
+        self.max_queue_depth = max_queue_depth
+        self.max_wait = max_wait
+        self.rate_window = rate_window
+        self.depth_cache_seconds = depth_cache_seconds
+        self.default_retry_after = default_retry_after
+        self.max_retry_after = max_retry_after
+        self._depths: Dict[str, Tuple[float, Optional[int]]] = {}
+        self._completions: Dict[str, Deque[float]] = {}
+        # Finishes counted within the rate window, oldest first
+        self._counted: "OrderedDict[Tuple[str, Hashable], float]" = OrderedDict()
+        self._started = time.monotonic()
+        self.stats = {"admitted": 0, "rejected": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_queue_depth > 0 or self.max_wait > 0
+
+    def record_completion(self, stage: str, now: Optional[float] = None, task_id: Optional[Hashable] = None):
+        """
+        Count a task of ``stage`` that finished (completed or failed).
+
+        ``task_id`` identifies the finish, e.g. the file id and the worker's
+        timestamp; a repeated status message for a finish already counted
+        within the rate window is ignored.
+        """
+        now = time.monotonic() if now is None else now
+        if task_id is not None:
+            while self._counted and next(iter(self._counted.values())) < now - self.rate_window:
+                self._counted.popitem(last=False)
+            if (stage, task_id) in self._counted:
+                return
+            self._counted[(stage, task_id)] = now
+        completions = self._completions.setdefault(stage, deque())
+        completions.append(now)
+        self._trim(completions, now)
+
+    def _trim(self, completions: Deque[float], now: float):
+        while completions and completions[0] < now - self.rate_window:
+            completions.popleft()
+
+    def processing_rate(self, stage: str, now: Optional[float] = None) -> Optional[float]:
+        """Tasks per second finished recently, or None before any finished"""
+        now = time.monotonic() if now is None else now
+        completions = self._completions.get(stage)
+        if not completions:
+            return None
+        self._trim(completions, now)
+        if not completions:
+            return None
+        # Shortly after startup only the time since then has been observed
+        return len(completions) / min(self.rate_window, max(now - self._started, 1.0))
+
+    async def queue_depth(self, stage: str) -> Optional[int]:
+        now = time.monotonic()
+        cached = self._depths.get(stage)
+        if cached is not None and now - cached[0] < self.depth_cache_seconds:
+            return cached[1]
+        try:
+            depth = await self.get_depth(stage)
+        except Exception as e:
+            logger.warning(f"Could not read the {stage} queue depth: {str(e)}")
+            depth = None
+        self._depths[stage] = (now, depth)
+        return depth
+
+    def _retry_after(self, excess: float, rate: Optional[float]) -> int:
+        """Seconds until ``excess`` tasks are worked off at ``rate``"""
+        if not rate:
+            return self.default_retry_after
+        return max(1, min(self.max_retry_after, math.ceil(excess / rate)))
+
+    async def check(self, stages: Iterable[str]):
+        """
+        Admit new work for ``stages`` or refuse it.
+
+        Raises:
+            Overloaded: For the first stage over a limit, with a Retry-After estimate
+        """
+        if not self.enabled:
+            return
+        for stage in stages:
+            depth = await self.queue_depth(stage)
+            if depth is None:
+                # Without a measurement the upload is not held back
+                continue
+            rate = self.processing_rate(stage)
+            if self.max_queue_depth > 0 and depth >= self.max_queue_depth:
+                self.stats["rejected"] += 1
+                raise Overloaded(stage, depth, self._retry_after(depth - self.max_queue_depth + 1, rate),
+                                 f"{depth} queued tasks")
+            if self.max_wait > 0 and rate and depth / rate > self.max_wait:
+                self.stats["rejected"] += 1
+                raise Overloaded(stage, depth, self._retry_after(depth - self.max_wait * rate, rate),
+                                 f"about {depth / rate:.0f}s of work")
+        self.stats["admitted"] += 1
+
+    def get_stats(self) -> Dict[str, object]:
+        """Counters, last measured depths and current rates per stage"""
+        stages = set(self._depths) | set(self._completions)
+        return {
+            **self.stats,
+            "stages": {
+                stage: {
+                    "queue_depth": self._depths.get(stage, (None, None))[1],
+                    "processing_rate": self.processing_rate(stage),
+                }
+                for stage in sorted(stages)
+            },
+        }
@@ -0,0 +1,97 @@
+"""
+Micro-batching for consumed messages.
+
+A consumer callback that handles one message at a time pays the full
+cost of its work (a database commit, a network send) for every message.
+``MessageBatcher`` collects messages instead and hands them to a handler
+together, then acknowledges the whole batch with a single ``multiple`` ack.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from ..config import STATUS_BATCH_SIZE, STATUS_BATCH_WAIT
+
+logger = logging.getLogger(__name__)
+
+BatchHandler = Callable[[List[Any]], Awaitable[None]]
+
+
+class MessageBatcher:
+    """
+    Collect consumed messages and pass them to ``handler`` in batches.
+
+    A batch is handed over when ``max_size`` messages have arrived, or
+    ``max_wait`` seconds after its first message. Batches are handled one
+    at a time and in arrival order. Like ``message.process()`` before it,
+    a batch is acknowledged even if the handler fails; the error is logged.
+
+    Args:
+        handler: Coroutine called with a list of messages
+        max_size: Largest batch
+        max_wait: Seconds a partial batch waits for more messages
+    """
+
+    def __init__(self, handler: BatchHandler, max_size: int = STATUS_BATCH_SIZE,
+                 max_wait: float = STATUS_BATCH_WAIT):
+        self.handler = handler
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait
+        self._messages: List[Any] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._handling = asyncio.Lock()
+        self.stats = {"messages": 0, "batches": 0, "errors": 0}
+
+    async def add(self, message):
+        """Consumer callback: queue a message for the next batch"""
+        self._messages.append(message)
+        if len(self._messages) >= self.max_size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_wait)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Handle and acknowledge the messages collected so far"""
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+            self._timer = None
+        batch, self._messages = self._messages, []
+        if not batch:
+            return
+
+        async with self._handling:
+            try:
+                await self.handler(batch)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Error handling a batch of {len(batch)} messages: {str(e)}")
+            self.stats["messages"] += len(batch)
+            self.stats["batches"] += 1
+            await self._ack(batch)
+
+    @staticmethod
+    async def _ack(batch: List[Any]):
+        """Acknowledge a batch with one ack per channel"""
+        last_per_channel: Dict[int, Any] = {}
+        for message in batch:
+            if message.processed:
+                continue
+            last = last_per_channel.get(id(message.channel))
+            if last is None or message.delivery_tag > last.delivery_tag:
+                last_per_channel[id(message.channel)] = message
+        for message in last_per_channel.values():
+            try:
+                # Also acknowledges every earlier delivery on the channel,
+                # all of which belong to this or an already handled batch
+                await message.ack(multiple=True)
+            except Exception as e:
+                logger.error(f"Failed to acknowledge status messages: {str(e)}")
+
+    async def close(self):
+        """Handle whatever is still collected"""
+        await self.flush()
@@ -0,0 +1,17 @@
+"""
+Broker transport selection.
+
+The broker URL normally points at RabbitMQ. A ``memory://`` URL selects
+the in-process broker in ``memory_broker`` instead, which is used to run
+the API and both workers in a single process and for hermetic tests.
+"""
+import aio_pika
+
+from . import memory_broker
+
+
+async def connect(url: str):
+    """Open a connection to the broker at ``url``"""
+    if memory_broker.is_memory_url(url):
+        return await memory_broker.connect(url)
+    return await aio_pika.connect_robust(url)
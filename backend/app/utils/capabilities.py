@@ -0,0 +1,193 @@
+"""
+Toolchain capability registry.
+
+Which media tools a process can use does not change while it runs, so it
+is discovered once: the ffmpeg/ffprobe binaries on the path and their
+versions, the encoders ffmpeg was built with, and the first OpenCV
+``VideoWriter`` codec that can actually open an MP4 file. Jobs read the
+cached result from ``get_capabilities()`` instead of searching the path,
+running ``-version`` or opening trial writers themselves.
+"""
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# OpenCV writer codecs in order of preference (best browser support first)
+PREFERRED_CODECS = ['avc1', 'H264', 'h264', 'XVID', 'mp4v']
+
+# External tools the workers call
+BINARIES = ['ffmpeg', 'ffprobe']
+
+_capabilities: Optional["Capabilities"] = None
+_lock = threading.Lock()
+
+
+def _run(cmd: List[str], timeout: float = 10) -> Optional[str]:
+    """stdout of a command, or None if it could not run or failed"""
+    try:
+        result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True,
+                                text=True, timeout=timeout)
+    except (subprocess.SubprocessError, OSError) as e:
+        logger.warning(f"Could not run {cmd[0]}: {str(e)}")
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout
+
+
+def _parse_encoders(output: str) -> List[str]:
+    """
+    Encoder names from ``ffmpeg -encoders``.
+
+    The list follows a legend that ends with a `` ------`` line; every
+    entry is ``<flags> <name> <description>``.
+    """
+    encoders = []
+    in_list = False
+    for line in output.splitlines():
+        if not in_list:
+            in_list = line.strip().startswith('---')
+            continue
+        parts = line.split()
+        if len(parts) >= 2:
+            encoders.append(parts[1])
+    return encoders
+
+
+def _find_writer_codec() -> Optional[str]:
+    """First preferred codec with which OpenCV can write an MP4 file"""
+    frame = np.zeros((16, 16, 3), dtype=np.uint8)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "probe.mp4")
+        for codec in PREFERRED_CODECS:
+            try:
+                out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), 25, (16, 16))
+                try:
+                    if out.isOpened():
+                        out.write(frame)
+                        return codec
+                finally:
+                    out.release()
+            except Exception as e:
+                logger.debug(f"Writer codec {codec} unusable: {str(e)}")
+    return None
+
+
+class Capabilities:
+    """
+    Media tools available to this process.
+
+    Attributes:
+        binaries: Path of each tool in ``BINARIES`` that was found
+        versions: First line of ``<tool> -version`` for each found tool
+        encoders: Encoders of the found ffmpeg, or None if they could not be listed
+        opencv_version: Version of the OpenCV build
+        writer_codec: Fourcc of the first codec in ``PREFERRED_CODECS``
+            that opened a writer, or None if none did
+    """
+
+    def __init__(self, binaries: Dict[str, str], versions: Dict[str, str],
+                 encoders: Optional[List[str]], opencv_version: str,
+                 writer_codec: Optional[str]):
+        self.binaries = binaries
+        self.versions = versions
+        self.encoders = encoders
+        self.opencv_version = opencv_version
+        self.writer_codec = writer_codec
+
+    @classmethod
+    def detect(cls) -> "Capabilities":
+        """Discover the tools available now (runs subprocesses, blocking)"""
+        binaries = {}
+        versions = {}
+        for name in BINARIES:
+            path = shutil.which(name)
+            if path is None:
+                continue
+            output = _run([path, '-version'])
+            if output is None:
+                continue
+            binaries[name] = path
+            versions[name] = output.splitlines()[0] if output else ""
+
+        encoders = None
+        if 'ffmpeg' in binaries:
+            output = _run([binaries['ffmpeg'], '-hide_banner', '-encoders'])
+            if output is not None:
+                encoders = _parse_encoders(output)
+
+        return cls(binaries, versions, encoders, cv2.__version__, _find_writer_codec())
+
+    def has(self, binary: str) -> bool:
+        """Whether ``binary`` was found and runs"""
+        return binary in self.binaries
+
+    def can_encode(self, encoder: str) -> bool:
+        """
+        Whether ffmpeg can use ``encoder``.
+
+        When ffmpeg runs but its encoders could not be listed this assumes
+        it can, and leaves the error to the encode itself.
+        """
+        if not self.has('ffmpeg'):
+            return False
+        return self.encoders is None or encoder in self.encoders
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "binaries": {
+                name: {"path": self.binaries.get(name), "version": self.versions.get(name)}
+                for name in BINARIES
+            },
+            "encoders": sorted(self.encoders) if self.encoders is not None else None,
+            "opencv": {
+                "version": self.opencv_version,
+                "writer_codec": self.writer_codec,
+            },
+        }
+
+
+def get_capabilities() -> Capabilities:
+    """
+    The capabilities of this process, detected on first use.
+
+    Blocking on the first call; the workers and the API call it during
+    startup (through ``run_blocking``) so jobs only read the cache.
+    """
+    global _capabilities
+    if _capabilities is None:
+        with _lock:
+            if _capabilities is None:
+                capabilities = Capabilities.detect()
+                logger.info(
+                    f"Capabilities: {', '.join(capabilities.versions.values()) or 'no ffmpeg/ffprobe'}; "
+                    f"OpenCV {capabilities.opencv_version}, writer codec {capabilities.writer_codec}"
+                )
+                _capabilities = capabilities
+    return _capabilities
+
+
+def install(capabilities: Capabilities):
+    """
+    Use capabilities detected elsewhere, e.g. by the parent of a pool
+    process, instead of detecting them again
+    """
+    global _capabilities
+    with _lock:
+        _capabilities = capabilities
+
+
+def reset():
+    """Forget the detected capabilities, e.g. after the tool set changed in tests"""
+    global _capabilities
+    with _lock:
+        _capabilities = None
@@ -0,0 +1,63 @@
+"""
+Helpers for running blocking work off the asyncio event loop.
+"""
+import asyncio
+import functools
+import logging
+from concurrent.futures import Executor
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the progress stream
+_DONE = object()
+
+ProgressCallback = Callable[[int], Awaitable[Any]]
+
+
+async def run_blocking(func: Callable, *args, on_progress: Optional[ProgressCallback] = None,
+                       executor: Optional[Executor] = None) -> Any:
+    """
+    Run a blocking function in an executor without stalling the event loop.
+
+    When ``on_progress`` is given, ``func`` is called with an extra last
+    argument ``report(progress)``. ``report`` is thread-safe: each value is
+    handed back to the event loop and passed to ``on_progress`` there, in the
+    order reported. All progress callbacks have finished when this coroutine
+    returns.
+
+    Args:
+        func: Blocking callable
+        *args: Positional arguments for ``func``
+        on_progress: Optional coroutine function receiving progress values
+        executor: Executor to use (default: the loop's default thread pool)
+
+    Returns:
+        The return value of ``func``
+    """
+    loop = asyncio.get_running_loop()
+    if on_progress is None:
+        return await loop.run_in_executor(executor, functools.partial(func, *args))
+
+    progress_queue: asyncio.Queue = asyncio.Queue()
+
+    def report(progress: int):
+        loop.call_soon_threadsafe(progress_queue.put_nowait, progress)
+
+    async def forward_progress():
+        while True:
+            progress = await progress_queue.get()
+            if progress is _DONE:
+                return
+            try:
+                await on_progress(progress)
+            except Exception as e:
+                logger.error(f"Progress callback failed: {str(e)}")
+
+    forwarder = asyncio.create_task(forward_progress())
+    try:
+        return await loop.run_in_executor(executor, functools.partial(func, *args, report))
+    finally:
+        # Values reported before func returned are already queued ahead of this
+        progress_queue.put_nowait(_DONE)
+        await forwarder
@@ -0,0 +1,642 @@
+"""
+In-process message broker exposing the part of the aio_pika API used here.
+
+Selected with a ``memory://`` broker URL. Direct, fanout and topic
+exchanges, the default exchange, durable, exclusive and auto-delete
+queues, message priorities, prefetch limits, acknowledgements,
+requeueing, per-queue TTL and dead-lettering follow RabbitMQ's rules, so
+the API and the workers run unchanged in one process without AMQP framing
+or network round trips. Publishing is confirmed as soon as the message
+is routed.
+
+Everything lives in memory: messages are lost when the process exits and
+other processes cannot connect. Brokers are shared by URL, so every
+``memory://`` connection in a process reaches the same exchanges and
+queues.
+"""
+import heapq
+import asyncio
+import itertools
+import logging
+import uuid
+from collections import namedtuple
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import aio_pika
+from aio_pika.exceptions import (
+    ChannelInvalidStateError,
+    ChannelNotFoundEntity,
+    ChannelPreconditionFailed,
+    MessageProcessError,
+    QueueEmpty
+)
+from aio_pika.message import ProcessContext
+
+logger = logging.getLogger(__name__)
+
+MEMORY_SCHEME = "memory://"
+
+# Same shape as the broker's Queue.DeclareOk frame
+DeclareOk = namedtuple("DeclareOk", ["queue", "message_count", "consumer_count"])
+
+MessageCallback = Callable[["MemoryIncomingMessage"], Awaitable[Any]]
+
+
+def is_memory_url(url: Optional[str]) -> bool:
+    """Whether a broker URL selects the in-process broker"""
+    return isinstance(url, str) and url.startswith(MEMORY_SCHEME)
+
+
+def _topic_matches(pattern: str, routing_key: str) -> bool:
+    """Topic exchange matching: ``*`` is one word, ``#`` zero or more"""
+    def match(words: List[str], keys: List[str]) -> bool:
+        if not words:
+            return not keys
+        if words[0] == "#":
+            return any(match(words[1:], keys[i:]) for i in range(len(keys) + 1))
+        if not keys:
+            return False
+        return (words[0] == "*" or words[0] == keys[0]) and match(words[1:], keys[1:])
+    return match(pattern.split("."), routing_key.split("."))
+
+
+class _Envelope:
+    """A message as stored in a queue"""
+
+    PROPERTIES = (
+        "body", "content_type", "content_encoding", "headers", "delivery_mode", "priority",
+        "correlation_id", "reply_to", "expiration", "message_id", "timestamp", "type",
+        "user_id", "app_id"
+    )
+
+    def __init__(self, exchange: str, routing_key: str, redelivered: bool = False, **properties):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.redelivered = redelivered
+        for name in self.PROPERTIES:
+            setattr(self, name, properties.get(name))
+        self.headers = dict(self.headers or {})
+        self.body = bytes(self.body or b"")
+
+    @classmethod
+    def from_message(cls, message: aio_pika.Message, exchange: str, routing_key: str) -> "_Envelope":
+        return cls(exchange, routing_key, **{name: getattr(message, name, None) for name in cls.PROPERTIES})
+
+    def copy(self, **changes) -> "_Envelope":
+        fields = {name: getattr(self, name) for name in self.PROPERTIES}
+        fields.update(exchange=self.exchange, routing_key=self.routing_key, redelivered=self.redelivered)
+        fields.update(changes)
+        return _Envelope(**fields)
+
+
+class _Exchange:
+    def __init__(self, name: str, type: aio_pika.ExchangeType, durable: bool):
+        self.name = name
+        self.type = type
+        self.durable = durable
+        self.bindings: List[Tuple["_Queue", str]] = []
+
+    def matching_queues(self, routing_key: str) -> List["_Queue"]:
+        queues = []
+        for queue, binding_key in self.bindings:
+            if self.type == aio_pika.ExchangeType.FANOUT:
+                matched = True
+            elif self.type == aio_pika.ExchangeType.TOPIC:
+                matched = _topic_matches(binding_key, routing_key)
+            else:
+                matched = binding_key == routing_key
+            if matched and queue not in queues:
+                queues.append(queue)
+        return queues
+
+
+class _Consumer:
+    def __init__(self, tag: str, queue: "_Queue", channel: "MemoryChannel", callback: MessageCallback,
+                 no_ack: bool):
+        self.tag = tag
+        self.queue = queue
+        self.channel = channel
+        self.callback = callback
+        self.no_ack = no_ack
+        # basic.qos applies per consumer, to consumers created after it
+        self.prefetch_count = channel.prefetch_count
+        self.unacked = 0
+
+    def can_take(self) -> bool:
+        if self.channel.is_closed:
+            return False
+        return self.no_ack or self.prefetch_count == 0 or self.unacked < self.prefetch_count
+
+
+class _Queue:
+    def __init__(self, broker: "MemoryBroker", name: str, durable: bool, exclusive: bool, auto_delete: bool,
+                 arguments: Dict[str, Any], owner: "MemoryConnection"):
+        self.broker = broker
+        self.name = name
+        self.durable = durable
+        self.exclusive = exclusive
+        self.auto_delete = auto_delete
+        self.arguments = arguments
+        self.owner = owner
+        self.max_priority = int(arguments.get("x-max-priority") or 0)
+        ttl = arguments.get("x-message-ttl")
+        self.ttl = ttl / 1000 if ttl is not None else None
+        self.deleted = False
+        # Heap of (-priority, sequence, envelope): highest priority first, FIFO within a priority
+        self._ready: List[Tuple[int, int, _Envelope]] = []
+        self._consumers: List[_Consumer] = []
+        self._next_consumer = 0
+        self._had_consumers = False
+
+    @property
+    def message_count(self) -> int:
+        return len(self._ready)
+
+    @property
+    def consumer_count(self) -> int:
+        return len(self._consumers)
+
+    def put(self, envelope: _Envelope, sequence: Optional[int] = None):
+        """Enqueue a message; a requeued message keeps its original position"""
+        if self.deleted:
+            return
+        priority = min(max(envelope.priority or 0, 0), self.max_priority)
+        entry = (-priority, next(self.broker.sequence) if sequence is None else sequence, envelope)
+        heapq.heappush(self._ready, entry)
+        if self.ttl is not None:
+            asyncio.get_running_loop().call_later(self.ttl, self._expire, entry)
+        self.dispatch()
+
+    def take(self) -> Optional[Tuple[int, _Envelope]]:
+        if not self._ready:
+            return None
+        _, sequence, envelope = heapq.heappop(self._ready)
+        return sequence, envelope
+
+    def _expire(self, entry: Tuple[int, int, _Envelope]):
+        if entry not in self._ready:
+            return
+        self._ready.remove(entry)
+        heapq.heapify(self._ready)
+        self.dead_letter(entry[2], "expired")
+
+    def dead_letter(self, envelope: _Envelope, reason: str):
+        """Republish to the queue's dead-letter exchange, or drop the message"""
+        exchange = self.arguments.get("x-dead-letter-exchange")
+        if exchange is None:
+            return
+        routing_key = self.arguments.get("x-dead-letter-routing-key", envelope.routing_key)
+        deaths = [dict(death) for death in envelope.headers.get("x-death", [])]
+        for death in deaths:
+            if death.get("queue") == self.name and death.get("reason") == reason:
+                death["count"] = death.get("count", 1) + 1
+                deaths.remove(death)
+                deaths.insert(0, death)
+                break
+        else:
+            deaths.insert(0, {
+                "count": 1,
+                "reason": reason,
+                "queue": self.name,
+                "exchange": envelope.exchange,
+                "routing-keys": [envelope.routing_key],
+            })
+        self.broker.stats["dead_lettered"] += 1
+        try:
+            self.broker.route(exchange, routing_key, envelope.copy(
+                headers={**envelope.headers, "x-death": deaths},
+                exchange=exchange,
+                routing_key=routing_key,
+                redelivered=False
+            ))
+        except ChannelNotFoundEntity:
+            logger.warning(f"Dead-letter exchange '{exchange}' of queue {self.name} does not exist, message dropped")
+
+    def add_consumer(self, consumer: _Consumer):
+        self._consumers.append(consumer)
+        self._had_consumers = True
+        self.dispatch()
+
+    def remove_consumer(self, consumer: _Consumer):
+        if consumer in self._consumers:
+            self._consumers.remove(consumer)
+        if self.auto_delete and self._had_consumers and not self._consumers:
+            self.broker.delete_queue(self)
+
+    def _next_ready_consumer(self) -> Optional[_Consumer]:
+        for _ in range(len(self._consumers)):
+            self._next_consumer %= len(self._consumers)
+            consumer = self._consumers[self._next_consumer]
+            self._next_consumer += 1
+            if consumer.can_take():
+                return consumer
+        return None
+
+    def dispatch(self):
+        """Hand ready messages to consumers round-robin, within their prefetch limits"""
+        while self._ready and self._consumers:
+            consumer = self._next_ready_consumer()
+            if consumer is None:
+                return
+            sequence, envelope = self.take()
+            consumer.channel.deliver(consumer, self, sequence, envelope)
+
+
+class MemoryIncomingMessage:
+    """A delivered message with the IncomingMessage interface"""
+
+    def __init__(self, channel: "MemoryChannel", queue: _Queue, sequence: int, envelope: _Envelope,
+                 delivery_tag: int, consumer: Optional[_Consumer], no_ack: bool):
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        self.consumer_tag = consumer.tag if consumer is not None else None
+        self.exchange = envelope.exchange
+        self.routing_key = envelope.routing_key
+        self.redelivered = envelope.redelivered
+        for name in _Envelope.PROPERTIES:
+            setattr(self, name, getattr(envelope, name))
+        self.headers = dict(envelope.headers)
+        self._queue = queue
+        self._sequence = sequence
+        self._envelope = envelope
+        self._consumer = consumer
+        self._processed = no_ack
+
+    @property
+    def processed(self) -> bool:
+        return self._processed
+
+    def process(self, requeue: bool = False, reject_on_redelivered: bool = False,
+                ignore_processed: bool = False) -> ProcessContext:
+        """Acknowledge on success and reject on error, as IncomingMessage.process"""
+        return ProcessContext(
+            self,
+            requeue=requeue,
+            reject_on_redelivered=reject_on_redelivered,
+            ignore_processed=ignore_processed
+        )
+
+    def _settle(self) -> _Envelope:
+        if self._processed:
+            raise MessageProcessError("Message already processed", self)
+        if self.channel.is_closed:
+            raise ChannelInvalidStateError("Channel is closed")
+        self._processed = True
+        self.channel.forget(self)
+        return self._envelope
+
+    async def ack(self, multiple: bool = False):
+        """Acknowledge; with ``multiple`` also every earlier delivery on the channel"""
+        for message in self._with_earlier(multiple):
+            message._settle()
+            message._queue.dispatch()
+
+    async def nack(self, multiple: bool = False, requeue: bool = True):
+        for message in self._with_earlier(multiple):
+            envelope = message._settle()
+            if requeue:
+                message._queue.put(envelope.copy(redelivered=True), message._sequence)
+            else:
+                message._queue.dead_letter(envelope, "rejected")
+            message._queue.dispatch()
+
+    def _with_earlier(self, multiple: bool) -> List["MemoryIncomingMessage"]:
+        if not multiple or self._processed:
+            return [self]
+        return self.channel.unacked_up_to(self.delivery_tag)
+
+    async def reject(self, requeue: bool = False):
+        await self.nack(requeue=requeue)
+
+    def __repr__(self) -> str:
+        return f"<MemoryIncomingMessage {self._queue.name}#{self.delivery_tag}>"
+
+
+class MemoryExchange:
+    def __init__(self, channel: "MemoryChannel", name: str):
+        self.channel = channel
+        self.name = name
+
+    async def publish(self, message: aio_pika.Message, routing_key: str, *, mandatory: bool = True,
+                      immediate: bool = False, timeout: Optional[float] = None):
+        """Route a message to the bound queues; it is confirmed once routed"""
+        if self.channel.is_closed:
+            raise ChannelInvalidStateError("Channel is closed")
+        self.channel.broker.route(self.name, routing_key, _Envelope.from_message(message, self.name, routing_key))
+
+    def __repr__(self) -> str:
+        return f"<MemoryExchange {self.name or '(default)'}>"
+
+
+class MemoryQueue:
+    """A queue as seen through one channel"""
+
+    def __init__(self, channel: "MemoryChannel", queue: _Queue):
+        self.channel = channel
+        self._queue = queue
+        self.name = queue.name
+        self.durable = queue.durable
+        self.exclusive = queue.exclusive
+        self.auto_delete = queue.auto_delete
+        self.arguments = queue.arguments
+        self.declaration_result = DeclareOk(queue.name, queue.message_count, queue.consumer_count)
+
+    def _check(self):
+        if self.channel.is_closed:
+            raise ChannelInvalidStateError("Channel is closed")
+        if self._queue.deleted:
+            raise ChannelNotFoundEntity(f"no queue '{self.name}'")
+
+    async def bind(self, exchange, routing_key: Optional[str] = None, *, arguments=None, timeout=None):
+        self._check()
+        name = exchange if isinstance(exchange, str) else exchange.name
+        self.channel.broker.bind(self._queue, name, self.name if routing_key is None else routing_key)
+
+    async def unbind(self, exchange, routing_key: Optional[str] = None, arguments=None, timeout=None):
+        self._check()
+        name = exchange if isinstance(exchange, str) else exchange.name
+        self.channel.broker.unbind(self._queue, name, self.name if routing_key is None else routing_key)
+
+    async def consume(self, callback: MessageCallback, no_ack: bool = False, exclusive: bool = False,
+                      arguments=None, consumer_tag: Optional[str] = None, timeout=None) -> str:
+        """Deliver messages to ``callback``, each in its own task"""
+        self._check()
+        consumer = _Consumer(consumer_tag or f"ctag-{uuid.uuid4().hex}", self._queue, self.channel,
+                             callback, no_ack)
+        self.channel.consumers[consumer.tag] = consumer
+        self._queue.add_consumer(consumer)
+        return consumer.tag
+
+    async def cancel(self, consumer_tag: str, timeout=None, nowait: bool = False):
+        consumer = self.channel.consumers.pop(consumer_tag, None)
+        if consumer is not None:
+            consumer.queue.remove_consumer(consumer)
+
+    async def get(self, *, no_ack: bool = False, fail: bool = True,
+                  timeout: Optional[float] = 5) -> Optional[MemoryIncomingMessage]:
+        """Fetch one message, or None (or QueueEmpty) when the queue is empty"""
+        self._check()
+        taken = self._queue.take()
+        if taken is None:
+            if fail:
+                raise QueueEmpty()
+            return None
+        sequence, envelope = taken
+        return self.channel.track(self._queue, sequence, envelope, None, no_ack)
+
+    async def purge(self, no_wait: bool = False, timeout=None) -> int:
+        self._check()
+        count = self._queue.message_count
+        self._queue._ready.clear()
+        return count
+
+    async def delete(self, *, if_unused: bool = True, if_empty: bool = True, timeout=None):
+        self._check()
+        if if_unused and self._queue.consumer_count:
+            raise ChannelPreconditionFailed(f"queue '{self.name}' in use")
+        if if_empty and self._queue.message_count:
+            raise ChannelPreconditionFailed(f"queue '{self.name}' not empty")
+        self.channel.broker.delete_queue(self._queue)
+
+    def __repr__(self) -> str:
+        return f"<MemoryQueue {self.name}>"
+
+
+class MemoryChannel:
+    def __init__(self, connection: "MemoryConnection", number: int, publisher_confirms: bool = True):
+        self.connection = connection
+        self.broker = connection.broker
+        self.number = number
+        self.publisher_confirms = publisher_confirms
+        self.prefetch_count = 0
+        self.is_closed = False
+        self.consumers: Dict[str, _Consumer] = {}
+        self.default_exchange = MemoryExchange(self, "")
+        self._unacked: Dict[int, MemoryIncomingMessage] = {}
+        self._delivery_tags = itertools.count(1)
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _check(self):
+        if self.is_closed:
+            raise ChannelInvalidStateError("Channel is closed")
+
+    async def set_qos(self, prefetch_count: int = 0, prefetch_size: int = 0, global_: bool = False,
+                      timeout=None, all_channels=None):
+        self._check()
+        self.prefetch_count = prefetch_count
+
+    async def declare_exchange(self, name: str, type=aio_pika.ExchangeType.DIRECT, *, durable: bool = False,
+                               auto_delete: bool = False, internal: bool = False, passive: bool = False,
+                               arguments=None, timeout=None) -> MemoryExchange:
+        self._check()
+        self.broker.declare_exchange(name, aio_pika.ExchangeType(type), durable, passive)
+        return MemoryExchange(self, name)
+
+    async def get_exchange(self, name: str, *, ensure: bool = True) -> MemoryExchange:
+        self._check()
+        if ensure and name not in self.broker.exchanges:
+            raise ChannelNotFoundEntity(f"no exchange '{name}'")
+        return MemoryExchange(self, name)
+
+    async def declare_queue(self, name: Optional[str] = None, *, durable: bool = False, exclusive: bool = False,
+                            passive: bool = False, auto_delete: bool = False, arguments=None,
+                            timeout=None, robust: bool = True) -> MemoryQueue:
+        self._check()
+        queue = self.broker.declare_queue(
+            name, self.connection, durable, exclusive, auto_delete, dict(arguments or {}), passive
+        )
+        return MemoryQueue(self, queue)
+
+    async def get_queue(self, name: str, *, ensure: bool = True) -> MemoryQueue:
+        return await self.declare_queue(name, passive=True)
+
+    def track(self, queue: _Queue, sequence: int, envelope: _Envelope, consumer: Optional[_Consumer],
+              no_ack: bool) -> MemoryIncomingMessage:
+        message = MemoryIncomingMessage(
+            self, queue, sequence, envelope, next(self._delivery_tags), consumer, no_ack
+        )
+        if not no_ack:
+            self._unacked[message.delivery_tag] = message
+            if consumer is not None:
+                consumer.unacked += 1
+        return message
+
+    def unacked_up_to(self, delivery_tag: int) -> List[MemoryIncomingMessage]:
+        return [message for tag, message in sorted(self._unacked.items()) if tag <= delivery_tag]
+
+    def forget(self, message: MemoryIncomingMessage):
+        if self._unacked.pop(message.delivery_tag, None) is not None and message._consumer is not None:
+            message._consumer.unacked -= 1
+
+    def deliver(self, consumer: _Consumer, queue: _Queue, sequence: int, envelope: _Envelope):
+        message = self.track(queue, sequence, envelope, consumer, consumer.no_ack)
+        task = asyncio.get_running_loop().create_task(consumer.callback(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_callback_done)
+
+    def _on_callback_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Consumer callback failed: {task.exception()!r}")
+
+    async def close(self, exc=None):
+        """Close the channel; unacknowledged messages go back to their queues"""
+        if self.is_closed:
+            return
+        self.is_closed = True
+        for consumer in list(self.consumers.values()):
+            consumer.queue.remove_consumer(consumer)
+        self.consumers.clear()
+        unacked = sorted(self._unacked.values(), key=lambda message: message._sequence)
+        self._unacked.clear()
+        for message in unacked:
+            message._processed = True
+            message._queue.put(message._envelope.copy(redelivered=True), message._sequence)
+        self.connection.forget(self)
+
+    def __repr__(self) -> str:
+        return f"<MemoryChannel #{self.number}>"
+
+
+class MemoryConnection:
+    """Connection to an in-process broker"""
+
+    def __init__(self, broker: "MemoryBroker"):
+        self.broker = broker
+        self.is_closed = False
+        # Called with (connection, exc) when the connection closes
+        self.close_callbacks: Set[Callable] = set()
+        self._channels: List[MemoryChannel] = []
+        self._channel_numbers = itertools.count(1)
+
+    async def channel(self, channel_number: Optional[int] = None, publisher_confirms: bool = True,
+                      on_return_raises: bool = False) -> MemoryChannel:
+        if self.is_closed:
+            raise ChannelInvalidStateError("Connection is closed")
+        channel = MemoryChannel(self, channel_number or next(self._channel_numbers), publisher_confirms)
+        self._channels.append(channel)
+        return channel
+
+    def forget(self, channel: MemoryChannel):
+        if channel in self._channels:
+            self._channels.remove(channel)
+
+    async def close(self, exc=None):
+        """Close every channel and delete the exclusive queues of this connection"""
+        if self.is_closed:
+            return
+        self.is_closed = True
+        for channel in list(self._channels):
+            await channel.close()
+        for queue in list(self.broker.queues.values()):
+            if queue.exclusive and queue.owner is self:
+                self.broker.delete_queue(queue)
+        for callback in list(self.close_callbacks):
+            callback(self, exc)
+
+    async def __aenter__(self) -> "MemoryConnection":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class MemoryBroker:
+    """Exchanges and queues of one ``memory://`` URL"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.exchanges: Dict[str, _Exchange] = {}
+        self.queues: Dict[str, _Queue] = {}
+        self.sequence = itertools.count()
+        self.stats = {"published": 0, "unroutable": 0, "dead_lettered": 0}
+
+    def declare_exchange(self, name: str, type: aio_pika.ExchangeType, durable: bool, passive: bool = False):
+        if not name:
+            raise ChannelPreconditionFailed("the default exchange cannot be declared")
+        exchange = self.exchanges.get(name)
+        if exchange is None:
+            if passive:
+                raise ChannelNotFoundEntity(f"no exchange '{name}'")
+            if type not in (aio_pika.ExchangeType.DIRECT, aio_pika.ExchangeType.FANOUT,
+                            aio_pika.ExchangeType.TOPIC):
+                raise NotImplementedError(f"{type.value} exchanges are not supported by the in-memory broker")
+            self.exchanges[name] = _Exchange(name, type, durable)
+        elif not passive and (exchange.type != type or exchange.durable != durable):
+            raise ChannelPreconditionFailed(f"exchange '{name}' exists with different type or durability")
+
+    def declare_queue(self, name: Optional[str], owner: "MemoryConnection", durable: bool, exclusive: bool,
+                      auto_delete: bool, arguments: Dict[str, Any], passive: bool = False) -> _Queue:
+        name = name or f"amq.gen-{uuid.uuid4().hex}"
+        queue = self.queues.get(name)
+        if queue is None:
+            if passive:
+                raise ChannelNotFoundEntity(f"no queue '{name}'")
+            queue = _Queue(self, name, durable, exclusive, auto_delete, arguments, owner)
+            self.queues[name] = queue
+            return queue
+        if queue.exclusive and queue.owner is not owner:
+            raise ChannelPreconditionFailed(f"queue '{name}' is exclusive to another connection")
+        if not passive and (queue.durable != durable or queue.arguments != arguments):
+            raise ChannelPreconditionFailed(f"queue '{name}' exists with different durability or arguments")
+        return queue
+
+    def delete_queue(self, queue: _Queue):
+        queue.deleted = True
+        queue._ready.clear()
+        self.queues.pop(queue.name, None)
+        for exchange in self.exchanges.values():
+            exchange.bindings = [binding for binding in exchange.bindings if binding[0] is not queue]
+
+    def _exchange(self, name: str) -> _Exchange:
+        exchange = self.exchanges.get(name)
+        if exchange is None:
+            raise ChannelNotFoundEntity(f"no exchange '{name}'")
+        return exchange
+
+    def bind(self, queue: _Queue, exchange_name: str, routing_key: str):
+        exchange = self._exchange(exchange_name)
+        if (queue, routing_key) not in exchange.bindings:
+            exchange.bindings.append((queue, routing_key))
+
+    def unbind(self, queue: _Queue, exchange_name: str, routing_key: str):
+        exchange = self._exchange(exchange_name)
+        if (queue, routing_key) in exchange.bindings:
+            exchange.bindings.remove((queue, routing_key))
+
+    def route(self, exchange_name: str, routing_key: str, envelope: _Envelope) -> int:
+        """Put a copy of the message in every matching queue; returns the number of queues"""
+        if exchange_name == "":
+            # The default exchange routes to the queue named by the routing key
+            queue = self.queues.get(routing_key)
+            queues = [queue] if queue is not None else []
+        else:
+            queues = self._exchange(exchange_name).matching_queues(routing_key)
+        self.stats["published"] += 1
+        if not queues:
+            self.stats["unroutable"] += 1
+            logger.debug(f"Message to '{exchange_name}' with routing key '{routing_key}' was not routed")
+        for queue in queues:
+            queue.put(envelope.copy())
+        return len(queues)
+
+
+_brokers: Dict[str, MemoryBroker] = {}
+
+
+def get_broker(url: str = MEMORY_SCHEME) -> MemoryBroker:
+    """The broker for a ``memory://`` URL, created on first use"""
+    key = url[len(MEMORY_SCHEME):].strip("/") if is_memory_url(url) else url
+    if key not in _brokers:
+        _brokers[key] = MemoryBroker(url)
+    return _brokers[key]
+
+
+def reset():
+    """Forget every in-memory broker and its messages"""
+    _brokers.clear()
+
+
+async def connect(url: str = MEMORY_SCHEME) -> MemoryConnection:
+    """Open a connection to the in-process broker for ``url``"""
+    return MemoryConnection(get_broker(url))
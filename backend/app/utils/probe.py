@@ -0,0 +1,85 @@
+"""
+Probe-once ingest.
+
+The API runs a single ``ffprobe -show_format -show_streams`` on every
+upload, without blocking the event loop, and refuses files that ffprobe
+cannot read or that have no video stream. The probe result travels in
+the task message (``probe``), so the workers validate the file and read
+its streams and format from it instead of starting their own ffprobe
+processes. Tasks without a probe, e.g. when ffprobe is missing on the API
+host, are probed by the workers with ``probe_video`` as well.
+"""
+import logging
+from typing import Any, Dict, Optional
+
+from .capabilities import get_capabilities
+from .process import ProcessTimeout, run_json
+from ..config import PROBE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidVideo(Exception):
+    """ffprobe could not read the file, or it has no video stream"""
+
+
+def _first_stream(probe: Dict[str, Any], codec_type: str) -> Optional[Dict[str, Any]]:
+    for stream in probe.get("streams") or []:
+        if stream.get("codec_type") == codec_type:
+            return stream
+    return None
+
+
+def has_video_stream(probe: Dict[str, Any]) -> bool:
+    return _first_stream(probe, "video") is not None
+
+
+def video_stream_from_probe(probe: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """First video stream of a probe result, or None without one"""
+    return _first_stream(probe, "video")
+
+
+def audio_codec_from_probe(probe: Dict[str, Any]) -> Optional[str]:
+    """Codec name of the first audio stream, or None without audio"""
+    stream = _first_stream(probe, "audio")
+    return stream.get("codec_name") if stream else None
+
+
+async def probe_video(path: str, timeout: float = PROBE_TIMEOUT) -> Optional[Dict[str, Any]]:
+    """
+    Probe a video file once with ffprobe.
+
+    Returns:
+        dict: ffprobe's JSON output (``format`` and ``streams``), or None
+        when ffprobe is not installed, did not finish in time or printed
+        no readable JSON
+
+    Raises:
+        InvalidVideo: ffprobe rejected the file or found no video stream
+    """
+    capabilities = get_capabilities()
+    if not capabilities.has("ffprobe"):
+        return None
+
+    cmd = [
+        capabilities.binaries["ffprobe"],
+        "-v", "error",
+        "-print_format", "json",
+        "-show_format",
+        "-show_streams",
+        path
+    ]
+    try:
+        result = await run_json(cmd, timeout)
+    except (ProcessTimeout, OSError) as e:
+        logger.warning(f"Could not probe {path}: {str(e)}")
+        return None
+
+    if not result.ok:
+        raise InvalidVideo(f"FFprobe validation failed: {result.stderr.strip()}")
+    probe = result.data
+    if probe is None:
+        return None
+    if not has_video_stream(probe):
+        raise InvalidVideo("File does not contain a valid video stream")
+    return probe
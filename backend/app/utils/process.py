@@ -0,0 +1,145 @@
+"""
+Running ffmpeg and ffprobe without blocking the event loop.
+
+``run_process`` starts a command as an asyncio subprocess and reads its
+stdout and stderr while it runs. The process is killed when it exceeds its
+timeout and when the awaiting task is cancelled, so a stuck or abandoned
+ffprobe never outlives the job that started it. ``run_json`` decodes stdout
+incrementally as it arrives and parses it as JSON, for ffprobe's
+``-print_format json`` output.
+"""
+import json
+import codecs
+import asyncio
+import logging
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Read size for the output pipes
+_CHUNK_SIZE = 64 * 1024
+
+# Largest stdout kept from one command (ffprobe JSON is a few KB)
+MAX_OUTPUT_BYTES = 16 * 1024 * 1024
+
+
+class ProcessTimeout(Exception):
+    """The command did not finish within its timeout and was killed"""
+
+
+class ProcessResult:
+    """
+    Exit status and output of a finished command.
+
+    Attributes:
+        returncode: Exit status of the process
+        stdout: Decoded stdout (for ``run_json``, the raw text that was parsed)
+        stderr: Decoded stderr
+        data: Parsed JSON document (``run_json`` only, None if stdout was not JSON)
+    """
+
+    def __init__(self, returncode: int, stdout: str, stderr: str, data: Any = None):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.data = data
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+class _TextCollector:
+    """Decode UTF-8 chunks as they are read, keeping up to ``limit`` bytes"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.size = 0
+        self.truncated = False
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._parts: List[str] = []
+
+    def feed(self, chunk: bytes):
+        if self.size + len(chunk) > self.limit:
+            chunk = chunk[:max(0, self.limit - self.size)]
+            self.truncated = True
+        self.size += len(chunk)
+        if chunk:
+            self._parts.append(self._decoder.decode(chunk))
+
+    def text(self) -> str:
+        self._parts.append(self._decoder.decode(b"", final=True))
+        return "".join(self._parts)
+
+
+async def _drain(stream: asyncio.StreamReader, collector: _TextCollector):
+    while True:
+        chunk = await stream.read(_CHUNK_SIZE)
+        if not chunk:
+            return
+        # Past the limit the pipe is still read so the process cannot block on it
+        collector.feed(chunk)
+
+
+async def run_process(cmd: List[str], timeout: Optional[float],
+                      max_output: int = MAX_OUTPUT_BYTES) -> ProcessResult:
+    """
+    Run a command and collect its output.
+
+    Args:
+        cmd: Program and arguments
+        timeout: Seconds before the process is killed (None = no limit)
+        max_output: Bytes of stdout and of stderr kept; the rest is discarded
+
+    Returns:
+        ProcessResult: Exit status and decoded output
+
+    Raises:
+        ProcessTimeout: The process ran longer than ``timeout``
+        OSError: The program could not be started
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout = _TextCollector(max_output)
+    stderr = _TextCollector(max_output)
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(_drain(process.stdout, stdout), _drain(process.stderr, stderr), process.wait()),
+            timeout
+        )
+    except asyncio.TimeoutError:
+        raise ProcessTimeout(f"{cmd[0]} did not finish within {timeout}s")
+    finally:
+        # Timed out, cancelled or failed while reading: do not leave it running
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    if stdout.truncated:
+        logger.warning(f"Output of {cmd[0]} exceeded {max_output} bytes and was truncated")
+    return ProcessResult(process.returncode, stdout.text(), stderr.text())
+
+
+async def run_json(cmd: List[str], timeout: Optional[float],
+                   max_output: int = MAX_OUTPUT_BYTES) -> ProcessResult:
+    """
+    Run a command that prints a JSON document and parse it.
+
+    ``data`` of the result is the parsed document, or None if the command
+    failed or its output was not valid JSON.
+
+    Raises:
+        ProcessTimeout: The process ran longer than ``timeout``
+        OSError: The program could not be started
+    """
+    result = await run_process(cmd, timeout, max_output)
+    if result.ok:
+        try:
+            result.data = json.loads(result.stdout)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Unreadable JSON from {cmd[0]}: {str(e)}")
+    return result
@@ -1,14 +1,133 @@
 import aio_pika
-import json
+import os
 import time
+import uuid
+import zlib
+import socket
 import asyncio
 import logging
-from typing import Dict, Any, Callable
+from typing import Dict, Any, Callable, Iterable, List, Optional, Set
 
-from ..config import RABBITMQ_URL, RABBITMQ_RECONNECT_ATTEMPTS, RABBITMQ_RECONNECT_DELAY
+from . import broker
+from .codec import make_message, decode_body
+from .retry import ATTEMPTS_HEADER, LAST_ERROR_HEADER, FAILED_AT_HEADER, dead_letter_queue_name
+from ..config import (
+    RABBITMQ_URL,
+    RABBITMQ_RECONNECT_ATTEMPTS,
+    RABBITMQ_RECONNECT_DELAY,
+    PUBLISHER_CHANNELS,
+    PUBLISHER_MAX_IN_FLIGHT,
+    TASK_EXCHANGE,
+    TASK_MAX_PRIORITY,
+    PROCESSING_STAGES,
+    STATUS_BATCH_SIZE
+)
 
 logger = logging.getLogger(__name__)
 
+# Shared status queue used before every API process had its own
+LEGACY_STATUS_QUEUE = "status_updates_queue"
+
+# Per-stage task queues of the fanout exchange used before tasks were routed
+LEGACY_TASK_QUEUES = {stage: f"{stage}_queue" for stage in PROCESSING_STAGES}
+
+def task_queue_name(stage: str) -> str:
+    """Queue a stage's workers consume tasks from"""
+    return f"{stage}_priority_queue"
+
+def status_queue_name() -> str:
+    """Name of this process's status queue, unique per host and process"""
+    return f"status_updates.{socket.gethostname()}.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+
+class PublisherPool:
+    """
+    Pool of publisher-confirm channels.
+
+    ``publish`` hands the message to a channel and returns a task that
+    completes when the broker confirms it, so many messages can be in flight
+    and confirmed together instead of waiting one round trip per message.
+    Callers await the task only when they need the confirmation.
+
+    Messages with the same ``ordering_key`` always go through the same
+    channel and therefore reach the broker in publish order.
+    """
+
+    def __init__(self, connection, size: int = PUBLISHER_CHANNELS, max_in_flight: int = PUBLISHER_MAX_IN_FLIGHT):
+        self.connection = connection
+        self.size = max(1, size)
+        self._channels: List[Any] = []
+        self._exchanges: List[Dict[str, Any]] = []
+        self._next_channel = 0
+        self._in_flight = asyncio.Semaphore(max(1, max_in_flight))
+        self._pending: Set[asyncio.Task] = set()
+
+    async def open(self):
+        """Open the pool's channels"""
+        for _ in range(self.size):
+            self._channels.append(await self.connection.channel(publisher_confirms=True))
+            self._exchanges.append({})
+
+    def _pick_channel(self, ordering_key: Optional[str]) -> int:
+        if ordering_key is None:
+            index = self._next_channel
+            self._next_channel = (self._next_channel + 1) % self.size
+            return index
+        return zlib.crc32(ordering_key.encode()) % self.size
+
+    async def _get_exchange(self, index: int, exchange_name: str):
+        exchanges = self._exchanges[index]
+        if exchange_name not in exchanges:
+            # The exchange is declared elsewhere; this only binds it to the channel
+            exchanges[exchange_name] = await self._channels[index].get_exchange(exchange_name, ensure=False)
+        return exchanges[exchange_name]
+
+    async def publish(self, exchange_name: str, message: aio_pika.Message, routing_key: str = "",
+                      ordering_key: Optional[str] = None) -> asyncio.Task:
+        """
+        Start publishing a message.
+
+        Waits only when ``max_in_flight`` messages are already unconfirmed.
+
+        Returns:
+            asyncio.Task: Completes when the broker confirms the message
+        """
+        await self._in_flight.acquire()
+        try:
+            exchange = await self._get_exchange(self._pick_channel(ordering_key), exchange_name)
+        except Exception:
+            self._in_flight.release()
+            raise
+
+        confirm = asyncio.create_task(exchange.publish(message, routing_key=routing_key))
+        self._pending.add(confirm)
+        confirm.add_done_callback(self._on_confirmed)
+        return confirm
+
+    def _on_confirmed(self, confirm: asyncio.Task):
+        self._pending.discard(confirm)
+        self._in_flight.release()
+        if not confirm.cancelled() and confirm.exception() is not None:
+            logger.error(f"Publish was not confirmed: {str(confirm.exception())}")
+
+    @property
+    def in_flight(self) -> int:
+        """Number of published messages not confirmed yet"""
+        return len(self._pending)
+
+    async def flush(self):
+        """Wait until every message published so far is confirmed or failed"""
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+    async def close(self):
+        """Wait for outstanding confirms and close the channels"""
+        await self.flush()
+        for channel in self._channels:
+            if not channel.is_closed:
+                await channel.close()
+        self._channels.clear()
+        self._exchanges.clear()
+
 class RabbitMQClient:
     def __init__(self, url: str = RABBITMQ_URL):
         self.url = url
@@ -17,10 +136,12 @@ class RabbitMQClient:
         self.task_exchange = None
         self.status_exchange = None
         self.status_queue = None
+        self.publisher = None
         self._connecting = False
         self._connected = asyncio.Event()
         self._status_consumer_callback = None
         self._connection_closed_event = None
+        self._depth_channel = None
 
     async def connect(self):
         """
@@ -37,13 +158,18 @@ class RabbitMQClient:
         for attempt in range(1, RABBITMQ_RECONNECT_ATTEMPTS + 1):
             try:
                 logger.info(f"Connecting to RabbitMQ (attempt {attempt}/{RABBITMQ_RECONNECT_ATTEMPTS})...")
-                self.connection = await aio_pika.connect_robust(self.url)
+                self.connection = await broker.connect(self.url)
                 self.channel = await self.connection.channel()
+                # Bounds the status messages held while a batch is handled
+                await self.channel.set_qos(prefetch_count=STATUS_BATCH_SIZE * 2)
                 
-                # Create separate exchanges for tasks and status updates
+                # Create separate exchanges for tasks and status updates.
+                # Tasks are routed by stage name so each worker type only
+                # receives the work it does.
                 self.task_exchange = await self.channel.declare_exchange(
-                    "video_tasks",
-                    aio_pika.ExchangeType.FANOUT
+                    TASK_EXCHANGE,
+                    aio_pika.ExchangeType.DIRECT,
+                    durable=True
                 )
                 
                 self.status_exchange = await self.channel.declare_exchange(
@@ -51,12 +177,20 @@ class RabbitMQClient:
                     aio_pika.ExchangeType.FANOUT
                 )
                 
-                # Create status queue for the server to consume
+                # Every API process gets its own copy of each status update,
+                # so clients are reached whichever process holds their
+                # WebSocket. The queue goes away with the connection.
                 self.status_queue = await self.channel.declare_queue(
-                    "status_updates_queue", 
-                    durable=True
+                    status_queue_name(),
+                    exclusive=True,
+                    auto_delete=True
                 )
                 await self.status_queue.bind(self.status_exchange)
+                await self._retire_legacy_status_queue()
+                
+                # Channels used for publishing with batched confirms
+                self.publisher = PublisherPool(self.connection)
+                await self.publisher.open()
                 
                 # Set up connection closed callback using the newer approach
                 # Different versions of aio_pika have different ways to handle connection closed events
@@ -95,6 +229,80 @@ class RabbitMQClient:
                     self._connecting = False
                     raise
 
+    async def _retire_legacy_status_queue(self):
+        """Delete the old shared status queue once no older API process consumes it"""
+        channel = await self.connection.channel()
+        try:
+            queue = await channel.declare_queue(LEGACY_STATUS_QUEUE, passive=True)
+            await queue.delete(if_unused=True, if_empty=False)
+            logger.info(f"Deleted legacy status queue {LEGACY_STATUS_QUEUE}")
+        except Exception as e:
+            # Already gone, or an older API process still consumes from it
+            logger.debug(f"Legacy status queue not deleted: {str(e)}")
+        finally:
+            if not channel.is_closed:
+                await channel.close()
+
+    async def migrate_legacy_task_queues(self) -> Dict[str, int]:
+        """
+        Move tasks left in the old per-stage queues to the routed exchange.
+
+        Before tasks were routed, every worker type consumed a ``{stage}_queue``
+        bound to a fanout exchange; tasks still waiting there would never
+        reach the new priority queues. Each one is republished with its stage
+        as routing key and acknowledged after the broker confirmed it. A
+        legacy queue is deleted once it is empty and no older worker consumes
+        it; otherwise it is drained again on the next run.
+
+        Run once per upgrade with ``migrate_legacy_tasks.py`` rather than
+        from every API process, so processes do not drain the same queues.
+
+        Returns:
+            dict: Number of tasks moved per stage that still had a legacy queue
+        """
+        moved = {}
+        for stage, queue_name in LEGACY_TASK_QUEUES.items():
+            # A failed passive declare closes its channel, so each gets its own
+            channel = await self.connection.channel()
+            try:
+                try:
+                    queue = await channel.declare_queue(queue_name, passive=True, robust=False)
+                except aio_pika.exceptions.ChannelNotFoundEntity:
+                    continue
+                
+                # Without the stage queue the direct exchange would drop them
+                await self.create_queue(task_queue_name(stage), stage)
+                moved[stage] = 0
+                while True:
+                    message = await queue.get(no_ack=False, fail=False)
+                    if message is None:
+                        break
+                    await self.task_exchange.publish(
+                        aio_pika.Message(
+                            body=message.body,
+                            content_type=message.content_type,
+                            priority=message.priority,
+                            headers=message.headers or {},
+                            delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+                        ),
+                        routing_key=stage
+                    )
+                    await message.ack()
+                    moved[stage] += 1
+                if moved[stage]:
+                    logger.info(f"Moved {moved[stage]} tasks from legacy queue {queue_name} to stage {stage}")
+                
+                try:
+                    await queue.delete(if_unused=True, if_empty=True)
+                    logger.info(f"Deleted legacy task queue {queue_name}")
+                except Exception as e:
+                    # An older worker still consumes from it
+                    logger.debug(f"Legacy task queue {queue_name} not deleted: {str(e)}")
+            finally:
+                if not channel.is_closed:
+                    await channel.close()
+        return moved
+
     def _on_connection_closed(self, sender=None, exc=None):
         """Handle connection closed event"""
         if isinstance(exc, Exception):
@@ -119,23 +327,34 @@ class RabbitMQClient:
                 except:
                     pass
                 self._connection_closed_event = None
+            try:
+                # Closing on purpose must not trigger a reconnect
+                self.connection.close_callbacks.discard(self._on_connection_closed)
+            except AttributeError:
+                pass
                 
+            if self.publisher:
+                await self.publisher.close()
             await self.connection.close()
             logger.info("RabbitMQ connection closed")
 
-    async def publish_task(self, message: Dict[str, Any]):
-        """Publish a task message to the task exchange"""
+    async def publish_task(self, message: Dict[str, Any], stages: Optional[Iterable[str]] = None,
+                           priority: Optional[int] = None):
+        """Publish a task message to the task exchange, once per stage to run"""
         if not self.connection or self.connection.is_closed:
             await self.connect()
         
-        logger.info(f"Publishing task: {message}")
-        await self.task_exchange.publish(
-            aio_pika.Message(
-                body=json.dumps(message).encode(),
-                delivery_mode=aio_pika.DeliveryMode.PERSISTENT
-            ),
-            routing_key=""
-        )
+        stages = list(stages) if stages is not None else list(PROCESSING_STAGES)
+        logger.info(f"Publishing task for stages {stages}: {message}")
+        confirms = []
+        for stage in stages:
+            confirms.append(await self.publisher.publish(
+                TASK_EXCHANGE,
+                make_message(message, aio_pika.DeliveryMode.PERSISTENT, priority=priority),
+                routing_key=stage
+            ))
+        # The upload is only acknowledged once the broker has every task
+        await asyncio.gather(*confirms)
         
     async def start_consuming_status(self, callback: Callable):
         """Start consuming status messages"""
@@ -146,12 +365,110 @@ class RabbitMQClient:
         await self.status_queue.consume(callback)
         logger.info("Started consuming status messages")
 
-    async def create_queue(self, queue_name: str):
-        """Create and bind a queue to the task exchange"""
+    async def create_queue(self, queue_name: str, stage: str):
+        """Create a queue and bind it to the task exchange for one stage"""
+        if not self.connection or self.connection.is_closed:
+            await self.connect()
+        
+        queue = await self.channel.declare_queue(
+            queue_name,
+            durable=True,
+            arguments={"x-max-priority": TASK_MAX_PRIORITY}
+        )
+        await queue.bind(self.task_exchange, routing_key=stage)
+        logger.info(f"Created queue {queue_name} bound to stage {stage}")
+        return queue 
+
+    async def get_queue_depth(self, stage: str) -> Optional[int]:
+        """Number of tasks waiting in a stage's queue, or None if it does not exist yet"""
         if not self.connection or self.connection.is_closed:
             await self.connect()
         
-        queue = await self.channel.declare_queue(queue_name, durable=True)
-        await queue.bind(self.task_exchange)
-        logger.info(f"Created and bound queue: {queue_name}")
-        return queue 
\ No newline at end of file
+        # A failed passive declare closes its channel, so it gets its own
+        if self._depth_channel is None or self._depth_channel.is_closed:
+            self._depth_channel = await self.connection.channel()
+        try:
+            queue = await self._depth_channel.declare_queue(task_queue_name(stage), passive=True, robust=False)
+        except aio_pika.exceptions.ChannelNotFoundEntity:
+            return None
+        return queue.declaration_result.message_count
+
+    async def _get_dead_letter_messages(self, stage: str, limit: int) -> List[aio_pika.IncomingMessage]:
+        """Fetch up to limit messages from a dead-letter queue without acknowledging them"""
+        if not self.connection or self.connection.is_closed:
+            await self.connect()
+        
+        queue = await self.channel.declare_queue(dead_letter_queue_name(stage), durable=True)
+        messages = []
+        while len(messages) < limit:
+            message = await queue.get(no_ack=False, fail=False)
+            if message is None:
+                break
+            messages.append(message)
+        return messages
+
+    @staticmethod
+    def _describe_dead_letter(message: aio_pika.IncomingMessage) -> Dict[str, Any]:
+        headers = message.headers or {}
+        try:
+            task = decode_body(message.body, message.content_type)
+        except Exception:
+            task = None
+        return {
+            "file_id": task.get("file_id") if isinstance(task, dict) else None,
+            "attempts": headers.get(ATTEMPTS_HEADER, 0),
+            "last_error": headers.get(LAST_ERROR_HEADER),
+            "failed_at": headers.get(FAILED_AT_HEADER),
+            "task": task if task is not None else message.body[:200].decode("utf-8", errors="replace"),
+        }
+
+    async def get_dead_letters(self, stage: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Inspect dead-lettered tasks of a stage; they stay in the queue"""
+        messages = await self._get_dead_letter_messages(stage, limit)
+        try:
+            return [self._describe_dead_letter(message) for message in messages]
+        finally:
+            for message in messages:
+                await message.nack(requeue=True)
+
+    async def requeue_dead_letters(self, stage: str, limit: int = 50, file_id: Optional[str] = None) -> List[str]:
+        """
+        Send dead-lettered tasks back to their stage with a fresh attempt count.
+
+        Args:
+            stage: Stage whose dead-letter queue is read
+            limit: Maximum number of messages to look at
+            file_id: Only requeue tasks for this file
+
+        Returns:
+            list: File ids of the requeued tasks
+        """
+        messages = await self._get_dead_letter_messages(stage, limit)
+        requeued = []
+        try:
+            for message in messages:
+                description = self._describe_dead_letter(message)
+                if file_id is not None and description["file_id"] != file_id:
+                    continue
+                headers = {
+                    key: value for key, value in (message.headers or {}).items()
+                    if key not in (ATTEMPTS_HEADER, LAST_ERROR_HEADER, FAILED_AT_HEADER)
+                }
+                await self.task_exchange.publish(
+                    aio_pika.Message(
+                        body=message.body,
+                        content_type=message.content_type,
+                        priority=message.priority,
+                        headers=headers,
+                        delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+                    ),
+                    routing_key=stage
+                )
+                await message.ack()
+                requeued.append(description["file_id"])
+        finally:
+            for message in messages:
+                if not message.processed:
+                    await message.nack(requeue=True)
+        logger.info(f"Requeued {len(requeued)} dead-lettered {stage} tasks")
+        return requeued
@@ -0,0 +1,221 @@
+"""
+File responses with HTTP Range support.
+
+Serves single ranges, multiple ranges (multipart/byteranges) and suffix
+ranges with 206/416 semantics. When the ASGI server supports the
+``http.response.zerocopysend`` extension the file is handed to the server
+for ``sendfile``; otherwise it is read in large chunks off the event loop.
+
+uvicorn, which serves the API in the deployed configuration, does not
+offer that extension (and Starlette's ``FileResponse`` does not use
+``sendfile`` either), so there every request takes the chunked ``pread``
+path. Raise ``DOWNLOAD_CHUNK_SIZE`` rather than expecting zero-copy there.
+"""
+import os
+import secrets
+import logging
+from email.utils import formatdate
+from typing import List, Mapping, Optional, Tuple
+
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from .executor import run_blocking
+from ..config import DOWNLOAD_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# More ranges than this in one request are ignored and the full file is sent
+MAX_RANGES = 32
+
+ZERO_COPY_EXTENSION = "http.response.zerocopysend"
+
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested ranges overlap the file"""
+
+
+def parse_range_header(range_header: Optional[str], file_size: int) -> List[Tuple[int, int]]:
+    """
+    Parse a ``Range`` header into sorted, merged, inclusive byte ranges.
+
+    Returns an empty list when the header is missing, malformed or asks for
+    too many ranges; per RFC 9110 the whole file is served in that case.
+
+    Raises:
+        RangeNotSatisfiable: The header is valid but no range overlaps the file
+    """
+    if not range_header:
+        return []
+    unit, _, specs = range_header.strip().partition("=")
+    if unit.strip().lower() != "bytes" or not specs or specs.count(",") >= MAX_RANGES:
+        return []
+
+    ranges = []
+    for spec in specs.split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, sep, last = spec.partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+            return []
+
+        if first == "":
+            # Suffix range: the last N bytes
+            if last == "":
+                return []
+            length = int(last)
+            if length == 0 or file_size == 0:
+                # An empty file has no last bytes to send
+                continue
+            ranges.append((max(file_size - length, 0), file_size - 1))
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return []
+            if start >= file_size:
+                continue
+            end = min(int(last), file_size - 1) if last else file_size - 1
+            ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    # Overlapping or adjacent ranges are sent once
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeFileResponse(Response):
+    """
+    Serve a file honouring the request's ``Range`` and ``If-Range`` headers.
+
+    Args:
+        path: File to send
+        request_headers: Headers of the incoming request
+        media_type: Content type of the file
+        headers: Extra response headers
+        chunk_size: Read size when zero-copy sending is unavailable
+    """
+
+    def __init__(self, path: str, request_headers: Mapping[str, str], media_type: str,
+                 headers: Optional[Mapping[str, str]] = None, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+        self.path = path
+        self.media_type = media_type
+        self.chunk_size = chunk_size
+        self.background = None
+
+        stat_result = os.stat(path)
+        self.file_size = stat_result.st_size
+        etag = f'"{stat_result.st_mtime_ns:x}-{self.file_size:x}"'
+        last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if if_range and if_range.strip() not in (etag, last_modified):
+            # The client's copy is stale, send the current file in full
+            range_header = None
+
+        self.ranges: List[Tuple[int, int]] = []
+        self.boundary = None
+        self.status_code = 200
+        try:
+            self.ranges = parse_range_header(range_header, self.file_size)
+        except RangeNotSatisfiable:
+            self.status_code = 416
+
+        self.init_headers(headers)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["etag"] = etag
+        self.headers["last-modified"] = last_modified
+
+        if self.status_code == 416:
+            self.headers["content-range"] = f"bytes */{self.file_size}"
+            self.headers["content-length"] = "0"
+        elif len(self.ranges) == 1:
+            start, end = self.ranges[0]
+            self.status_code = 206
+            self.headers["content-type"] = media_type
+            self.headers["content-range"] = f"bytes {start}-{end}/{self.file_size}"
+            self.headers["content-length"] = str(end - start + 1)
+        elif self.ranges:
+            self.status_code = 206
+            self.boundary = secrets.token_hex(13)
+            self.headers["content-type"] = f"multipart/byteranges; boundary={self.boundary}"
+            self.headers["content-length"] = str(
+                sum(len(self._part_header(start, end)) + end - start + 1 + 2 for start, end in self.ranges)
+                + len(self._closing_boundary())
+            )
+        else:
+            self.headers["content-type"] = media_type
+            self.headers["content-length"] = str(self.file_size)
+
+    def _part_header(self, start: int, end: int) -> bytes:
+        return (
+            f"--{self.boundary}\r\n"
+            f"Content-Type: {self.media_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{self.file_size}\r\n\r\n"
+        ).encode("latin-1")
+
+    def _closing_boundary(self) -> bytes:
+        return f"--{self.boundary}--\r\n".encode("latin-1")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if scope.get("method") == "HEAD" or self.status_code == 416:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        zero_copy = ZERO_COPY_EXTENSION in scope.get("extensions", {})
+        ranges = self.ranges or [(0, self.file_size - 1)]
+        with open(self.path, "rb") as file:
+            if self.boundary is None:
+                start, end = ranges[0]
+                await self._send_range(send, file, start, end, zero_copy, more_body=False)
+                return
+
+            for start, end in ranges:
+                await send({"type": "http.response.body", "body": self._part_header(start, end), "more_body": True})
+                await self._send_range(send, file, start, end, zero_copy, more_body=True)
+                await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+            await send({"type": "http.response.body", "body": self._closing_boundary(), "more_body": False})
+
+    async def _send_range(self, send: Send, file, start: int, end: int, zero_copy: bool, more_body: bool):
+        """Send bytes start..end (inclusive) of the open file"""
+        count = end - start + 1
+        if count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": more_body})
+            return
+
+        if zero_copy:
+            # The server sends straight from the file descriptor (sendfile)
+            await send({
+                "type": ZERO_COPY_EXTENSION,
+                "file": file,
+                "offset": start,
+                "count": count,
+                "more_body": more_body,
+            })
+            return
+
+        fd = file.fileno()
+        offset = start
+        while count > 0:
+            chunk = await run_blocking(os.pread, fd, min(self.chunk_size, count), offset)
+            if not chunk:
+                raise RuntimeError(f"{self.path} shrank while it was being sent")
+            offset += len(chunk)
+            count -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body or count > 0})
@@ -0,0 +1,241 @@
+"""
+Content-addressed cache of processing results.
+
+The API hashes every upload while streaming it to disk. When a stage of
+an upload completes, its result is indexed under the content hash and
+``PIPELINE_VERSION``; a later upload with the same content gets the
+results of that stage by hard-linking the earlier files (enhanced video
+and thumbnail, metadata JSON) instead of being processed again. Bumping
+``PIPELINE_VERSION`` after a change to the processing retires all entries.
+
+The index lives in the processing state database, so every API process on
+a host shares it. An entry whose files have since been removed counts as
+a miss and is dropped.
+"""
+import os
+import glob
+import json
+import shutil
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..config import (
+    PROCESSING_STATES_DB,
+    PIPELINE_VERSION,
+    PROCESSED_DIR,
+    THUMBNAILS_DIR,
+    METADATA_DIR,
+    PROCESSING_STAGES
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Index from content hash and pipeline version to finished results.
+
+    Args:
+        db_path: SQLite database holding the index
+        version: Pipeline version results are recorded and looked up under
+        processed_dir: Directory of the enhanced videos
+        thumbnails_dir: Directory of the thumbnails
+        metadata_dir: Directory of the metadata JSON files
+    """
+
+    def __init__(self, db_path: str = PROCESSING_STATES_DB, version: str = PIPELINE_VERSION,
+                 processed_dir: str = PROCESSED_DIR, thumbnails_dir: str = THUMBNAILS_DIR,
+                 metadata_dir: str = METADATA_DIR):
+        self.db_path = db_path
+        self.version = version
+        self.processed_dir = processed_dir
+        self.thumbnails_dir = thumbnails_dir
+        self.metadata_dir = metadata_dir
+        self._lock = threading.Lock()
+        self.stats = {stage: {"hits": 0, "misses": 0} for stage in PROCESSING_STAGES}
+        self._conn = self._connect()
+        self._create_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _create_schema(self):
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS result_cache_uploads (
+                    file_id TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    pipeline_version TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS result_cache (
+                    content_hash TEXT NOT NULL,
+                    pipeline_version TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    PRIMARY KEY (content_hash, pipeline_version, stage)
+                );
+            """)
+
+    def record_upload(self, file_id: str, content_hash: str):
+        """Remember the content of an upload whose stages are being processed"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO result_cache_uploads VALUES (?, ?, ?, ?)",
+                (file_id, content_hash, self.version, datetime.utcnow().isoformat())
+            )
+
+    def record_completions(self, completions: Iterable[Tuple[str, str]]):
+        """
+        Index the results of completed ``(file_id, stage)`` pairs.
+
+        Files that were not recorded with ``record_upload`` (uploaded
+        before the cache existed, or served from it) are ignored.
+        """
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for file_id, stage in completions:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO result_cache "
+                        "SELECT content_hash, pipeline_version, ?, file_id, ? "
+                        "FROM result_cache_uploads WHERE file_id = ?",
+                        (stage, now, file_id)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _artifacts(self, file_id: str, stage: str) -> List[str]:
+        """Result files of a stage for a file, empty if the required ones are missing"""
+        if stage == "video_enhancement":
+            videos = [
+                path for path in glob.glob(os.path.join(self.processed_dir, f"{glob.escape(file_id)}_enhanced.*"))
+                if not path.endswith(".temp.mp4")
+            ]
+            if not videos:
+                return []
+            thumbnail = os.path.join(self.thumbnails_dir, f"{file_id}_thumbnail.jpg")
+            return videos[:1] + ([thumbnail] if os.path.exists(thumbnail) else [])
+        if stage == "metadata_extraction":
+            metadata = os.path.join(self.metadata_dir, f"{file_id}_metadata.json")
+            return [metadata] if os.path.exists(metadata) else []
+        return []
+
+    def lookup(self, content_hash: str, stage: str) -> Optional[str]:
+        """File id of earlier results of a stage for the same content, if they still exist"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id FROM result_cache WHERE content_hash = ? AND pipeline_version = ? AND stage = ?",
+                (content_hash, self.version, stage)
+            ).fetchone()
+            if row is None:
+                return None
+            if not self._artifacts(row["file_id"], stage):
+                logger.info(f"Cached {stage} result of {row['file_id']} is gone, dropping it")
+                self._conn.execute(
+                    "DELETE FROM result_cache WHERE content_hash = ? AND pipeline_version = ? AND stage = ?",
+                    (content_hash, self.version, stage)
+                )
+                return None
+            return row["file_id"]
+
+    def reuse_results(self, content_hash: str, file_id: str, stages: Iterable[str]) -> Dict[str, str]:
+        """
+        Give a new upload the earlier results of its stages where they exist.
+
+        Returns:
+            dict: File id whose results were reused, per stage served from the cache
+        """
+        reused = {}
+        for stage in stages:
+            source_file_id = self.lookup(content_hash, stage)
+            if source_file_id is not None and self.reuse(source_file_id, file_id, stage):
+                reused[stage] = source_file_id
+            with self._lock:
+                counts = self.stats.setdefault(stage, {"hits": 0, "misses": 0})
+                counts["hits" if stage in reused else "misses"] += 1
+        return reused
+
+    def reuse(self, source_file_id: str, file_id: str, stage: str) -> bool:
+        """
+        Give ``file_id`` the results of ``source_file_id`` for a stage.
+
+        Videos and thumbnails are hard-linked (copied where links are not
+        possible); the metadata JSON is rewritten with the new file id.
+
+        Returns:
+            bool: True if every result file is in place
+        """
+        artifacts = self._artifacts(source_file_id, stage)
+        if not artifacts:
+            return False
+        created = []
+        try:
+            for source in artifacts:
+                directory, name = os.path.split(source)
+                target = os.path.join(directory, file_id + name[len(source_file_id):])
+                if stage == "metadata_extraction":
+                    with open(source) as f:
+                        metadata = json.load(f)
+                    metadata["file_id"] = file_id
+                    if metadata.get("filename", "").startswith(source_file_id):
+                        metadata["filename"] = file_id + metadata["filename"][len(source_file_id):]
+                    with open(target, "w") as f:
+                        json.dump(metadata, f, indent=2)
+                else:
+                    try:
+                        os.link(source, target)
+                    except OSError:
+                        shutil.copy2(source, target)
+                created.append(target)
+        except Exception as e:
+            logger.warning(f"Could not reuse {stage} results of {source_file_id}: {str(e)}")
+            for path in created:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            return False
+        return True
+
+    def get_stats(self) -> Dict[str, object]:
+        """Hits, misses and hit rate, overall and per stage"""
+        with self._lock:
+            stages = {stage: dict(counts) for stage, counts in self.stats.items()}
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM result_cache WHERE pipeline_version = ?", (self.version,)
+            ).fetchone()[0]
+        for counts in stages.values():
+            lookups = counts["hits"] + counts["misses"]
+            counts["hit_rate"] = counts["hits"] / lookups if lookups else None
+        hits = sum(counts["hits"] for counts in stages.values())
+        lookups = hits + sum(counts["misses"] for counts in stages.values())
+        return {
+            "pipeline_version": self.version,
+            "entries": entries,
+            "hits": hits,
+            "misses": lookups - hits,
+            "hit_rate": hits / lookups if lookups else None,
+            "stages": stages,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Global cache instance
+result_cache = ResultCache()
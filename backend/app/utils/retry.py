@@ -0,0 +1,136 @@
+"""
+Retry with backoff and dead-lettering for task messages.
+
+A failed task is republished to a delay queue whose per-queue TTL holds it
+for the backoff time; when the TTL expires RabbitMQ dead-letters it back to
+the task exchange with the stage as routing key. There is one delay queue
+per backoff step, so every message in a queue expires in arrival order.
+The number of failed attempts travels in the ``x-attempts`` header. Once a
+task has failed ``max_attempts`` times, or cannot be decoded at all, it is
+moved to the stage's dead-letter queue for inspection.
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import aio_pika
+
+from ..config import (
+    TASK_EXCHANGE,
+    MAX_PROCESSING_ATTEMPTS,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY
+)
+
+logger = logging.getLogger(__name__)
+
+ATTEMPTS_HEADER = "x-attempts"
+LAST_ERROR_HEADER = "x-last-error"
+FAILED_AT_HEADER = "x-failed-at"
+
+# Headers are limited in size; long error messages are cut
+MAX_ERROR_LENGTH = 500
+
+
+def dead_letter_queue_name(stage: str) -> str:
+    return f"{stage}_dead_letter"
+
+
+def retry_queue_name(stage: str, delay: float) -> str:
+    return f"{stage}_retry_{int(delay)}s"
+
+
+class RetryPolicy:
+    """
+    Backoff schedule and delay/dead-letter queues for one stage.
+
+    Args:
+        stage: Stage name, also the routing key of its tasks
+        max_attempts: Attempts before a task is dead-lettered
+        base_delay: Delay in seconds after the first failure
+        max_delay: Upper bound for the delay
+    """
+
+    def __init__(self, stage: str, max_attempts: int = MAX_PROCESSING_ATTEMPTS,
+                 base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY):
+        self.stage = stage
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay_for(self, attempt: int) -> float:
+        """Seconds to wait after the given failed attempt (1-based)"""
+        return min(self.base_delay * (2 ** (attempt - 1)), self.max_delay)
+
+    def delays(self) -> List[float]:
+        """Distinct delays used by this policy, one delay queue each"""
+        return sorted({self.delay_for(attempt) for attempt in range(1, self.max_attempts)})
+
+    @staticmethod
+    def attempts(message) -> int:
+        """Failed attempts recorded on a message so far"""
+        try:
+            return int((message.headers or {}).get(ATTEMPTS_HEADER, 0))
+        except (TypeError, ValueError):
+            return 0
+
+    async def declare(self, channel):
+        """Declare the delay queues and the dead-letter queue"""
+        for delay in self.delays():
+            await channel.declare_queue(
+                retry_queue_name(self.stage, delay),
+                durable=True,
+                arguments={
+                    "x-message-ttl": int(delay * 1000),
+                    "x-dead-letter-exchange": TASK_EXCHANGE,
+                    "x-dead-letter-routing-key": self.stage,
+                }
+            )
+        await channel.declare_queue(dead_letter_queue_name(self.stage), durable=True)
+
+    def _copy(self, message, headers: Dict[str, Any]) -> aio_pika.Message:
+        return aio_pika.Message(
+            body=message.body,
+            content_type=message.content_type,
+            priority=message.priority,
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            headers={**(message.headers or {}), **headers}
+        )
+
+    async def retry_or_dead_letter(self, channel, message, error: str) -> Tuple[str, Optional[float], int]:
+        """
+        Count a failed attempt and schedule a retry, or dead-letter the task.
+
+        The copy is published (with confirms) before the caller acknowledges
+        the original, so the task is never lost.
+
+        Returns:
+            tuple: ("retry", delay, attempts) or ("dead_letter", None, attempts)
+        """
+        attempts = self.attempts(message) + 1
+        if attempts >= self.max_attempts:
+            await self.dead_letter(channel, message, error, attempts)
+            return "dead_letter", None, attempts
+
+        delay = self.delay_for(attempts)
+        await channel.default_exchange.publish(
+            self._copy(message, {
+                ATTEMPTS_HEADER: attempts,
+                LAST_ERROR_HEADER: error[:MAX_ERROR_LENGTH],
+            }),
+            routing_key=retry_queue_name(self.stage, delay)
+        )
+        logger.warning(f"{self.stage} attempt {attempts}/{self.max_attempts} failed, retrying in {delay:.0f}s: {error}")
+        return "retry", delay, attempts
+
+    async def dead_letter(self, channel, message, error: str, attempts: Optional[int] = None):
+        """Move a task to the dead-letter queue"""
+        await channel.default_exchange.publish(
+            self._copy(message, {
+                ATTEMPTS_HEADER: attempts if attempts is not None else self.attempts(message),
+                LAST_ERROR_HEADER: error[:MAX_ERROR_LENGTH],
+                FAILED_AT_HEADER: datetime.utcnow().isoformat(),
+            }),
+            routing_key=dead_letter_queue_name(self.stage)
+        )
+        logger.error(f"{self.stage} task moved to {dead_letter_queue_name(self.stage)}: {error}")
@@ -0,0 +1,184 @@
+"""
+Streaming multipart upload handling.
+
+The request body is parsed as it arrives and the file part is written to
+disk in fixed-size chunks, so an upload never has to fit in memory and an
+oversized upload is rejected as soon as it crosses the limit.
+"""
+import os
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+from .executor import run_blocking
+from ..config import UPLOAD_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Room for multipart boundaries, part headers and small form fields when
+# checking Content-Length against the file size limit
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class StreamedUpload:
+    """A file part that has been written to disk, with the SHA-256 of its content"""
+
+    def __init__(self, filename: str, filepath: str, content_type: str, size: int, sha256: str):
+        self.filename = filename
+        self.filepath = filepath
+        self.content_type = content_type
+        self.size = size
+        self.sha256 = sha256
+
+
+class _FilePartCollector:
+    """Multipart parser callbacks that pick out a single file field"""
+
+    def __init__(self, field_name: str, content_type_prefix: Optional[str]):
+        self.field_name = field_name
+        self.content_type_prefix = content_type_prefix
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self.found = False
+        self.finished = False
+        self._in_file = False
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_name = b""
+        self._header_value = b""
+        self._data: List[bytes] = []
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._in_file = False
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        if name != self.field_name or b"filename" not in options or self.found:
+            return
+
+        content_type = self._headers.get(b"content-type", b"").decode("latin-1")
+        if self.content_type_prefix and not content_type.startswith(self.content_type_prefix):
+            raise HTTPException(status_code=400, detail="File must be a video")
+
+        self.filename = options[b"filename"].decode("utf-8", errors="replace")
+        self.content_type = content_type
+        self.found = True
+        self._in_file = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._data.append(data[start:end])
+
+    def on_part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self.finished = True
+
+    def take_data(self) -> bytes:
+        """Return and clear the file data parsed so far"""
+        data = b"".join(self._data)
+        self._data.clear()
+        return data
+
+
+async def stream_upload(request: Request, upload_dir: str, file_id: str, max_bytes: int,
+                        field_name: str = "file", content_type_prefix: Optional[str] = "video/",
+                        chunk_size: int = UPLOAD_CHUNK_SIZE) -> StreamedUpload:
+    """
+    Stream the file field of a multipart request to ``upload_dir``.
+
+    The file is written to ``{file_id}.part`` while it arrives and renamed to
+    ``{file_id}{extension}`` once complete. The content is hashed as it is
+    written; disk writes and hashing run in a thread so the event loop is
+    never blocked. The partial file is removed on any failure.
+
+    Raises:
+        HTTPException: 400 for a malformed request or wrong content type,
+            413 as soon as the file grows past ``max_bytes``
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    # Reject uploads that announce their size up front without reading them
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_bytes + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"File exceeds the {max_bytes // (1024 * 1024)} MB limit")
+
+    collector = _FilePartCollector(field_name, content_type_prefix)
+    parser = MultipartParser(params[b"boundary"], collector.callbacks())
+    partial_path = os.path.join(upload_dir, f"{file_id}.part")
+    buffer = await run_blocking(open, partial_path, "wb")
+    digest = hashlib.sha256()
+    pending: List[bytes] = []
+    pending_size = 0
+    size = 0
+
+    def write(data: bytes):
+        digest.update(data)
+        buffer.write(data)
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            data = collector.take_data()
+            if not data:
+                continue
+
+            size += len(data)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"File exceeds the {max_bytes // (1024 * 1024)} MB limit")
+
+            pending.append(data)
+            pending_size += len(data)
+            if pending_size >= chunk_size:
+                await run_blocking(write, b"".join(pending))
+                pending.clear()
+                pending_size = 0
+
+        parser.finalize()
+        if not collector.finished:
+            raise HTTPException(status_code=400, detail=f"Missing file field '{field_name}'")
+        if pending:
+            await run_blocking(write, b"".join(pending))
+        await run_blocking(buffer.close)
+
+        filename = f"{file_id}{os.path.splitext(collector.filename)[1]}"
+        filepath = os.path.join(upload_dir, filename)
+        await run_blocking(os.replace, partial_path, filepath)
+    except BaseException:
+        # Includes client disconnects and cancellation
+        buffer.close()
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        logger.info(f"Discarded partial upload {partial_path} after {size} bytes")
+        raise
+
+    return StreamedUpload(filename, filepath, collector.content_type, size, digest.hexdigest())
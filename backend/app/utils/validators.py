@@ -3,9 +3,10 @@ Validation utilities for the video processing system.
 """
 import os
 import logging
-import subprocess
-from typing import Tuple, List
+from typing import Any, Dict, List, Optional, Tuple
 
+from .probe import InvalidVideo, has_video_stream, probe_video
+from .capabilities import get_capabilities
 from ..config import SUPPORTED_VIDEO_FORMATS, MAX_FILE_SIZE_MB
 
 logger = logging.getLogger('validators')
@@ -17,31 +18,19 @@ def check_ffprobe_availability() -> bool:
     Returns:
         bool: True if ffprobe is available, False otherwise
     """
-    try:
-        result = subprocess.run(
-            ["ffprobe", "-version"], 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE, 
-            text=True,
-            timeout=5
-        )
-        if result.returncode == 0:
-            logger.info(f"FFprobe available: {result.stdout.splitlines()[0]}")
-            return True
-        return False
-    except (subprocess.SubprocessError, FileNotFoundError):
-        logger.warning("FFprobe not found on system path")
-        return False
-    except Exception as e:
-        logger.warning(f"Error checking ffprobe availability: {str(e)}")
-        return False
+    return get_capabilities().has("ffprobe")
 
-def validate_video_file(file_path: str) -> Tuple[bool, str]:
+async def validate_video_file(file_path: str, probe: Optional[Dict[str, Any]] = None,
+                              use_ffprobe: bool = True) -> Tuple[bool, str]:
     """
     Validate a video file for processing.
     
     Args:
         file_path (str): Path to the video file
+        probe (dict, optional): ffprobe result from the upload; when given
+            it is used instead of running ffprobe again
+        use_ffprobe (bool): Check the file with ffprobe when no probe is
+            given; callers that probe the file themselves pass False
         
     Returns:
         Tuple[bool, str]: (is_valid, error_message)
@@ -64,28 +53,18 @@ def validate_video_file(file_path: str) -> Tuple[bool, str]:
     if extension.lower().lstrip('.') not in SUPPORTED_VIDEO_FORMATS:
         return False, f"Unsupported file format: {extension}. Supported formats: {', '.join(SUPPORTED_VIDEO_FORMATS)}"
     
+    if probe is not None:
+        if not has_video_stream(probe):
+            return False, "File does not contain a valid video stream"
+        return True, ""
+    
     # Try to verify file integrity using ffprobe
-    if check_ffprobe_availability():
+    if use_ffprobe and check_ffprobe_availability():
         try:
-            cmd = [
-                "ffprobe",
-                "-v", "error",
-                "-select_streams", "v:0",
-                "-show_entries", "stream=codec_type",
-                "-of", "default=noprint_wrappers=1:nokey=1",
-                file_path
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=15)
-            
-            if result.returncode != 0:
-                return False, f"FFprobe validation failed: {result.stderr.strip()}"
-            
-            if "video" not in result.stdout.strip():
-                return False, f"File does not contain a valid video stream"
-                
-        except subprocess.TimeoutExpired:
-            # Don't fail validation if ffprobe times out, just log a warning
-            logger.warning(f"FFprobe validation timed out for {file_path}")
+            # A timeout or unreadable output leaves the file valid
+            await probe_video(file_path, timeout=15)
+        except InvalidVideo as e:
+            return False, str(e)
         except Exception as e:
             logger.warning(f"Error during ffprobe validation: {str(e)}")
     
@@ -0,0 +1,110 @@
+"""
+Colour profile of a video from a fixed number of sampled frames.
+
+Frames are taken at ``samples`` evenly spaced positions across the video
+(the first frame of a video is often black), downscaled so their longest
+side is at most ``max_side`` pixels and stacked into one array. The channel
+histograms of the whole batch come from a single ``np.bincount`` and the
+average colour is derived from those histograms, so the cost depends on
+the number of samples, not on the length or resolution of the video.
+"""
+import logging
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from ..config import COLOR_PROFILE_SAMPLES, COLOR_PROFILE_SAMPLE_SIZE
+
+logger = logging.getLogger('color_profile')
+
+CHANNELS = ['b', 'g', 'r']
+
+# Bin offsets that give each channel its own 256 bins in one bincount
+_CHANNEL_OFFSETS = np.arange(len(CHANNELS), dtype=np.intp) * 256
+
+
+def sample_positions(frame_count: int, samples: int) -> List[int]:
+    """
+    Frame indices at the middle of ``samples`` equal parts of the video.
+
+    Returns:
+        List[int]: Distinct, increasing frame indices (``[0]`` when the
+        frame count is unknown)
+    """
+    if frame_count <= 0 or samples <= 0:
+        return [0]
+    samples = min(samples, frame_count)
+    return sorted({int((i + 0.5) * frame_count / samples) for i in range(samples)})
+
+
+def _downscale(frame: np.ndarray, max_side: int) -> np.ndarray:
+    height, width = frame.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return frame
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+def sample_frames(cap: cv2.VideoCapture, frame_count: int, samples: int = COLOR_PROFILE_SAMPLES,
+                  max_side: int = COLOR_PROFILE_SAMPLE_SIZE) -> Optional[np.ndarray]:
+    """
+    Read downscaled frames at evenly spaced positions.
+
+    Each position is reached with a seek, which the decoder serves from
+    the preceding keyframe, so reading a sample never decodes more than
+    one group of pictures.
+
+    Returns:
+        Optional[np.ndarray]: ``(n, height, width, 3)`` batch of BGR frames,
+        or None if no frame could be read
+    """
+    batch = []
+    for position in sample_positions(frame_count, samples):
+        if position > 0 and not cap.set(cv2.CAP_PROP_POS_FRAMES, position):
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            logger.debug(f"Could not read a sample at frame {position}")
+            continue
+        small = _downscale(frame, max_side)
+        if batch and small.shape != batch[0].shape:
+            continue
+        batch.append(small)
+    if not batch:
+        return None
+    return np.stack(batch)
+
+
+def compute_color_profile(frames: np.ndarray) -> Dict[str, Any]:
+    """
+    Normalised channel histograms and average colour of a batch of frames.
+
+    The histograms are L2-normalised per channel, like ``cv2.normalize``
+    with its defaults, and the average colour is truncated to integers.
+    """
+    pixels = frames.reshape(-1, len(CHANNELS))
+    counts = np.bincount(
+        (pixels + _CHANNEL_OFFSETS).ravel(),
+        minlength=256 * len(CHANNELS)
+    ).reshape(len(CHANNELS), 256).astype(np.float64)
+
+    averages = counts @ np.arange(256) / len(pixels)
+    norms = np.linalg.norm(counts, axis=1, keepdims=True)
+    histograms = counts / np.where(norms > 0, norms, 1)
+
+    return {
+        "histograms": {color: histograms[i].tolist() for i, color in enumerate(CHANNELS)},
+        "average_color": {color: int(averages[i]) for i, color in enumerate(CHANNELS)},
+        "sampled_frames": int(frames.shape[0]),
+    }
+
+
+def extract_color_profile(cap: cv2.VideoCapture, frame_count: int, samples: int = COLOR_PROFILE_SAMPLES,
+                          max_side: int = COLOR_PROFILE_SAMPLE_SIZE) -> Optional[Dict[str, Any]]:
+    """Colour profile of an opened video, or None if no frame could be read"""
+    frames = sample_frames(cap, frame_count, samples, max_side)
+    if frames is None:
+        return None
+    return compute_color_profile(frames)
@@ -0,0 +1,189 @@
+"""
+Video writer that streams raw frames into a single ffmpeg process.
+
+Enhanced BGR frames are written as ``rawvideo`` to ffmpeg's stdin and
+encoded once, straight into the final web-compatible H.264 MP4 (yuv420p,
+``+faststart``). The audio track is taken from the original upload, copied
+when MP4 can hold it and re-encoded to AAC otherwise. This replaces the
+OpenCV temp file plus the second ffmpeg conversion pass.
+"""
+import logging
+import subprocess
+import threading
+from collections import deque
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ..utils.capabilities import get_capabilities
+from ..utils.process import ProcessTimeout, run_process
+
+logger = logging.getLogger('ffmpeg_writer')
+
+# Audio codecs that can be stream-copied into an MP4 container
+MP4_COPYABLE_AUDIO_CODECS = {'aac', 'mp3', 'ac3', 'eac3', 'alac', 'opus'}
+
+
+async def probe_audio_codec(input_path: str, timeout: float = 15) -> Optional[str]:
+    """
+    Get the codec name of the first audio stream.
+
+    Returns:
+        Optional[str]: Codec name, or None if there is no audio stream or it
+        could not be probed
+    """
+    capabilities = get_capabilities()
+    if not capabilities.has("ffprobe"):
+        return None
+
+    cmd = [
+        capabilities.binaries["ffprobe"],
+        "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "stream=codec_name",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        input_path
+    ]
+    try:
+        result = await run_process(cmd, timeout)
+    except (ProcessTimeout, OSError) as e:
+        logger.warning(f"Could not probe audio of {input_path}: {str(e)}")
+        return None
+    if not result.ok:
+        return None
+    codec = result.stdout.strip().splitlines()
+    return codec[0].strip() if codec else None
+
+
+def build_ffmpeg_command(ffmpeg_path: str, output_path: str, fps: float,
+                         frame_size: Tuple[int, int],
+                         audio_source: Optional[str] = None,
+                         audio_codec: Optional[str] = None) -> List[str]:
+    """Build the ffmpeg command line for encoding piped BGR frames"""
+    width, height = frame_size
+    cmd = [
+        ffmpeg_path,
+        '-loglevel', 'error',
+        '-nostats',
+        '-f', 'rawvideo',
+        '-pix_fmt', 'bgr24',
+        '-s', f'{width}x{height}',
+        '-r', f'{fps}',
+        '-i', 'pipe:0',
+    ]
+    if audio_source:
+        cmd += ['-i', audio_source, '-map', '0:v:0', '-map', '1:a:0?']
+
+    cmd += [
+        '-c:v', 'libx264',     # H.264 video codec
+        '-preset', 'fast',     # Encoding speed/quality balance
+        '-crf', '22',          # Quality (lower is better, 18-28 is reasonable)
+        '-pix_fmt', 'yuv420p', # Chroma subsampling browsers can decode
+    ]
+    if audio_source:
+        if audio_codec in MP4_COPYABLE_AUDIO_CODECS:
+            cmd += ['-c:a', 'copy']
+        else:
+            cmd += ['-c:a', 'aac', '-b:a', '128k']
+        # Stop at the end of the video even if the audio runs longer
+        cmd += ['-shortest']
+
+    cmd += [
+        '-movflags', '+faststart',  # Optimize for web streaming
+        '-f', 'mp4',
+        '-y',
+        output_path
+    ]
+    return cmd
+
+
+class FFmpegPipeWriter:
+    """
+    ``cv2.VideoWriter``-like writer backed by an ffmpeg subprocess.
+
+    ``write`` may be called from any single thread. ``release`` closes the
+    pipe, waits for ffmpeg to finish and raises if encoding failed.
+    """
+
+    def __init__(self, output_path: str, fps: float, frame_size: Tuple[int, int],
+                 audio_source: Optional[str] = None, audio_codec: Optional[str] = None,
+                 finish_timeout: float = 300):
+        self.output_path = output_path
+        self.frame_size = frame_size
+        self.finish_timeout = finish_timeout
+        self._stderr_tail = deque(maxlen=20)
+        self._released = False
+
+        capabilities = get_capabilities()
+        if not capabilities.has('ffmpeg'):
+            raise RuntimeError("FFmpeg not found, cannot encode piped frames")
+
+        cmd = build_ffmpeg_command(capabilities.binaries['ffmpeg'], output_path, fps, frame_size,
+                                   audio_source, audio_codec)
+        logger.info(f"Starting FFmpeg encoder: {' '.join(cmd)}")
+        self.process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+        # Drain stderr so a chatty ffmpeg can never block on a full pipe
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, name="ffmpeg-stderr", daemon=True)
+        self._stderr_thread.start()
+
+    def _drain_stderr(self):
+        for line in iter(self.process.stderr.readline, b''):
+            self._stderr_tail.append(line.decode(errors='replace').rstrip())
+
+    def isOpened(self) -> bool:
+        return not self._released and self.process.poll() is None
+
+    def write(self, frame: np.ndarray):
+        """Write one BGR frame"""
+        height, width = frame.shape[:2]
+        if (width, height) != tuple(self.frame_size):
+            raise ValueError(f"Frame size {width}x{height} does not match writer size {self.frame_size}")
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except (BrokenPipeError, ValueError) as e:
+            raise IOError(f"FFmpeg encoder stopped accepting frames: {self.error_output() or str(e)}")
+
+    def error_output(self) -> str:
+        """Last lines ffmpeg wrote to stderr"""
+        return "\n".join(self._stderr_tail)
+
+    def release(self):
+        """
+        Finish encoding.
+
+        Raises:
+            RuntimeError: If ffmpeg exits with an error or does not finish in time
+        """
+        if self._released:
+            return
+        self._released = True
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            self.process.wait(timeout=self.finish_timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+            raise RuntimeError("FFmpeg encoder did not finish in time")
+        finally:
+            self._stderr_thread.join(timeout=5)
+
+        if self.process.returncode != 0:
+            raise RuntimeError(f"FFmpeg encoding failed: {self.error_output()}")
+        logger.info(f"FFmpeg encoder finished: {self.output_path}")
+
+    def abort(self):
+        """Stop ffmpeg without waiting for the output to be finished"""
+        if self._released:
+            return
+        self._released = True
+        self.process.kill()
+        self.process.wait()
+        self._stderr_thread.join(timeout=5)
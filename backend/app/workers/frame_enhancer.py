@@ -0,0 +1,101 @@
+"""
+Frame enhancement engine used by the video enhancement worker.
+
+The enhancement is a contrast/brightness adjustment followed by a 3x3
+sharpen. The engine keeps the sharpen kernel and all intermediate and output
+arrays around between calls, so processing a frame does not allocate
+anything once the first frame of a resolution has been seen.
+
+A 256-entry ``cv2.LUT`` mapping and the algebraic ``10 * I - box3x3(I)`` form
+of the sharpen produce identical output, but both measured slower than the
+vectorised ``convertScaleAbs``/``filter2D`` kernels (see
+``benchmark_enhancement.py``), so the engine uses the latter.
+"""
+import logging
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger('frame_enhancer')
+
+# Default enhancement parameters
+DEFAULT_ALPHA = 1.2  # Contrast control (1.0-3.0)
+DEFAULT_BETA = 10    # Brightness control (0-100)
+
+# Slight sharpening kernel
+SHARPEN_KERNEL = np.array([[-1, -1, -1],
+                           [-1,  9, -1],
+                           [-1, -1, -1]], dtype=np.float32)
+
+
+def enhance_frame_reference(frame: np.ndarray) -> np.ndarray:
+    """
+    Original per-frame enhancement, kept as the baseline the engine is
+    checked and benchmarked against.
+    """
+    # Unused float copy, kept so the baseline costs what the original did
+    frame_float = frame.astype(np.float32) / 255.0
+
+    # Apply contrast enhancement
+    enhanced = cv2.convertScaleAbs(frame, alpha=DEFAULT_ALPHA, beta=DEFAULT_BETA)
+
+    # Apply slight sharpening
+    kernel = np.array([[-1, -1, -1],
+                       [-1, 9, -1],
+                       [-1, -1, -1]])
+    return cv2.filter2D(enhanced, -1, kernel)
+
+
+class FrameEnhancer:
+    """
+    Frame enhancer with per-resolution buffers.
+
+    The array returned by ``enhance`` is owned by the enhancer and is
+    overwritten by the next call for the same resolution. Callers that need
+    to keep a frame around must either copy it or pass their own ``out``
+    buffer. An instance is not meant to be shared between threads; create one
+    enhancer per thread instead.
+    """
+
+    def __init__(self, alpha: float = DEFAULT_ALPHA, beta: float = DEFAULT_BETA):
+        self.alpha = alpha
+        self.beta = beta
+        self.kernel = SHARPEN_KERNEL
+        self._buffers: Dict[Tuple[int, ...], Dict[str, np.ndarray]] = {}
+
+    def _get_buffers(self, shape: Tuple[int, ...]) -> Dict[str, np.ndarray]:
+        """Get (or allocate) the working buffers for a frame shape"""
+        buffers = self._buffers.get(shape)
+        if buffers is None:
+            logger.info(f"Allocating enhancement buffers for frame shape {shape}")
+            buffers = {
+                "contrast": np.empty(shape, dtype=np.uint8),
+                "output": np.empty(shape, dtype=np.uint8),
+            }
+            self._buffers[shape] = buffers
+        return buffers
+
+    def enhance(self, frame: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Enhance a single frame.
+
+        Args:
+            frame: 8-bit frame (BGR or single channel)
+            out: Optional destination array with the same shape as ``frame``
+
+        Returns:
+            np.ndarray: The enhanced frame (``out`` if given, otherwise an
+            internal buffer that is reused by the next call)
+        """
+        buffers = self._get_buffers(frame.shape)
+        if out is None:
+            out = buffers["output"]
+
+        cv2.convertScaleAbs(frame, dst=buffers["contrast"], alpha=self.alpha, beta=self.beta)
+        cv2.filter2D(buffers["contrast"], -1, self.kernel, dst=out)
+        return out
+
+    def release(self):
+        """Drop all cached buffers"""
+        self._buffers.clear()
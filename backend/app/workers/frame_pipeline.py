@@ -0,0 +1,253 @@
+"""
+Threaded decode -> enhance -> write pipeline for the video enhancement worker.
+
+One decoder thread reads frames from a ``cv2.VideoCapture``, a pool of
+enhancement threads runs the frame enhancer on them and a single writer
+thread puts the frames back in order and hands them to the output writer.
+OpenCV releases the GIL while decoding, filtering and encoding, so the stages
+run on separate cores.
+
+Memory is bounded by ``max_frames_in_flight``: the decoder may only hold that
+many frame buffers at once and reuses a buffer once the writer is done with
+it.
+"""
+import time
+import queue
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .frame_enhancer import FrameEnhancer
+from ..utils.capabilities import PREFERRED_CODECS, get_capabilities
+
+logger = logging.getLogger('frame_pipeline')
+
+# How often blocked threads wake up to check whether the pipeline was stopped
+_POLL_INTERVAL = 0.1
+
+# Marks the end of the frame stream in the queues
+_END = None
+
+
+def open_video_writer(output_path: str, fps: float, frame_size: Tuple[int, int]) -> cv2.VideoWriter:
+    """
+    Create a video writer with the codec found to work at startup.
+
+    Only if that codec cannot open this file (e.g. another container) are
+    the other preferred codecs tried one by one.
+
+    Raises:
+        Exception: If no codec could open the output file
+    """
+    writer_codec = get_capabilities().writer_codec
+    codecs = PREFERRED_CODECS
+    if writer_codec is not None:
+        codecs = [writer_codec] + [codec for codec in PREFERRED_CODECS if codec != writer_codec]
+
+    for codec in codecs:
+        try:
+            fourcc = cv2.VideoWriter_fourcc(*codec)
+            out = cv2.VideoWriter(output_path, fourcc, fps, frame_size)
+
+            if out.isOpened():
+                logger.debug(f"Created video writer with codec: {codec}")
+                return out
+            else:
+                logger.warning(f"Failed to create video writer with codec: {codec}")
+        except Exception as e:
+            logger.warning(f"Error using codec {codec}: {str(e)}")
+
+    # Fallback to default codec as last resort
+    logger.warning("All preferred codecs failed, using default codec")
+    out = cv2.VideoWriter(output_path, 0, fps, frame_size)
+    if not out.isOpened():
+        raise Exception("Failed to create output video file with any codec")
+    return out
+
+
+class _PipelineStopped(Exception):
+    """Raised inside a stage thread when another stage has failed"""
+
+
+class FramePipeline:
+    """
+    Run the enhancement of a whole video across several threads.
+
+    Args:
+        capture: Opened ``cv2.VideoCapture`` to read frames from
+        writer: Object with a ``write(frame)`` method (e.g. ``cv2.VideoWriter``)
+        enhancer_threads: Number of enhancement threads
+        max_frames_in_flight: Maximum number of frames held by the pipeline
+        on_frame_written: Optional callback ``(index, frame)`` called from the
+            writer thread after each frame has been written. The frame buffer
+            is reused afterwards, so the callback must not keep it.
+        deadline: Optional ``time.time()`` value after which the pipeline
+            fails with ``TimeoutError``
+    """
+
+    def __init__(self, capture, writer, enhancer_threads: int = 2,
+                 max_frames_in_flight: int = 16,
+                 on_frame_written: Optional[Callable[[int, np.ndarray], Any]] = None,
+                 deadline: Optional[float] = None):
+        self.capture = capture
+        self.writer = writer
+        self.enhancer_threads = max(1, enhancer_threads)
+        # Every enhancer needs a frame to work on plus one being decoded/written
+        self.max_frames_in_flight = max(self.enhancer_threads + 2, max_frames_in_flight)
+        self.on_frame_written = on_frame_written
+        self.deadline = deadline
+
+        self._decoded = queue.Queue(maxsize=self.max_frames_in_flight)
+        self._enhanced = queue.Queue(maxsize=self.max_frames_in_flight)
+        self._free_buffers = queue.Queue()
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._error_lock = threading.Lock()
+        self.frames_written = 0
+
+    def _fail(self, error: BaseException):
+        """Record the first error and stop all stages"""
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+    def _put(self, target: queue.Queue, item):
+        """Put an item on a bounded queue, giving up if the pipeline stops"""
+        while True:
+            if self._stop.is_set():
+                raise _PipelineStopped()
+            try:
+                target.put(item, timeout=_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, source: queue.Queue):
+        """Get an item from a queue, giving up if the pipeline stops"""
+        while True:
+            if self._stop.is_set():
+                raise _PipelineStopped()
+            try:
+                return source.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+    def _decode(self):
+        """Decoder stage: read frames into recycled buffers"""
+        try:
+            allocated = 0
+            index = 0
+            while True:
+                if self.deadline is not None and time.time() > self.deadline:
+                    raise TimeoutError("Video enhancement timed out")
+
+                # Reuse a written frame's buffer once the in-flight limit is reached
+                if allocated < self.max_frames_in_flight:
+                    buffer = None
+                else:
+                    buffer = self._get(self._free_buffers)
+
+                ret, frame = self.capture.read(buffer) if buffer is not None else self.capture.read()
+                if not ret:
+                    break
+                if buffer is None:
+                    allocated += 1
+
+                self._put(self._decoded, (index, frame))
+                index += 1
+        except _PipelineStopped:
+            return
+        except BaseException as e:
+            self._fail(e)
+            return
+
+        try:
+            for _ in range(self.enhancer_threads):
+                self._put(self._decoded, _END)
+        except _PipelineStopped:
+            pass
+
+    def _enhance(self):
+        """Enhancement stage: enhance frames in place"""
+        enhancer = FrameEnhancer()
+        try:
+            while True:
+                item = self._get(self._decoded)
+                if item is _END:
+                    self._put(self._enhanced, _END)
+                    return
+                index, frame = item
+                # The enhancer reads from its own buffers, so writing back into
+                # the decoded frame is safe and avoids another allocation
+                enhancer.enhance(frame, out=frame)
+                self._put(self._enhanced, (index, frame))
+        except _PipelineStopped:
+            return
+        except BaseException as e:
+            self._fail(e)
+
+    def _write(self):
+        """Writer stage: write frames in their original order"""
+        try:
+            pending: Dict[int, np.ndarray] = {}
+            finished_enhancers = 0
+            next_index = 0
+            while finished_enhancers < self.enhancer_threads:
+                item = self._get(self._enhanced)
+                if item is _END:
+                    finished_enhancers += 1
+                    continue
+
+                index, frame = item
+                pending[index] = frame
+                while next_index in pending:
+                    frame = pending.pop(next_index)
+                    self.writer.write(frame)
+                    self.frames_written += 1
+                    if self.on_frame_written:
+                        self.on_frame_written(next_index, frame)
+                    self._free_buffers.put(frame)
+                    next_index += 1
+
+            if pending:
+                raise RuntimeError(f"Pipeline finished with {len(pending)} frames out of order")
+        except _PipelineStopped:
+            return
+        except BaseException as e:
+            self._fail(e)
+
+    def run(self) -> int:
+        """
+        Run the pipeline until all frames have been written.
+
+        Returns:
+            int: Number of frames written
+
+        Raises:
+            The first exception raised by any stage
+        """
+        threads = [threading.Thread(target=self._decode, name="frame-decoder", daemon=True)]
+        threads += [
+            threading.Thread(target=self._enhance, name=f"frame-enhancer-{i}", daemon=True)
+            for i in range(self.enhancer_threads)
+        ]
+        threads.append(threading.Thread(target=self._write, name="frame-writer", daemon=True))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+        logger.info(f"Pipeline wrote {self.frames_written} frames using {self.enhancer_threads} enhancer threads")
+        return self.frames_written
+
+    def stop(self):
+        """Ask all stages to stop as soon as possible"""
+        self._fail(RuntimeError("Frame pipeline was stopped"))
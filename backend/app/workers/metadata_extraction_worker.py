@@ -3,14 +3,29 @@ import aio_pika
 import json
 import os
 import cv2
-import subprocess
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Callable, Optional, Tuple
 import logging
 from datetime import datetime
 
-from ..config import METADATA_DIR, RABBITMQ_URL, PROCESSING_TIMEOUT
+from ..config import (
+    METADATA_DIR,
+    RABBITMQ_URL,
+    TASK_EXCHANGE,
+    TASK_MAX_PRIORITY,
+    PROCESSING_TIMEOUT,
+    MAX_PROCESSING_ATTEMPTS,
+    WORKER_CONCURRENCY
+)
 from ..utils.validators import check_ffprobe_availability, validate_video_file
+from ..utils.executor import run_blocking
+from ..utils.probe import InvalidVideo, probe_video
+from ..utils import broker
+from ..utils.rabbitmq import PublisherPool, task_queue_name
+from ..utils.codec import decode_body
+from ..utils.retry import RetryPolicy
+from .progress_reporter import ProgressReporter, publish_status
+from .color_profile import extract_color_profile
 
 # Configure logging
 logging.basicConfig(
@@ -20,13 +35,19 @@ logging.basicConfig(
 logger = logging.getLogger('metadata_extraction_worker')
 
 class MetadataExtractionWorker:
-    def __init__(self, rabbitmq_url: str = RABBITMQ_URL):
+    def __init__(self, rabbitmq_url: str = RABBITMQ_URL, concurrency: int = WORKER_CONCURRENCY):
         self.rabbitmq_url = rabbitmq_url
+        self.concurrency = max(1, concurrency)
+        # Caps the number of jobs processed at once by this worker
+        self._job_slots = asyncio.Semaphore(self.concurrency)
         self.connection = None
         self.channel = None
         self.queue = None
         self.task_exchange = None
         self.status_exchange = None
+        self.publisher = None
+        self.retry_policy = RetryPolicy("metadata_extraction", MAX_PROCESSING_ATTEMPTS)
+        self.progress_reporter = ProgressReporter("metadata_extraction_status", self._publish_status)
         self.metadata_dir = METADATA_DIR
         self.ffprobe_available = False
         os.makedirs(self.metadata_dir, exist_ok=True)
@@ -34,20 +55,24 @@ class MetadataExtractionWorker:
     async def startup(self):
         """Run startup checks and initialization"""
         # Check if ffprobe is available
-        self.ffprobe_available = check_ffprobe_availability()
+        self.ffprobe_available = await run_blocking(check_ffprobe_availability)
         if not self.ffprobe_available:
             logger.warning("FFprobe not available - advanced metadata extraction will be limited")
 
     async def connect(self):
         """Establish connection to RabbitMQ"""
         try:
-            self.connection = await aio_pika.connect_robust(self.rabbitmq_url)
+            self.connection = await broker.connect(self.rabbitmq_url)
             self.channel = await self.connection.channel()
+            # Only take as many unacknowledged jobs as we can process at once,
+            # so the broker spreads the rest across other workers
+            await self.channel.set_qos(prefetch_count=self.concurrency)
             
             # Create separate exchanges for tasks and status updates
             self.task_exchange = await self.channel.declare_exchange(
-                "video_tasks",
-                aio_pika.ExchangeType.FANOUT
+                TASK_EXCHANGE,
+                aio_pika.ExchangeType.DIRECT,
+                durable=True
             )
             
             self.status_exchange = await self.channel.declare_exchange(
@@ -55,12 +80,23 @@ class MetadataExtractionWorker:
                 aio_pika.ExchangeType.FANOUT
             )
             
-            # Bind only to the task exchange with a unique queue name
+            # Bind to the task exchange for this stage's tasks only
+            # Priority queue so short or interactive jobs are served first.
+            # A new name is used because RabbitMQ cannot add x-max-priority
+            # to the existing queue.
             self.queue = await self.channel.declare_queue(
-                "metadata_extraction_queue",
-                durable=True
+                task_queue_name("metadata_extraction"),
+                durable=True,
+                arguments={"x-max-priority": TASK_MAX_PRIORITY}
             )
-            await self.queue.bind(self.task_exchange)
+            await self.queue.bind(self.task_exchange, routing_key="metadata_extraction")
+            
+            # Delay queues for retries with backoff, and the dead-letter queue
+            await self.retry_policy.declare(self.channel)
+            
+            # Status updates go out through a pool of confirm channels
+            self.publisher = PublisherPool(self.connection)
+            await self.publisher.open()
             logger.info("Connected to RabbitMQ")
         except Exception as e:
             logger.error(f"Failed to connect to RabbitMQ: {str(e)}")
@@ -68,13 +104,16 @@ class MetadataExtractionWorker:
 
     async def close(self):
         """Close RabbitMQ connection"""
+        self.progress_reporter.close()
+        if self.publisher:
+            await self.publisher.close()
+            self.publisher = None
         if self.connection:
             await self.connection.close()
             logger.info("RabbitMQ connection closed")
 
     async def extract_metadata(self, message: Dict[str, Any]) -> Dict[str, Any]:
         """Extract metadata from the video file"""
-        start_time = time.time()
         try:
             file_id = message["file_id"]
             input_path = message["filepath"]
@@ -82,71 +121,51 @@ class MetadataExtractionWorker:
                 self.metadata_dir,
                 f"{file_id}_metadata.json"
             )
-
-            # Validate the video file
-            is_valid, error_message = validate_video_file(input_path)
-            if not is_valid:
-                raise ValueError(f"Invalid video file: {error_message}")
-
-            # Open video file
-            cap = cv2.VideoCapture(input_path)
-            if not cap.isOpened():
-                raise Exception("Failed to open video file")
-
-            # Extract basic video properties
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            duration = frame_count / fps if fps > 0 else 0
+            start_time = time.time()
             
-            metadata = {
-                "file_id": file_id,
-                "filename": os.path.basename(input_path),
-                "format": os.path.splitext(input_path)[1][1:],
-                "resolution": {
-                    "width": width,
-                    "height": height
-                },
-                "fps": fps,
-                "frame_count": frame_count,
-                "duration_seconds": int(duration)
-            }
+            async def send_progress(progress):
+                await self.update_status(file_id, "processing", progress)
             
-            # Update progress
-            await self.update_status(file_id, "processing", 30)
+            # Probed once at upload; older tasks and API hosts without ffprobe
+            # leave it out and the file is probed here
+            probe = message.get("probe")
             
-            # Check processing timeout
-            if time.time() - start_time > PROCESSING_TIMEOUT:
-                raise TimeoutError("Metadata extraction timed out")
+            # Validate the video file (the ffprobe check is the probe below)
+            is_valid, error_message = await validate_video_file(input_path, probe, use_ffprobe=False)
+            if not is_valid:
+                raise ValueError(f"Invalid video file: {error_message}")
             
-            # Additional metadata using ffprobe (if available)
-            if self.ffprobe_available:
-                try:
-                    cmd = [
-                        "ffprobe",
-                        "-v", "quiet",
-                        "-print_format", "json",
-                        "-show_format",
-                        "-show_streams",
-                        input_path
-                    ]
-                    result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-                    if result.returncode == 0:
-                        ffprobe_data = json.loads(result.stdout)
-                        metadata["advanced"] = ffprobe_data
-                        
-                        # Extract more user-friendly metadata from ffprobe output
-                        if "format" in ffprobe_data:
-                            metadata["file_size_bytes"] = int(ffprobe_data["format"].get("size", 0))
-                            metadata["bit_rate"] = ffprobe_data["format"].get("bit_rate")
-                        
-                        # Update progress
-                        await self.update_status(file_id, "processing", 70)
-                except subprocess.TimeoutExpired:
-                    logger.warning(f"ffprobe timed out for file {file_id}")
-                except Exception as e:
-                    logger.warning(f"Could not extract advanced metadata: {str(e)}")
+            # OpenCV reads the video in a thread while ffprobe runs as a subprocess
+            read_video = run_blocking(
+                self._read_video_blocking,
+                file_id,
+                input_path,
+                start_time,
+                on_progress=send_progress
+            )
+            if probe is None and self.ffprobe_available:
+                # Both finish before any error is raised, so no progress
+                # is reported after the job has failed
+                video_result, probe = await asyncio.gather(
+                    read_video, probe_video(input_path, timeout=60), return_exceptions=True
+                )
+                if isinstance(probe, InvalidVideo):
+                    raise ValueError(f"Invalid video file: {str(probe)}")
+                if isinstance(video_result, BaseException):
+                    raise video_result
+                if isinstance(probe, BaseException):
+                    logger.warning(f"Could not extract advanced metadata: {str(probe)}")
+                    probe = None
+            else:
+                video_result = await read_video
+            metadata, color_profile = video_result
+            
+            # Additional metadata from ffprobe (if available)
+            if probe is not None:
+                metadata["advanced"] = probe
+                if "format" in probe:
+                    metadata["file_size_bytes"] = int(probe["format"].get("size", 0))
+                    metadata["bit_rate"] = probe["format"].get("bit_rate")
             else:
                 logger.info("Skipping ffprobe metadata extraction (not available)")
                 
@@ -155,45 +174,11 @@ class MetadataExtractionWorker:
                     metadata["file_size_bytes"] = os.path.getsize(input_path)
                 except Exception as e:
                     logger.warning(f"Could not get file size: {str(e)}")
+            if color_profile is not None:
+                metadata["color_profile"] = color_profile
             
-            # Check processing timeout again
-            if time.time() - start_time > PROCESSING_TIMEOUT:
-                raise TimeoutError("Metadata extraction timed out")
-            
-            # Calculate color histogram (sample from first frame)
-            ret, frame = cap.read()
-            if ret:
-                # Calculate color histograms (normalized)
-                histograms = {}
-                for i, color in enumerate(['b', 'g', 'r']):
-                    hist = cv2.calcHist([frame], [i], None, [256], [0, 256])
-                    hist = cv2.normalize(hist, hist).flatten().tolist()
-                    histograms[color] = hist
-                
-                # Add dominant color detection
-                pixels = frame.reshape(-1, 3)
-                
-                # Simple approach: take average color
-                average_color = pixels.mean(axis=0).astype(int).tolist()
-                metadata["color_profile"] = {
-                    "histograms": histograms,
-                    "average_color": {
-                        "b": average_color[0],
-                        "g": average_color[1],
-                        "r": average_color[2]
-                    }
-                }
-            
-            # Release resources
-            cap.release()
-            
-            # Save metadata to file
-            try:
-                with open(output_path, 'w') as f:
-                    json.dump(metadata, f, indent=2)
-            except Exception as e:
-                logger.error(f"Failed to save metadata to file: {str(e)}")
-                # Continue anyway - we'll return the metadata even if we can't save it
+            await self.update_status(file_id, "processing", 70)
+            await run_blocking(self._save_metadata, output_path, metadata)
             
             # Update progress
             await self.update_status(file_id, "processing", 100)
@@ -223,33 +208,79 @@ class MetadataExtractionWorker:
                 "processed_at": datetime.utcnow().isoformat()
             }
 
+    def _read_video_blocking(self, file_id: str, input_path: str, start_time: float,
+                             report_progress: Callable[[int], None]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """
+        Read the video properties and colour profile with OpenCV (blocking, runs in an executor).
+
+        Returns:
+            Tuple[Dict[str, Any], Optional[Dict[str, Any]]]: (basic metadata, colour profile or None)
+        """
+        # Open video file
+        cap = cv2.VideoCapture(input_path)
+        try:
+            if not cap.isOpened():
+                raise Exception("Failed to open video file")
+
+            # Extract basic video properties
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            duration = frame_count / fps if fps > 0 else 0
+            
+            metadata = {
+                "file_id": file_id,
+                "filename": os.path.basename(input_path),
+                "format": os.path.splitext(input_path)[1][1:],
+                "resolution": {
+                    "width": width,
+                    "height": height
+                },
+                "fps": fps,
+                "frame_count": frame_count,
+                "duration_seconds": int(duration)
+            }
+            
+            # Update progress
+            report_progress(30)
+            
+            # Check processing timeout
+            if time.time() - start_time > PROCESSING_TIMEOUT:
+                raise TimeoutError("Metadata extraction timed out")
+            
+            # Colour profile from frames sampled across the whole video
+            color_profile = extract_color_profile(cap, frame_count)
+        finally:
+            # Release resources
+            cap.release()
+        
+        return metadata, color_profile
+
+    def _save_metadata(self, output_path: str, metadata: Dict[str, Any]):
+        """Write the metadata JSON file (blocking)"""
+        try:
+            with open(output_path, 'w') as f:
+                json.dump(metadata, f, indent=2)
+        except Exception as e:
+            logger.error(f"Failed to save metadata to file: {str(e)}")
+            # Continue anyway - we'll return the metadata even if we can't save it
+
     async def update_status(self, file_id: str, status: str, progress: int = 0, error: str = None):
         """Update processing status via RabbitMQ"""
-        status_message = {
-            "type": "metadata_extraction_status",
-            "file_id": file_id,
-            "status": status,
-            "progress": progress,
-            "error": error,
-            "timestamp": datetime.utcnow().isoformat()
-        }
+        await self.progress_reporter.report(file_id, status, progress, error)
+
+    async def _publish_status(self, status_message: Dict[str, Any], persistent: bool):
         # Publish to status exchange, not task exchange
-        try:
-            await self.status_exchange.publish(
-                aio_pika.Message(
-                    body=json.dumps(status_message).encode(),
-                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT
-                ),
-                routing_key=""
-            )
-        except Exception as e:
-            logger.error(f"Failed to publish status update: {str(e)}")
+        await publish_status(self.publisher, self.status_exchange, status_message, persistent)
 
     async def process_message(self, message: aio_pika.IncomingMessage):
         """Process incoming message from queue"""
-        async with message.process():
+        # Requeue if handling escapes with an error; the redelivery then
+        # counts as a failed attempt below
+        async with self._job_slots, message.process(requeue=True):
             try:
-                data = json.loads(message.body.decode())
+                data = decode_body(message.body, message.content_type)
                 logger.info(f"Received message: {data}")
                 
                 # Validate message structure
@@ -263,6 +294,12 @@ class MetadataExtractionWorker:
                     raise ValueError("Message must contain 'filepath'")
                 
                 file_id = data["file_id"]
+                
+                if message.redelivered:
+                    # The previous delivery never finished (worker crashed or
+                    # was stopped), so back off instead of retrying right away
+                    await self.handle_failure(message, file_id, "Worker stopped before finishing the task")
+                    return
                 logger.info(f"Extracting metadata from video: {file_id}")
                 
                 # Update status to processing
@@ -280,12 +317,7 @@ class MetadataExtractionWorker:
                         None
                     )
                 else:
-                    await self.update_status(
-                        file_id,
-                        "failed",
-                        0,
-                        result.get("error")
-                    )
+                    await self.handle_failure(message, file_id, result.get("error") or "Processing failed")
 
             except json.JSONDecodeError as e:
                 logger.error(f"Invalid JSON message: {str(e)}")
@@ -295,6 +327,7 @@ class MetadataExtractionWorker:
                     0,
                     "Invalid message format"
                 )
+                await self.retry_policy.dead_letter(self.channel, message, f"Invalid message format: {str(e)}")
             except ValueError as e:
                 logger.error(f"Invalid message structure: {str(e)}")
                 await self.update_status(
@@ -303,15 +336,24 @@ class MetadataExtractionWorker:
                     0,
                     str(e)
                 )
+                await self.retry_policy.dead_letter(self.channel, message, str(e))
             except Exception as e:
                 logger.error(f"Error processing message: {str(e)}")
                 file_id = data.get("file_id", "unknown") if 'data' in locals() else "unknown"
-                await self.update_status(
-                    file_id,
-                    "failed",
-                    0,
-                    str(e)
-                )
+                await self.handle_failure(message, file_id, str(e))
+
+    async def handle_failure(self, message: aio_pika.IncomingMessage, file_id: str, error: str):
+        """Retry the task with backoff, or dead-letter it after MAX_PROCESSING_ATTEMPTS"""
+        outcome, delay, attempts = await self.retry_policy.retry_or_dead_letter(self.channel, message, error)
+        if outcome == "retry":
+            await self.update_status(
+                file_id,
+                "pending",
+                0,
+                f"Attempt {attempts} of {self.retry_policy.max_attempts} failed, retrying in {delay:.0f}s: {error}"
+            )
+        else:
+            await self.update_status(file_id, "failed", 0, error)
 
     async def start(self):
         """Start the worker"""
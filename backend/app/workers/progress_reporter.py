@@ -0,0 +1,143 @@
+"""
+Status reporting shared by the workers.
+
+Status changes (start of a job, retries, completion or failure) are
+published as persistent messages right away. A job is forgotten once it
+ends or goes back to the queue for a retry. Intermediate progress within
+a status is published as transient messages, at most once per
+``min_interval`` per file; a value superseded within the interval is
+dropped and only the latest one is sent.
+"""
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aio_pika
+
+from ..config import PROGRESS_MIN_INTERVAL
+from ..utils.codec import make_message
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+# Statuses after which a job is no longer tracked by this worker: it ended,
+# or it went back to the queue (retry) and may run on another worker
+RELEASED_STATUSES = TERMINAL_STATUSES + ("pending",)
+
+StatusSender = Callable[[Dict[str, Any], bool], Awaitable[None]]
+
+
+async def publish_status(publisher, status_exchange, status_message: Dict[str, Any], persistent: bool):
+    """
+    Publish a status message on the processing_status exchange.
+
+    Uses the worker's publisher pool when connected, otherwise the status
+    exchange directly. Terminal statuses wait for the broker confirm.
+    """
+    message = make_message(
+        status_message,
+        aio_pika.DeliveryMode.PERSISTENT if persistent else aio_pika.DeliveryMode.NOT_PERSISTENT
+    )
+    try:
+        if publisher is None:
+            await status_exchange.publish(message, routing_key="")
+            return
+        confirm = await publisher.publish(
+            "processing_status", message, routing_key="", ordering_key=status_message["file_id"]
+        )
+        if status_message["status"] in TERMINAL_STATUSES:
+            await confirm
+    except Exception as e:
+        logger.error(f"Failed to publish status update: {str(e)}")
+
+
+class _JobProgress:
+    def __init__(self):
+        self.status: Optional[str] = None
+        self.last_sent = 0.0
+        self.pending: Optional[Dict[str, Any]] = None
+        self.flusher: Optional[asyncio.Task] = None
+
+
+class ProgressReporter:
+    """
+    Rate-limited status reporting for one worker type.
+
+    Args:
+        message_type: Value of the ``type`` field, e.g. ``video_enhancement_status``
+        send: Coroutine ``send(status_message, persistent)`` that publishes a message
+        min_interval: Minimum seconds between progress messages for one file
+    """
+
+    def __init__(self, message_type: str, send: StatusSender, min_interval: float = PROGRESS_MIN_INTERVAL):
+        self.message_type = message_type
+        self.send = send
+        self.min_interval = min_interval
+        self._jobs: Dict[str, _JobProgress] = {}
+        self.stats = {"persistent": 0, "transient": 0, "dropped": 0}
+
+    async def report(self, file_id: str, status: str, progress: int = 0, error: str = None):
+        """Report a status; intermediate progress may be delayed or dropped"""
+        status_message = {
+            "type": self.message_type,
+            "file_id": file_id,
+            "status": status,
+            "progress": progress,
+            "error": error,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        job = self._jobs.get(file_id)
+
+        if job is None or status in TERMINAL_STATUSES or status != job.status:
+            # A status change: always delivered, and durable
+            if job is not None:
+                self._discard_pending(job)
+            if status in RELEASED_STATUSES:
+                self._jobs.pop(file_id, None)
+            else:
+                job = self._jobs.setdefault(file_id, _JobProgress())
+                job.status = status
+                job.last_sent = time.monotonic()
+            self.stats["persistent"] += 1
+            await self.send(status_message, True)
+            return
+
+        if job.pending is not None:
+            self.stats["dropped"] += 1
+        job.pending = status_message
+        if job.flusher is None:
+            delay = max(0.0, job.last_sent + self.min_interval - time.monotonic())
+            if delay == 0:
+                await self._send_pending(job)
+            else:
+                job.flusher = asyncio.create_task(self._flush_later(job, delay))
+
+    def _discard_pending(self, job: _JobProgress):
+        if job.pending is not None:
+            self.stats["dropped"] += 1
+            job.pending = None
+        if job.flusher is not None:
+            job.flusher.cancel()
+            job.flusher = None
+
+    async def _flush_later(self, job: _JobProgress, delay: float):
+        await asyncio.sleep(delay)
+        job.flusher = None
+        await self._send_pending(job)
+
+    async def _send_pending(self, job: _JobProgress):
+        status_message, job.pending = job.pending, None
+        if status_message is None:
+            return
+        job.last_sent = time.monotonic()
+        self.stats["transient"] += 1
+        await self.send(status_message, False)
+
+    def close(self):
+        """Drop progress that has not been sent yet"""
+        for job in self._jobs.values():
+            self._discard_pending(job)
+        self._jobs.clear()
@@ -0,0 +1,279 @@
+"""
+Segment-parallel video enhancement.
+
+A long video is split at keyframes into consecutive frame ranges. Each range
+is decoded, enhanced and encoded in its own process, and the encoded segments
+are joined with the ffmpeg concat demuxer without re-encoding. Enhancement is
+done frame by frame, so the joined output holds exactly the frames the serial
+path would produce.
+
+That only holds while a frame index maps to one timestamp, so only streams
+with a constant frame rate are split. Each segment checks the timestamp of
+the first frame it decoded and the number of frames it got against the plan;
+any difference fails the segment, and the caller enhances the video in one
+piece instead.
+
+The functions that run inside the process pool are module level so they can
+be pickled.
+"""
+import os
+import logging
+from fractions import Fraction
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .frame_pipeline import FramePipeline, open_video_writer
+from ..utils.capabilities import get_capabilities
+from ..utils.process import ProcessTimeout, run_process
+
+logger = logging.getLogger('segment_parallel')
+
+
+async def probe_keyframe_times(input_path: str, timeout: float = 60) -> List[float]:
+    """
+    Get the presentation times of the keyframes of the first video stream.
+
+    Returns:
+        List[float]: Sorted keyframe times in seconds (empty if ffprobe is
+        missing or fails)
+    """
+    capabilities = get_capabilities()
+    if not capabilities.has("ffprobe"):
+        return []
+
+    cmd = [
+        capabilities.binaries["ffprobe"],
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-skip_frame", "nokey",
+        "-show_entries", "frame=pts_time",
+        "-of", "csv=p=0",
+        input_path
+    ]
+    try:
+        result = await run_process(cmd, timeout)
+    except (ProcessTimeout, OSError) as e:
+        logger.warning(f"Could not probe keyframes of {input_path}: {str(e)}")
+        return []
+
+    if not result.ok:
+        logger.warning(f"Keyframe probe failed: {result.stderr.strip()}")
+        return []
+
+    times = []
+    for line in result.stdout.splitlines():
+        value = line.strip().rstrip(',')
+        if not value or value == "N/A":
+            continue
+        try:
+            times.append(float(value))
+        except ValueError:
+            continue
+    return sorted(times)
+
+
+def _parse_rate(value: Optional[str]) -> Optional[Fraction]:
+    """Frame rate from ffprobe's ``num/den`` notation, None if unknown"""
+    try:
+        rate = Fraction(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return rate if rate > 0 else None
+
+
+def has_constant_frame_rate(stream: Dict[str, Any]) -> bool:
+    """
+    Whether a probed video stream has a constant frame rate.
+
+    ffprobe's ``r_frame_rate`` is the base rate of the stream and
+    ``avg_frame_rate`` the average over its frames; they differ for
+    variable frame rate video, where frame indices cannot be derived from
+    timestamps.
+    """
+    base_rate = _parse_rate(stream.get("r_frame_rate"))
+    return base_rate is not None and base_rate == _parse_rate(stream.get("avg_frame_rate"))
+
+
+def stream_start_time(stream: Dict[str, Any]) -> float:
+    """Presentation time of the first frame of a probed stream, in seconds"""
+    try:
+        return float(stream.get("start_time") or 0)
+    except ValueError:
+        return 0.0
+
+
+def plan_segments(total_frames: int, fps: float, keyframe_times: List[float],
+                  segment_count: int, min_segment_frames: int,
+                  start_time: float = 0.0) -> List[Tuple[int, Optional[int]]]:
+    """
+    Split a video into consecutive frame ranges starting at keyframes.
+
+    Boundaries are placed at the keyframe closest to an even split. The last
+    range is open ended (``end`` is ``None``) so it runs to the real end of
+    the stream even if the container's frame count is off.
+
+    Keyframe times are presentation times; ``start_time`` (the stream's
+    first timestamp) is subtracted before they are mapped to frame indices.
+
+    Returns:
+        List[Tuple[int, Optional[int]]]: ``(start_frame, end_frame)`` ranges,
+        a single range when the video should not be split
+    """
+    if segment_count < 2 or total_frames <= 0 or fps <= 0:
+        return [(0, None)]
+
+    keyframes = sorted({int(round((t - start_time) * fps)) for t in keyframe_times})
+    keyframes = [k for k in keyframes if 0 < k < total_frames]
+    if not keyframes:
+        return [(0, None)]
+
+    segment_count = min(segment_count, max(1, total_frames // max(1, min_segment_frames)))
+    boundaries = [0]
+    for i in range(1, segment_count):
+        target = total_frames * i / segment_count
+        nearest = min(keyframes, key=lambda k: abs(k - target))
+        if nearest - boundaries[-1] >= min_segment_frames and total_frames - nearest >= min_segment_frames:
+            boundaries.append(nearest)
+
+    return [
+        (start, boundaries[i + 1] if i + 1 < len(boundaries) else None)
+        for i, start in enumerate(boundaries)
+    ]
+
+
+class _SegmentCapture:
+    """Capture wrapper that stops after a fixed number of frames"""
+
+    def __init__(self, capture, frame_limit: Optional[int], first_frame=None):
+        self.capture = capture
+        self.remaining = frame_limit
+        # Frame already decoded to check the seek, handed out first
+        self.first_frame = first_frame
+
+    def read(self, image=None):
+        if self.remaining is not None:
+            if self.remaining <= 0:
+                return False, None
+            self.remaining -= 1
+        if self.first_frame is not None:
+            frame, self.first_frame = self.first_frame, None
+            return True, frame
+        return self.capture.read(image) if image is not None else self.capture.read()
+
+
+def _seek(cap: cv2.VideoCapture, start_frame: int, fps: float) -> np.ndarray:
+    """
+    Position the capture on ``start_frame`` and decode that frame.
+
+    The capture reports back whatever frame number it was set to, so the
+    position is checked against the timestamp of the decoded frame instead.
+
+    Raises:
+        RuntimeError: The decoded frame is not ``start_frame``
+    """
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    ret, frame = cap.read()
+    if not ret:
+        raise RuntimeError(f"Could not seek to frame {start_frame}")
+    landed = cap.get(cv2.CAP_PROP_POS_MSEC) * fps / 1000
+    if abs(landed - start_frame) >= 0.5:
+        raise RuntimeError(f"Could not seek to frame {start_frame} (landed on {landed:.2f})")
+    return frame
+
+
+def enhance_segment(input_path: str, output_path: str, start_frame: int, end_frame: Optional[int],
+                    fps: float, frame_size: Tuple[int, int], thumbnail_path: Optional[str] = None,
+                    deadline: Optional[float] = None, expected_frames: Optional[int] = None) -> int:
+    """
+    Enhance and encode one frame range of a video (runs in a pool process).
+
+    Args:
+        expected_frames: Frames the plan expects from an open-ended range
+            (``end_frame`` None); a bounded range must yield all its frames
+
+    Returns:
+        int: Number of frames written
+
+    Raises:
+        RuntimeError: If the capture could not be positioned on ``start_frame``
+            or the range did not yield the planned number of frames
+    """
+    cap = cv2.VideoCapture(input_path)
+    out = None
+    try:
+        if not cap.isOpened():
+            raise Exception("Failed to open video file")
+
+        first_frame = _seek(cap, start_frame, fps) if start_frame > 0 else None
+
+        out = open_video_writer(output_path, fps, frame_size)
+
+        def on_frame_written(index, frame):
+            if index == 0 and thumbnail_path:
+                cv2.imwrite(thumbnail_path, frame)
+
+        frame_limit = end_frame - start_frame if end_frame is not None else None
+        pipeline = FramePipeline(
+            _SegmentCapture(cap, frame_limit, first_frame),
+            out,
+            enhancer_threads=1,
+            on_frame_written=on_frame_written,
+            deadline=deadline
+        )
+        frames_written = pipeline.run()
+
+        expected = frame_limit if frame_limit is not None else expected_frames
+        if expected is not None and frames_written != expected:
+            raise RuntimeError(
+                f"Segment {start_frame}-{end_frame} produced {frames_written} frames instead of {expected}"
+            )
+        return frames_written
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+
+
+async def concat_segments(segment_paths: List[str], output_path: str, timeout: float = 300) -> bool:
+    """
+    Join encoded segments with the ffmpeg concat demuxer (stream copy).
+
+    Returns:
+        bool: True if the joined file was written
+    """
+    capabilities = get_capabilities()
+    if not capabilities.has('ffmpeg'):
+        logger.warning("FFmpeg not found, cannot join video segments")
+        return False
+
+    list_path = f"{output_path}.segments.txt"
+    try:
+        with open(list_path, 'w') as f:
+            for path in segment_paths:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
+        cmd = [
+            capabilities.binaries['ffmpeg'],
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', list_path,
+            '-c', 'copy',
+            '-y',
+            output_path
+        ]
+        logger.info(f"Joining {len(segment_paths)} segments: {' '.join(cmd)}")
+        result = await run_process(cmd, timeout)
+        if not result.ok:
+            logger.error(f"FFmpeg concat failed: {result.stderr}")
+            return False
+        return os.path.exists(output_path) and os.path.getsize(output_path) > 0
+    except ProcessTimeout:
+        logger.error("FFmpeg concat timed out")
+        return False
+    finally:
+        if os.path.exists(list_path):
+            os.remove(list_path)
+
@@ -2,24 +2,53 @@ import os
 import time
 import logging
 import cv2
-import numpy as np
 import aio_pika
 import json
 import asyncio
 import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Dict, Any, List, Tuple, Optional
-from shutil import which
 
 from ..config import (
     RABBITMQ_URL, 
+    TASK_EXCHANGE,
+    TASK_MAX_PRIORITY,
     PROCESSING_TIMEOUT,
     PROCESSED_DIR,
     METADATA_DIR,
     THUMBNAILS_DIR,
-    MAX_PROCESSING_ATTEMPTS
+    MAX_PROCESSING_ATTEMPTS,
+    WORKER_CONCURRENCY,
+    ENHANCEMENT_THREADS,
+    ENHANCEMENT_MAX_FRAMES_IN_FLIGHT,
+    SEGMENT_PARALLEL_PROCESSES,
+    SEGMENT_MIN_SECONDS,
+    FFMPEG_PIPE_OUTPUT
 )
 from ..utils.validators import check_ffprobe_availability, validate_video_file
+from ..utils.executor import run_blocking
+from ..utils.probe import audio_codec_from_probe, probe_video, video_stream_from_probe
+from ..utils import capabilities
+from ..utils.capabilities import get_capabilities
+from ..utils.process import run_process
+from ..utils import broker
+from ..utils.rabbitmq import PublisherPool, task_queue_name
+from ..utils.codec import decode_body
+from ..utils.retry import RetryPolicy
+from .progress_reporter import ProgressReporter, publish_status
+from .frame_enhancer import FrameEnhancer
+from .frame_pipeline import FramePipeline, open_video_writer
+from .ffmpeg_writer import FFmpegPipeWriter, probe_audio_codec
+from .segment_parallel import (
+    probe_keyframe_times,
+    has_constant_frame_rate,
+    stream_start_time,
+    plan_segments,
+    enhance_segment,
+    concat_segments
+)
 
 # Configure logging
 logging.basicConfig(
@@ -29,36 +58,50 @@ logging.basicConfig(
 logger = logging.getLogger('video_enhancement_worker')
 
 class VideoEnhancementWorker:
-    def __init__(self, rabbitmq_url: str = RABBITMQ_URL):
+    def __init__(self, rabbitmq_url: str = RABBITMQ_URL, concurrency: int = WORKER_CONCURRENCY):
         self.rabbitmq_url = rabbitmq_url
+        self.concurrency = max(1, concurrency)
+        # Caps the number of jobs processed at once by this worker
+        self._job_slots = asyncio.Semaphore(self.concurrency)
         self.connection = None
         self.channel = None
         self.queue = None
         self.task_exchange = None
         self.status_exchange = None
+        self.publisher = None
+        self.retry_policy = RetryPolicy("video_enhancement", MAX_PROCESSING_ATTEMPTS)
+        self.progress_reporter = ProgressReporter("video_enhancement_status", self._publish_status)
         self.processed_dir = PROCESSED_DIR
         self.thumbnails_dir = THUMBNAILS_DIR
         self.ffprobe_available = False
+        self.frame_enhancer = FrameEnhancer()
+        self.segment_processes = SEGMENT_PARALLEL_PROCESSES
+        self.ffmpeg_pipe_output = FFMPEG_PIPE_OUTPUT
+        self._segment_pool = None
         os.makedirs(self.processed_dir, exist_ok=True)
         os.makedirs(self.thumbnails_dir, exist_ok=True)
         
     async def startup(self):
         """Run startup checks and initialization"""
         # Check if ffprobe is available
-        self.ffprobe_available = check_ffprobe_availability()
+        self.ffprobe_available = await run_blocking(check_ffprobe_availability)
         if not self.ffprobe_available:
             logger.warning("FFprobe not available - some enhancement features will be limited")
 
     async def connect(self):
         """Establish connection to RabbitMQ"""
         try:
-            self.connection = await aio_pika.connect_robust(self.rabbitmq_url)
+            self.connection = await broker.connect(self.rabbitmq_url)
             self.channel = await self.connection.channel()
+            # Only take as many unacknowledged jobs as we can process at once,
+            # so the broker spreads the rest across other workers
+            await self.channel.set_qos(prefetch_count=self.concurrency)
             
             # Create separate exchanges for tasks and status updates
             self.task_exchange = await self.channel.declare_exchange(
-                "video_tasks",
-                aio_pika.ExchangeType.FANOUT
+                TASK_EXCHANGE,
+                aio_pika.ExchangeType.DIRECT,
+                durable=True
             )
             
             self.status_exchange = await self.channel.declare_exchange(
@@ -66,12 +109,23 @@ class VideoEnhancementWorker:
                 aio_pika.ExchangeType.FANOUT
             )
             
-            # Bind only to the task exchange with a unique queue name
+            # Bind to the task exchange for this stage's tasks only
+            # Priority queue so short or interactive jobs are served first.
+            # A new name is used because RabbitMQ cannot add x-max-priority
+            # to the existing queue.
             self.queue = await self.channel.declare_queue(
-                "video_enhancement_queue",
-                durable=True
+                task_queue_name("video_enhancement"),
+                durable=True,
+                arguments={"x-max-priority": TASK_MAX_PRIORITY}
             )
-            await self.queue.bind(self.task_exchange)
+            await self.queue.bind(self.task_exchange, routing_key="video_enhancement")
+            
+            # Delay queues for retries with backoff, and the dead-letter queue
+            await self.retry_policy.declare(self.channel)
+            
+            # Status updates go out through a pool of confirm channels
+            self.publisher = PublisherPool(self.connection)
+            await self.publisher.open()
             logger.info("Connected to RabbitMQ")
         except Exception as e:
             logger.error(f"Failed to connect to RabbitMQ: {str(e)}")
@@ -79,6 +133,13 @@ class VideoEnhancementWorker:
 
     async def close(self):
         """Close RabbitMQ connection"""
+        self.progress_reporter.close()
+        if self._segment_pool is not None:
+            self._segment_pool.shutdown(wait=False, cancel_futures=True)
+            self._segment_pool = None
+        if self.publisher:
+            await self.publisher.close()
+            self.publisher = None
         if self.connection:
             await self.connection.close()
             logger.info("RabbitMQ connection closed")
@@ -102,13 +163,20 @@ class VideoEnhancementWorker:
                 self.processed_dir,
                 f"{base_name}_temp{extension}"
             )
+            # Output of the single-encode ffmpeg path is always an MP4
+            direct_output_path = os.path.join(
+                self.processed_dir,
+                f"{base_name}_enhanced.mp4"
+            )
             thumbnail_path = os.path.join(
                 self.thumbnails_dir,
                 f"{file_id}_thumbnail.jpg"
             )
             
             # Validate the video file
-            is_valid, error_message = validate_video_file(input_path)
+            # The upload probe, when present, saves running ffprobe again
+            probe = message.get("probe")
+            is_valid, error_message = await validate_video_file(input_path, probe)
             if not is_valid:
                 raise ValueError(f"Invalid video file: {error_message}")
             
@@ -124,87 +192,64 @@ class VideoEnhancementWorker:
             width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
             height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
             fps = cap.get(cv2.CAP_PROP_FPS)
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            deadline = start_time + PROCESSING_TIMEOUT
             
-            # Create video writer with codec that has good browser support
-            # Try multiple codecs in order of preference
-            codec_successful = False
-            preferred_codecs = ['avc1', 'H264', 'h264', 'XVID', 'mp4v']
-            
-            for codec in preferred_codecs:
-                try:
-                    fourcc = cv2.VideoWriter_fourcc(*codec)
-                    out = cv2.VideoWriter(temp_output_path, fourcc, fps, (width, height))
-                    
-                    if out.isOpened():
-                        logger.info(f"Successfully created video writer with codec: {codec}")
-                        codec_successful = True
-                        break
-                    else:
-                        logger.warning(f"Failed to create video writer with codec: {codec}")
-                except Exception as e:
-                    logger.warning(f"Error using codec {codec}: {str(e)}")
-            
-            if not codec_successful:
-                # Fallback to default codec as last resort
-                logger.warning("All preferred codecs failed, using default codec")
-                out = cv2.VideoWriter(temp_output_path, 0, fps, (width, height))
-            
-            if not out.isOpened():
-                raise Exception("Failed to create output video file with any codec")
+            # Long videos can be split into segments enhanced in parallel processes
+            enhanced_in_segments = False
+            if self.segment_processes > 1:
+                enhanced_in_segments = await self.enhance_video_segments(
+                    file_id, input_path, temp_output_path, total_frames, fps,
+                    (width, height), thumbnail_path, deadline, probe
+                )
             
-            # Process frame by frame
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            processed_frames = 0
-            saved_thumbnail = False
+            # Encode once by piping the enhanced frames straight into ffmpeg
+            encoded_directly = False
+            if not enhanced_in_segments and self.ffmpeg_pipe_output and fps > 0 and get_capabilities().can_encode('libx264'):
+                encoded_directly = await self.enhance_video_to_ffmpeg(
+                    file_id, cap, input_path, direct_output_path, total_frames, fps,
+                    (width, height), thumbnail_path, deadline, probe
+                )
+                if not encoded_directly:
+                    # The capture was consumed, start over for the OpenCV writer
+                    cap.release()
+                    cap = cv2.VideoCapture(input_path)
+                    if not cap.isOpened():
+                        raise Exception("Failed to open video file")
             
-            while True:
-                # Check for timeout
-                if time.time() - start_time > PROCESSING_TIMEOUT:
-                    raise TimeoutError("Video enhancement timed out")
-                
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                
-                # Apply enhancement to the frame
-                enhanced_frame = self.enhance_frame(frame)
-                
-                # Write the frame to output video
-                out.write(enhanced_frame)
-                
-                # Save thumbnail from first enhanced frame
-                if not saved_thumbnail:
-                    cv2.imwrite(thumbnail_path, enhanced_frame)
-                    saved_thumbnail = True
-                
-                # Update progress every 10% of frames
-                processed_frames += 1
-                if processed_frames % max(1, int(total_frames / 10)) == 0:
-                    progress = min(90, int(processed_frames / total_frames * 90))
-                    await self.update_status(file_id, "processing", progress)
+            if not enhanced_in_segments and not encoded_directly:
+                out = open_video_writer(temp_output_path, fps, (width, height))
+                try:
+                    await self.enhance_video_frames(
+                        file_id, cap, out, total_frames, thumbnail_path, deadline
+                    )
+                finally:
+                    out.release()
             
             # Release video objects
             cap.release()
-            out.release()
             
             # Update progress
             await self.update_status(file_id, "processing", 95)
             
-            # Post-process the video to ensure browser compatibility
-            is_converted = await self.convert_to_web_compatible(temp_output_path or output_path, output_path)
-            if not is_converted and temp_output_path:
-                # If conversion failed, but we have an OpenCV output, just use that
-                logger.warning(f"FFmpeg conversion failed, using original OpenCV output for {file_id}")
-                if os.path.exists(temp_output_path) and os.path.getsize(temp_output_path) > 0:
-                    import shutil
-                    shutil.copy2(temp_output_path, output_path)
-            
-            # Clean up temporary file
-            if temp_output_path and os.path.exists(temp_output_path):
-                try:
-                    os.remove(temp_output_path)
-                except Exception as e:
-                    logger.warning(f"Failed to remove temporary file {temp_output_path}: {e}")
+            if encoded_directly:
+                output_path = direct_output_path
+            else:
+                # Post-process the video to ensure browser compatibility
+                is_converted = await self.convert_to_web_compatible(temp_output_path or output_path, output_path)
+                if not is_converted and temp_output_path:
+                    # If conversion failed, but we have an OpenCV output, just use that
+                    logger.warning(f"FFmpeg conversion failed, using original OpenCV output for {file_id}")
+                    if os.path.exists(temp_output_path) and os.path.getsize(temp_output_path) > 0:
+                        import shutil
+                        shutil.copy2(temp_output_path, output_path)
+                
+                # Clean up temporary file
+                if temp_output_path and os.path.exists(temp_output_path):
+                    try:
+                        os.remove(temp_output_path)
+                    except Exception as e:
+                        logger.warning(f"Failed to remove temporary file {temp_output_path}: {e}")
             
             # Update to completed status
             await self.update_status(file_id, "completed", 100)
@@ -240,32 +285,210 @@ class VideoEnhancementWorker:
             try:
                 if 'cap' in locals() and cap is not None:
                     cap.release()
-                if 'out' in locals() and out is not None:
-                    out.release()
             except Exception as e:
                 logger.error(f"Error during cleanup: {str(e)}")
 
-    def enhance_frame(self, frame):
-        """Apply video enhancement techniques to a single frame"""
-        try:
-            # Convert to float for processing
-            frame_float = frame.astype(np.float32) / 255.0
-            
-            # Apply contrast enhancement (simple method)
-            alpha = 1.2  # Contrast control (1.0-3.0)
-            beta = 10    # Brightness control (0-100)
-            
-            # Apply contrast enhancement
-            enhanced = cv2.convertScaleAbs(frame, alpha=alpha, beta=beta)
+    async def enhance_video_frames(self, file_id: str, cap, out, total_frames: int,
+                                   thumbnail_path: str, deadline: float):
+        """
+        Enhance all frames of an opened capture with the threaded pipeline.
+
+        The caller owns ``out`` and releases it afterwards.
+        """
+        progress_step = max(1, int(total_frames / 10))
+        report_progress = None
+        
+        def on_frame_written(index, enhanced_frame):
+            # Save thumbnail from first enhanced frame
+            if index == 0:
+                cv2.imwrite(thumbnail_path, enhanced_frame)
             
-            # Apply slight sharpening
-            kernel = np.array([[-1,-1,-1], 
-                               [-1, 9,-1],
-                               [-1,-1,-1]])
-            enhanced = cv2.filter2D(enhanced, -1, kernel)
+            # Update progress every 10% of frames
+            processed_frames = index + 1
+            if total_frames > 0 and processed_frames % progress_step == 0:
+                report_progress(min(90, int(processed_frames / total_frames * 90)))
+        
+        pipeline = FramePipeline(
+            cap,
+            out,
+            enhancer_threads=ENHANCEMENT_THREADS,
+            max_frames_in_flight=ENHANCEMENT_MAX_FRAMES_IN_FLIGHT,
+            on_frame_written=on_frame_written,
+            deadline=deadline
+        )
+        
+        def run_pipeline(report):
+            nonlocal report_progress
+            report_progress = report
+            return pipeline.run()
+        
+        async def send_progress(progress):
+            await self.update_status(file_id, "processing", progress)
+        
+        try:
+            await run_blocking(run_pipeline, on_progress=send_progress)
+        except asyncio.CancelledError:
+            pipeline.stop()
+            raise
+
+    async def enhance_video_to_ffmpeg(self, file_id: str, cap, input_path: str, output_path: str,
+                                      total_frames: int, fps: float, frame_size: Tuple[int, int],
+                                      thumbnail_path: str, deadline: float,
+                                      probe: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Enhance a video and encode it once through an ffmpeg pipe.
+
+        Returns:
+            bool: True if the final MP4 was written, False if the OpenCV
+            writer should be used instead
+        """
+        audio_codec = None
+        if probe is not None:
+            audio_codec = audio_codec_from_probe(probe)
+        elif self.ffprobe_available:
+            audio_codec = await probe_audio_codec(input_path)
+        
+        try:
+            writer = FFmpegPipeWriter(
+                output_path, fps, frame_size,
+                audio_source=input_path,
+                audio_codec=audio_codec
+            )
+        except OSError as e:
+            logger.warning(f"Could not start FFmpeg encoder, using OpenCV writer: {str(e)}")
+            return False
+        
+        try:
+            await self.enhance_video_frames(file_id, cap, writer, total_frames, thumbnail_path, deadline)
+            await run_blocking(writer.release)
+            return True
+        except (TimeoutError, asyncio.CancelledError):
+            writer.abort()
+            self._remove_partial_output(output_path)
+            raise
+        except Exception as e:
+            writer.abort()
+            self._remove_partial_output(output_path)
+            logger.warning(f"FFmpeg pipe encoding failed for {file_id}, using OpenCV writer: {str(e)}")
+            return False
+
+    def _remove_partial_output(self, path: str):
+        """Delete an output file left behind by a failed encode"""
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except Exception as e:
+                logger.warning(f"Failed to remove partial output {path}: {e}")
+
+    async def enhance_video_segments(self, file_id: str, input_path: str, output_path: str,
+                                     total_frames: int, fps: float, frame_size: Tuple[int, int],
+                                     thumbnail_path: str, deadline: float,
+                                     probe: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Enhance a video as keyframe-aligned segments in the process pool.
+
+        Returns:
+            bool: True if the joined output was written, False if the video
+            should be enhanced in one piece instead (too short, variable frame
+            rate, no keyframe or stream information, seek, frame count or
+            join failure)
+        """
+        if probe is None:
+            try:
+                probe = await probe_video(input_path)
+            except Exception as e:
+                logger.warning(f"Could not probe {file_id} for segmenting: {str(e)}")
+        stream = video_stream_from_probe(probe) if probe else None
+        if stream is None:
+            return False
+        if not has_constant_frame_rate(stream):
+            logger.info(f"{file_id} has a variable frame rate, enhancing in one piece")
+            return False
+        
+        keyframe_times = await probe_keyframe_times(input_path)
+        segments = plan_segments(
+            total_frames,
+            fps,
+            keyframe_times,
+            self.segment_processes,
+            int(SEGMENT_MIN_SECONDS * fps),
+            stream_start_time(stream)
+        )
+        if len(segments) < 2:
+            return False
+        
+        logger.info(f"Enhancing {file_id} in {len(segments)} parallel segments: {segments}")
+        base_name, extension = os.path.splitext(output_path)
+        segment_paths = [f"{base_name}_part{i}{extension}" for i in range(len(segments))]
+        pool = self._get_segment_pool()
+        frames_done = 0
+        
+        async def run_segment(index: int, start_frame: int, end_frame: Optional[int]):
+            nonlocal frames_done
+            frames_written = await run_blocking(
+                enhance_segment,
+                input_path,
+                segment_paths[index],
+                start_frame,
+                end_frame,
+                fps,
+                frame_size,
+                thumbnail_path if index == 0 else None,
+                deadline,
+                (end_frame if end_frame is not None else total_frames) - start_frame,
+                executor=pool
+            )
+            frames_done += frames_written
+            if total_frames > 0:
+                progress = min(90, int(frames_done / total_frames * 90))
+                await self.update_status(file_id, "processing", progress)
+        
+        try:
+            results = await asyncio.gather(
+                *(run_segment(i, start, end) for i, (start, end) in enumerate(segments)),
+                return_exceptions=True
+            )
+            errors = [result for result in results if isinstance(result, BaseException)]
+            for error in errors:
+                if isinstance(error, TimeoutError):
+                    raise error
+            if errors:
+                logger.warning(f"Segment enhancement failed for {file_id}, enhancing in one piece: {errors[0]}")
+                return False
             
-            # Return enhanced frame
-            return enhanced
+            joined = await concat_segments(segment_paths, output_path)
+            if not joined:
+                logger.warning(f"Could not join segments for {file_id}, enhancing in one piece")
+            return joined
+        finally:
+            for path in segment_paths:
+                if os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except Exception as e:
+                        logger.warning(f"Failed to remove segment file {path}: {e}")
+
+    def _get_segment_pool(self) -> ProcessPoolExecutor:
+        """Get the process pool for segment enhancement (created on first use)"""
+        if self._segment_pool is None:
+            self._segment_pool = ProcessPoolExecutor(
+                max_workers=self.segment_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                # Pool processes reuse this process's capabilities
+                initializer=capabilities.install,
+                initargs=(get_capabilities(),)
+            )
+        return self._segment_pool
+
+    def enhance_frame(self, frame):
+        """
+        Apply video enhancement techniques to a single frame.
+
+        The returned frame is a buffer owned by the frame enhancer and is
+        reused for the next frame of the same resolution.
+        """
+        try:
+            return self.frame_enhancer.enhance(frame)
         except Exception as e:
             logger.error(f"Error enhancing frame: {str(e)}")
             # Return original frame if enhancement fails
@@ -273,30 +496,18 @@ class VideoEnhancementWorker:
 
     async def update_status(self, file_id: str, status: str, progress: int = 0, error: str = None):
         """Update processing status via RabbitMQ"""
-        status_message = {
-            "type": "video_enhancement_status",
-            "file_id": file_id,
-            "status": status,
-            "progress": progress,
-            "error": error,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        try:
-            await self.status_exchange.publish(
-                aio_pika.Message(
-                    body=json.dumps(status_message).encode(),
-                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT
-                ),
-                routing_key=""
-            )
-        except Exception as e:
-            logger.error(f"Failed to publish status update: {str(e)}")
+        await self.progress_reporter.report(file_id, status, progress, error)
+
+    async def _publish_status(self, status_message: Dict[str, Any], persistent: bool):
+        await publish_status(self.publisher, self.status_exchange, status_message, persistent)
 
     async def process_message(self, message: aio_pika.IncomingMessage):
         """Process incoming message from queue"""
-        async with message.process():
+        # Requeue if handling escapes with an error; the redelivery then
+        # counts as a failed attempt below
+        async with self._job_slots, message.process(requeue=True):
             try:
-                data = json.loads(message.body.decode())
+                data = decode_body(message.body, message.content_type)
                 logger.info(f"Received message: {data}")
                 
                 # Validate message structure
@@ -310,6 +521,12 @@ class VideoEnhancementWorker:
                     raise ValueError("Message must contain 'filepath'")
                 
                 file_id = data["file_id"]
+                
+                if message.redelivered:
+                    # The previous delivery never finished (worker crashed or
+                    # was stopped), so back off instead of retrying right away
+                    await self.handle_failure(message, file_id, "Worker stopped before finishing the task")
+                    return
                 logger.info(f"Enhancing video: {file_id}")
                 
                 # Check if file exists
@@ -331,12 +548,7 @@ class VideoEnhancementWorker:
                         None
                     )
                 else:
-                    await self.update_status(
-                        file_id,
-                        "failed",
-                        0,
-                        result.get("error")
-                    )
+                    await self.handle_failure(message, file_id, result.get("error") or "Processing failed")
 
             except json.JSONDecodeError as e:
                 logger.error(f"Invalid JSON message: {str(e)}")
@@ -346,6 +558,7 @@ class VideoEnhancementWorker:
                     0,
                     "Invalid message format"
                 )
+                await self.retry_policy.dead_letter(self.channel, message, f"Invalid message format: {str(e)}")
             except ValueError as e:
                 logger.error(f"Invalid message structure: {str(e)}")
                 await self.update_status(
@@ -354,15 +567,24 @@ class VideoEnhancementWorker:
                     0,
                     str(e)
                 )
+                await self.retry_policy.dead_letter(self.channel, message, str(e))
             except Exception as e:
                 logger.error(f"Error processing message: {str(e)}")
                 file_id = data.get("file_id", "unknown") if 'data' in locals() else "unknown"
-                await self.update_status(
-                    file_id,
-                    "failed",
-                    0,
-                    str(e)
-                )
+                await self.handle_failure(message, file_id, str(e))
+
+    async def handle_failure(self, message: aio_pika.IncomingMessage, file_id: str, error: str):
+        """Retry the task with backoff, or dead-letter it after MAX_PROCESSING_ATTEMPTS"""
+        outcome, delay, attempts = await self.retry_policy.retry_or_dead_letter(self.channel, message, error)
+        if outcome == "retry":
+            await self.update_status(
+                file_id,
+                "pending",
+                0,
+                f"Attempt {attempts} of {self.retry_policy.max_attempts} failed, retrying in {delay:.0f}s: {error}"
+            )
+        else:
+            await self.update_status(file_id, "failed", 0, error)
 
     async def start(self):
         """Start the worker"""
@@ -385,7 +607,8 @@ class VideoEnhancementWorker:
         Returns True if successful, False otherwise.
         """
         # Check if ffmpeg is available
-        if not which('ffmpeg'):
+        caps = get_capabilities()
+        if not caps.has('ffmpeg'):
             logger.warning("FFmpeg not found, skipping conversion to web-compatible format")
             return False
         
@@ -400,7 +623,7 @@ class VideoEnhancementWorker:
             
             # FFmpeg command to convert to web-compatible H.264
             cmd = [
-                'ffmpeg',
+                caps.binaries['ffmpeg'],
                 '-i', input_path,
                 '-c:v', 'libx264',  # H.264 video codec
                 '-preset', 'fast',   # Encoding speed/quality balance
@@ -415,16 +638,10 @@ class VideoEnhancementWorker:
             logger.info(f"Running FFmpeg conversion: {' '.join(cmd)}")
             
             # Run FFmpeg
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
+            result = await run_process(cmd, PROCESSING_TIMEOUT)
             
             # If using a temp file and conversion was successful, replace the original
-            if using_temp and process.returncode == 0:
+            if using_temp and result.ok:
                 if os.path.exists(temp_output) and os.path.getsize(temp_output) > 0:
                     if os.path.exists(output_path):
                         os.remove(output_path)
@@ -433,8 +650,8 @@ class VideoEnhancementWorker:
                     logger.error(f"FFmpeg produced an empty or missing file: {temp_output}")
                     return False
             
-            if process.returncode != 0:
-                logger.error(f"FFmpeg conversion failed: {stderr.decode()}")
+            if not result.ok:
+                logger.error(f"FFmpeg conversion failed: {result.stderr}")
                 return False
                 
             logger.info(f"Successfully converted video to web-compatible format: {output_path}")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Script to benchmark the message codecs.
+Measures encode and decode cost and the size of a typical status and task
+message for every codec in app.utils.codec.
+"""
+
+import time
+import uuid
+import argparse
+from datetime import datetime
+from app.utils.codec import CODECS
+
+def sample_messages():
+    """A status update and a task message as published by the system"""
+    file_id = str(uuid.uuid4())
+    timestamp = datetime.utcnow().isoformat()
+    return {
+        "status": {
+            "type": "video_enhancement_status",
+            "file_id": file_id,
+            "status": "processing",
+            "progress": 42,
+            "error": None,
+            "timestamp": timestamp
+        },
+        "task": {
+            "file_id": file_id,
+            "filepath": f"uploads/{file_id}.mp4",
+            "filename": f"{file_id}.mp4",
+            "client_id": "client_1234",
+            "stages": ["video_enhancement", "metadata_extraction"],
+            "timestamp": timestamp
+        }
+    }
+
+def measure_us(func, arg, iterations: int) -> float:
+    """Average microseconds per call"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def run_benchmark(iterations: int):
+    """Print bytes, encode and decode time per message for each codec"""
+    print(f"{'message':<10}{'codec':<10}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+    for message_name, message in sample_messages().items():
+        for codec_name, codec in CODECS.items():
+            body = codec.encode(message)
+            if codec.decode(body) != message:
+                raise RuntimeError(f"{codec_name} does not round-trip the {message_name} message")
+            encode_us = measure_us(codec.encode, message, iterations)
+            decode_us = measure_us(codec.decode, body, iterations)
+            print(f"{message_name:<10}{codec_name:<10}{len(body):>8}{encode_us:>12.2f}{decode_us:>12.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message codecs")
+    parser.add_argument("--iterations", type=int, default=100000,
+                        help="Encode/decode calls per measurement")
+    args = parser.parse_args()
+    run_benchmark(args.iterations)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import asyncio
+import logging
+from app.utils.rabbitmq import RabbitMQClient
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+async def main():
+    """Move tasks left in the queues of the old fanout exchange to their stage, once"""
+    client = RabbitMQClient()
+    try:
+        await client.connect()
+        moved = await client.migrate_legacy_task_queues()
+        if not moved:
+            logger.info("No legacy task queues found")
+        for stage, count in moved.items():
+            logger.info(f"{stage}: moved {count} tasks")
+    finally:
+        await client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -3,6 +3,7 @@ import logging
 import argparse
 from app.workers.video_enhancement_worker import VideoEnhancementWorker
 from app.workers.metadata_extraction_worker import MetadataExtractionWorker
+from app.config import WORKER_CONCURRENCY
 
 # Configure logging
 logging.basicConfig(
@@ -21,16 +22,22 @@ async def main():
         default="video-enhancement",
         help="Worker type to run (video-enhancement or metadata-extraction)"
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=WORKER_CONCURRENCY,
+        help="Number of jobs this worker processes at once (also used as the prefetch count)"
+    )
     args = parser.parse_args()
     
     try:
         if args.worker == "video-enhancement":
-            worker = VideoEnhancementWorker()
-            logger.info("Starting Video Enhancement Worker...")
+            worker = VideoEnhancementWorker(concurrency=args.concurrency)
+            logger.info(f"Starting Video Enhancement Worker (concurrency {worker.concurrency})...")
             await worker.start()
         elif args.worker == "metadata-extraction":
-            worker = MetadataExtractionWorker()
-            logger.info("Starting Metadata Extraction Worker...")
+            worker = MetadataExtractionWorker(concurrency=args.concurrency)
+            logger.info(f"Starting Metadata Extraction Worker (concurrency {worker.concurrency})...")
             await worker.start()
     except KeyboardInterrupt:
         logger.info("Shutting down worker...")
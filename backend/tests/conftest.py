@@ -0,0 +1,15 @@
+import os
+import shutil
+import tempfile
+
+# app.config reads its paths at import time and app.utils.state opens the
+# global store on import, so point them at a scratch directory before any
+# test module imports the app; the source tree stays untouched
+_scratch_dir = tempfile.mkdtemp(prefix="video-api-tests-")
+os.environ.setdefault("STATE_DIR", os.path.join(_scratch_dir, "state"))
+os.environ.setdefault("UPLOAD_DIR", os.path.join(_scratch_dir, "uploads"))
+os.environ.setdefault("PROCESSING_STATES_DB", os.path.join(_scratch_dir, "state", "processing_states.db"))
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_scratch_dir, ignore_errors=True)
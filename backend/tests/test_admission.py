@@ -0,0 +1,111 @@
+import pytest
+from fastapi.testclient import TestClient
+from app import main
+from app.utils import memory_broker
+from app.utils.admission import AdmissionController, Overloaded
+from app.utils.codec import make_message
+from app.utils.rabbitmq import RabbitMQClient
+
+def depth_probe(depths, calls=None):
+    async def get_depth(stage):
+        if calls is not None:
+            calls.append(stage)
+        return depths.get(stage)
+    return get_depth
+
+@pytest.mark.asyncio
+async def test_admits_below_limits():
+    controller = AdmissionController(depth_probe({"video_enhancement": 5}), max_queue_depth=10, max_wait=0)
+    await controller.check(["video_enhancement", "metadata_extraction"])
+    assert controller.stats == {"admitted": 1, "rejected": 0}
+
+@pytest.mark.asyncio
+async def test_rejects_deep_queue_with_retry_estimate():
+    """Retry-After is the time to work off the excess at the observed rate"""
+    controller = AdmissionController(depth_probe({"video_enhancement": 20}), max_queue_depth=10, max_wait=0,
+                                     rate_window=10)
+    controller._started -= 100
+    for _ in range(5):
+        controller.record_completion("video_enhancement")
+
+    with pytest.raises(Overloaded) as raised:
+        await controller.check(["video_enhancement"])
+    # 11 tasks over the limit at 0.5 tasks per second
+    assert raised.value.retry_after == 22
+    assert raised.value.stage == "video_enhancement"
+    assert controller.stats["rejected"] == 1
+
+@pytest.mark.asyncio
+async def test_rejects_when_backlog_takes_too_long():
+    """A queue under the depth limit is refused if it would take longer than max_wait"""
+    controller = AdmissionController(depth_probe({"metadata_extraction": 50}), max_queue_depth=1000, max_wait=60,
+                                     rate_window=100)
+    controller._started -= 1000
+    for _ in range(50):
+        controller.record_completion("metadata_extraction")
+
+    # 0.5 tasks per second: 100s of queued work, 30 tasks too many
+    with pytest.raises(Overloaded) as raised:
+        await controller.check(["metadata_extraction"])
+    assert raised.value.retry_after == 40
+
+def test_repeated_completion_counted_once():
+    """A status message delivered twice is one completion"""
+    controller = AdmissionController(depth_probe({}), rate_window=10)
+    controller.record_completion("video_enhancement", now=100, task_id=("f1", "t1"))
+    controller.record_completion("video_enhancement", now=101, task_id=("f1", "t1"))
+    controller.record_completion("video_enhancement", now=101, task_id=("f1", "t2"))
+    controller.record_completion("metadata_extraction", now=101, task_id=("f1", "t1"))
+    assert len(controller._completions["video_enhancement"]) == 2
+    assert len(controller._completions["metadata_extraction"]) == 1
+
+@pytest.mark.asyncio
+async def test_unknown_rate_and_depth():
+    """Without a rate the default Retry-After is used; without a depth the upload is admitted"""
+    controller = AdmissionController(depth_probe({"video_enhancement": 10}), max_queue_depth=10,
+                                     default_retry_after=45)
+    with pytest.raises(Overloaded) as raised:
+        await controller.check(["video_enhancement"])
+    assert raised.value.retry_after == 45
+
+    await controller.check(["metadata_extraction"])
+    assert controller.stats["admitted"] == 1
+
+@pytest.mark.asyncio
+async def test_depth_is_cached():
+    calls = []
+    controller = AdmissionController(depth_probe({}, calls), max_queue_depth=10, depth_cache_seconds=60)
+    for _ in range(3):
+        await controller.check(["video_enhancement"])
+    assert calls == ["video_enhancement"]
+
+@pytest.mark.asyncio
+async def test_queue_depth_from_passive_declare():
+    """The client reads the number of waiting tasks of a stage's queue"""
+    memory_broker.reset()
+    client = RabbitMQClient("memory://admission")
+    assert await client.get_queue_depth("video_enhancement") is None
+
+    queue = await client.create_queue("video_enhancement_priority_queue", "video_enhancement")
+    for _ in range(3):
+        await client.task_exchange.publish(make_message({"file_id": "f"}), routing_key="video_enhancement")
+    assert await client.get_queue_depth("video_enhancement") == 3
+    assert queue.name == "video_enhancement_priority_queue"
+    await client.close()
+    memory_broker.reset()
+
+def test_upload_refused_when_overloaded(monkeypatch, tmp_path):
+    """An overloaded API answers 503 with Retry-After and does not store the file"""
+    controller = AdmissionController(depth_probe({"video_enhancement": 500}), max_queue_depth=100,
+                                     default_retry_after=30)
+    monkeypatch.setattr(main, "admission", controller)
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+
+    response = TestClient(main.app).post(
+        "/upload",
+        files={"file": ("clip.mp4", b"data", "video/mp4")},
+        params={"client_id": "test_client"}
+    )
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "30"
+    assert list(tmp_path.iterdir()) == []
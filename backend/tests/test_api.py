@@ -1,10 +1,19 @@
 import pytest
 from fastapi.testclient import TestClient
 import os
-from app.main import app
+from app import main
+from app.main import app, rabbitmq_client
 
 client = TestClient(app)
 
+@pytest.fixture(autouse=True)
+def api_settings(tmp_path, monkeypatch):
+    # Use the in-process broker so the API tests do not need RabbitMQ
+    monkeypatch.setattr(rabbitmq_client, "url", "memory://test-api")
+    # The dummy uploads below are not real videos, so skip the upload probe
+    monkeypatch.setattr(main, "PROBE_ON_UPLOAD", False)
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+
 def test_websocket_connection():
     with client.websocket_connect("/ws/test_client") as websocket:
         data = websocket.receive_text()
@@ -0,0 +1,115 @@
+import asyncio
+import pytest
+import pytest_asyncio
+from app import main
+from app.utils import memory_broker
+from app.utils.batching import MessageBatcher
+from app.utils.codec import make_message
+from app.utils.state import ProcessingState
+
+@pytest_asyncio.fixture
+async def channel():
+    memory_broker.reset()
+    connection = await memory_broker.connect("memory://batching")
+    channel = await connection.channel()
+    yield channel
+    await connection.close()
+    memory_broker.reset()
+
+async def publish(channel, queue, bodies):
+    for body in bodies:
+        await channel.default_exchange.publish(make_message(body), routing_key=queue.name)
+
+@pytest.mark.asyncio
+async def test_full_batch_handled_at_once(channel):
+    """Messages are handed over in batches of max_size and acknowledged together"""
+    batches = []
+
+    async def handler(messages):
+        batches.append(len(messages))
+
+    batcher = MessageBatcher(handler, max_size=4, max_wait=10)
+    queue = await channel.declare_queue("status")
+    await queue.consume(batcher.add)
+    await publish(channel, queue, [{"n": n} for n in range(8)])
+    await asyncio.sleep(0.01)
+
+    assert batches == [4, 4]
+    assert channel._unacked == {}
+    assert batcher.stats == {"messages": 8, "batches": 2, "errors": 0}
+
+@pytest.mark.asyncio
+async def test_partial_batch_flushed_after_wait(channel):
+    """A partial batch waits at most max_wait"""
+    batches = []
+
+    async def handler(messages):
+        batches.append(len(messages))
+
+    batcher = MessageBatcher(handler, max_size=100, max_wait=0.02)
+    queue = await channel.declare_queue("status")
+    await queue.consume(batcher.add)
+    await publish(channel, queue, [{"n": n} for n in range(3)])
+    await asyncio.sleep(0)
+    assert batches == []
+
+    await asyncio.sleep(0.05)
+    assert batches == [3]
+    assert channel._unacked == {}
+
+@pytest.mark.asyncio
+async def test_failed_batch_still_acknowledged(channel):
+    """A failing handler is logged and does not block the queue"""
+    async def handler(messages):
+        raise RuntimeError("boom")
+
+    batcher = MessageBatcher(handler, max_size=2, max_wait=10)
+    queue = await channel.declare_queue("status")
+    await queue.consume(batcher.add)
+    await publish(channel, queue, [{"n": 1}, {"n": 2}])
+    await asyncio.sleep(0.01)
+
+    assert batcher.stats["errors"] == 1
+    assert channel._unacked == {}
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+@pytest.mark.asyncio
+async def test_status_batch_updates_state_and_clients(channel, tmp_path, monkeypatch):
+    """A batch becomes one state update per file and task, sent in order per client"""
+    store = ProcessingState(db_path=str(tmp_path / "states.db"), legacy_states_file=None, flush_interval=60)
+    store.create_state("f1", "client_1")
+    store.create_state("f2", "client_2")
+    websockets = {"client_1": FakeWebSocket()}
+    monkeypatch.setattr(main, "processing_state", store)
+    monkeypatch.setattr(main, "active_connections", websockets)
+
+    queue = await channel.declare_queue("status")
+    await publish(channel, queue, [
+        {"type": "metadata_extraction_status", "file_id": "f1", "status": "processing", "progress": 10,
+         "timestamp": "2024-01-01T00:00:01"},
+        {"type": "metadata_extraction_status", "file_id": "f1", "status": "completed", "progress": 100,
+         "timestamp": "2024-01-01T00:00:02"},
+        {"type": "video_enhancement_status", "file_id": "f1", "status": "processing", "progress": 30,
+         "timestamp": "2024-01-01T00:00:01"},
+        {"type": "video_enhancement_status", "file_id": "f2", "status": "processing", "progress": 50,
+         "timestamp": "2024-01-01T00:00:01"},
+        {"type": "something_else", "file_id": "f2"},
+    ])
+    messages = [await queue.get() for _ in range(5)]
+    await main.handle_status_batch(messages)
+
+    assert store.get_state("f1")["metadata_extraction"]["status"] == "completed"
+    assert store.get_state("f1")["video_enhancement"]["progress"] == 30
+    assert store.get_state("f2")["video_enhancement"]["progress"] == 50
+    assert store.get_stats()["sync_writes"] == 1
+    assert [(update["process_type"], update["status"]) for update in websockets["client_1"].sent] == [
+        ("metadata_extraction", "completed"),
+        ("video_enhancement", "processing"),
+    ]
+    store.close()
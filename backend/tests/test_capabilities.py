@@ -0,0 +1,90 @@
+import stat
+import pytest
+from fastapi.testclient import TestClient
+from app import main
+from app.utils import capabilities
+from app.utils.capabilities import Capabilities, get_capabilities
+from app.workers import frame_pipeline
+
+ENCODERS = """Encoders:
+ V..... = Video
+ A..... = Audio
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC (codec h264)
+ V....D mpeg4                MPEG-4 part 2
+ A....D aac                  AAC (Advanced Audio Coding)
+"""
+
+@pytest.fixture(autouse=True)
+def redetect_capabilities():
+    capabilities.reset()
+    yield
+    capabilities.reset()
+
+def install_tools(tmp_path, monkeypatch, tools):
+    """Replace PATH with a directory holding the given shell scripts"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, script in tools.items():
+        tool = bin_dir / name
+        tool.write_text("#!/bin/sh\n" + script)
+        tool.chmod(tool.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", str(bin_dir))
+
+def test_detects_binaries_versions_and_encoders(tmp_path, monkeypatch):
+    ffmpeg = (
+        'if [ "$1" = "-version" ]; then echo "ffmpeg version 6.1 Copyright"; echo more; exit 0; fi\n'
+        f"printf '%s' '{ENCODERS}'\n"
+    )
+    install_tools(tmp_path, monkeypatch, {"ffmpeg": ffmpeg, "ffprobe": 'echo "ffprobe version 6.1"\n'})
+
+    caps = Capabilities.detect()
+    assert caps.has("ffmpeg") and caps.has("ffprobe")
+    assert caps.versions["ffmpeg"] == "ffmpeg version 6.1 Copyright"
+    assert caps.encoders == ["libx264", "mpeg4", "aac"]
+    assert caps.can_encode("libx264")
+    assert not caps.can_encode("libx265")
+    assert caps.to_dict()["binaries"]["ffprobe"]["path"] == str(tmp_path / "bin" / "ffprobe")
+
+def test_missing_or_broken_tools_are_unavailable(tmp_path, monkeypatch):
+    install_tools(tmp_path, monkeypatch, {"ffprobe": "exit 1\n"})
+
+    caps = Capabilities.detect()
+    assert not caps.has("ffmpeg")
+    assert not caps.has("ffprobe")
+    assert not caps.can_encode("libx264")
+    assert caps.to_dict()["encoders"] is None
+
+def test_detected_once_per_process(monkeypatch):
+    calls = []
+    detected = Capabilities({}, {}, None, "4.x", "mp4v")
+    monkeypatch.setattr(Capabilities, "detect", classmethod(lambda cls: calls.append(1) or detected))
+
+    assert get_capabilities() is detected
+    assert get_capabilities() is detected
+    assert len(calls) == 1
+
+def test_video_writer_tries_detected_codec_first(tmp_path, monkeypatch):
+    capabilities.install(Capabilities({}, {}, None, "4.x", "mp4v"))
+    tried = []
+
+    class FakeWriter:
+        def __init__(self, path, fourcc, fps, size):
+            tried.append(fourcc)
+
+        def isOpened(self):
+            return True
+
+    monkeypatch.setattr(frame_pipeline.cv2, "VideoWriter", FakeWriter)
+    frame_pipeline.open_video_writer(str(tmp_path / "out.mp4"), 25, (16, 16))
+    assert tried == [frame_pipeline.cv2.VideoWriter_fourcc(*"mp4v")]
+
+def test_diagnostics_endpoint(monkeypatch):
+    capabilities.install(Capabilities({"ffprobe": "/usr/bin/ffprobe"}, {"ffprobe": "ffprobe version 6.1"},
+                                      None, "4.x", "avc1"))
+    response = TestClient(main.app).get("/internal/capabilities")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["binaries"]["ffprobe"] == {"path": "/usr/bin/ffprobe", "version": "ffprobe version 6.1"}
+    assert data["binaries"]["ffmpeg"] == {"path": None, "version": None}
+    assert data["opencv"]["writer_codec"] == "avc1"
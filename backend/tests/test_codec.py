@@ -0,0 +1,37 @@
+import json
+import pytest
+import aio_pika
+from app.utils.codec import decode_body, get_codec, make_message
+
+STATUS = {
+    "type": "video_enhancement_status",
+    "file_id": "0b8a3c52-5a4e-4f0e-9d55-3f1f3c0e2a11",
+    "status": "processing",
+    "progress": 42,
+    "error": None,
+    "timestamp": "2024-03-20T12:00:00.000000"
+}
+
+@pytest.mark.parametrize("codec_name", ["json", "msgpack"])
+def test_round_trip(codec_name):
+    """Messages decode to the same dict whichever codec encoded them"""
+    message = make_message(STATUS, aio_pika.DeliveryMode.NOT_PERSISTENT, codec_name)
+    assert message.content_type == get_codec(codec_name).content_type
+    assert message.delivery_mode == aio_pika.DeliveryMode.NOT_PERSISTENT
+    assert decode_body(message.body, message.content_type) == STATUS
+
+def test_msgpack_is_smaller():
+    """The binary encoding is more compact than JSON"""
+    assert len(get_codec("msgpack").encode(STATUS)) < len(get_codec("json").encode(STATUS))
+
+def test_messages_without_content_type_are_json():
+    """Messages from older publishers carry no content type"""
+    assert decode_body(json.dumps(STATUS).encode(), None) == STATUS
+    assert decode_body(json.dumps(STATUS).encode(), "application/json; charset=utf-8") == STATUS
+
+def test_unknown_codec_or_content_type():
+    """Unknown encodings are rejected with ValueError"""
+    with pytest.raises(ValueError):
+        get_codec("xml")
+    with pytest.raises(ValueError):
+        decode_body(b"<status/>", "application/xml")
@@ -0,0 +1,78 @@
+import pytest
+import cv2
+import numpy as np
+from app.workers.color_profile import (
+    compute_color_profile,
+    extract_color_profile,
+    sample_frames,
+    sample_positions
+)
+
+WIDTH, HEIGHT = 320, 240
+
+@pytest.fixture
+def fade_in_video(tmp_path):
+    """Black first frames, then a steady colour"""
+    path = str(tmp_path / "fade.mp4")
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 25, (WIDTH, HEIGHT))
+    for i in range(50):
+        frame = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+        if i >= 5:
+            frame[:] = (40, 120, 200)
+        out.write(frame)
+    out.release()
+    return path
+
+def test_matches_per_channel_calchist():
+    """The vectorised profile equals calcHist/normalize and the pixel mean"""
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=(48, 64, 3), dtype=np.uint8)
+
+    profile = compute_color_profile(frame[np.newaxis])
+
+    for i, color in enumerate(['b', 'g', 'r']):
+        hist = cv2.calcHist([frame], [i], None, [256], [0, 256])
+        expected = cv2.normalize(hist, hist).flatten()
+        assert np.allclose(profile["histograms"][color], expected, atol=1e-6)
+    average = frame.reshape(-1, 3).mean(axis=0).astype(int).tolist()
+    assert [profile["average_color"][c] for c in 'bgr'] == average
+    assert profile["sampled_frames"] == 1
+
+def test_positions_spread_over_video():
+    assert sample_positions(100, 4) == [12, 37, 62, 87]
+    assert sample_positions(3, 8) == [0, 1, 2]
+    assert sample_positions(0, 8) == [0]
+
+def test_profile_represents_whole_video(fade_in_video):
+    cap = cv2.VideoCapture(fade_in_video)
+    try:
+        profile = extract_color_profile(cap, 50, samples=4, max_side=80)
+    finally:
+        cap.release()
+
+    # The black opening frames are not what the video looks like
+    average = profile["average_color"]
+    assert abs(average["b"] - 40) < 8 and abs(average["g"] - 120) < 8 and abs(average["r"] - 200) < 8
+    assert profile["sampled_frames"] == 4
+
+def test_fixed_number_of_downscaled_reads(fade_in_video):
+    class CountingCapture:
+        def __init__(self, cap):
+            self.cap = cap
+            self.reads = 0
+
+        def set(self, prop, value):
+            return self.cap.set(prop, value)
+
+        def read(self):
+            self.reads += 1
+            return self.cap.read()
+
+    cap = CountingCapture(cv2.VideoCapture(fade_in_video))
+    try:
+        frames = sample_frames(cap, 50, samples=6, max_side=64)
+    finally:
+        cap.cap.release()
+
+    assert cap.reads == 6
+    assert frames.shape == (6, 48, 64, 3)
@@ -0,0 +1,61 @@
+import time
+import asyncio
+import threading
+import pytest
+from app.utils.executor import run_blocking
+
+@pytest.mark.asyncio
+async def test_run_blocking_returns_result():
+    """The blocking function runs in another thread and its result is returned"""
+    loop_thread = threading.get_ident()
+    result = await run_blocking(lambda a, b: (a + b, threading.get_ident()), 2, 3)
+    assert result[0] == 5
+    assert result[1] != loop_thread
+
+@pytest.mark.asyncio
+async def test_progress_is_forwarded_in_order():
+    """Progress reported from the thread reaches the loop in order before returning"""
+    received = []
+
+    def work(report):
+        for progress in (10, 20, 30):
+            report(progress)
+        return "done"
+
+    async def on_progress(progress):
+        received.append(progress)
+
+    assert await run_blocking(work, on_progress=on_progress) == "done"
+    assert received == [10, 20, 30]
+
+@pytest.mark.asyncio
+async def test_event_loop_stays_responsive():
+    """Other coroutines keep running while blocking work is in progress"""
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    task = asyncio.create_task(ticker())
+    await run_blocking(time.sleep, 0.2)
+    task.cancel()
+    assert ticks >= 5
+
+@pytest.mark.asyncio
+async def test_errors_propagate_after_progress():
+    """Exceptions from the blocking function are raised after pending progress is delivered"""
+    received = []
+
+    def work(report):
+        report(50)
+        raise ValueError("broken")
+
+    async def on_progress(progress):
+        received.append(progress)
+
+    with pytest.raises(ValueError, match="broken"):
+        await run_blocking(work, on_progress=on_progress)
+    assert received == [50]
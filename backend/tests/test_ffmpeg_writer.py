@@ -0,0 +1,132 @@
+import os
+import stat
+import pytest
+import cv2
+import numpy as np
+from app.utils import capabilities
+from app.utils.capabilities import Capabilities
+from app.workers.ffmpeg_writer import FFmpegPipeWriter, build_ffmpeg_command
+from app.workers.video_enhancement_worker import VideoEnhancementWorker
+
+WIDTH, HEIGHT = 64, 48
+FRAME_COUNT = 20
+
+# Stand-in ffmpeg that stores whatever arrives on stdin in the output file
+FAKE_FFMPEG = """#!/bin/sh
+for last; do :; done
+cat > "$last"
+"""
+
+FAILING_FFMPEG = """#!/bin/sh
+cat > /dev/null
+echo "Unknown encoder 'libx264'" >&2
+exit 1
+"""
+
+def install_fake_ffmpeg(directory, script, monkeypatch):
+    """Put a fake ffmpeg executable first on PATH"""
+    path = os.path.join(directory, "ffmpeg")
+    with open(path, "w") as f:
+        f.write(script)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{directory}{os.pathsep}{os.environ.get('PATH', '')}")
+    # Tools are detected once per process; register the stand-in directly
+    capabilities.install(Capabilities({"ffmpeg": path}, {"ffmpeg": "ffmpeg (test)"}, None, cv2.__version__, None))
+
+@pytest.fixture(autouse=True)
+def redetect_capabilities():
+    yield
+    capabilities.reset()
+
+@pytest.fixture
+def sample_video(tmp_path):
+    """Create a small test video"""
+    output_path = str(tmp_path / "sample.mp4")
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), 25, (WIDTH, HEIGHT))
+    for i in range(FRAME_COUNT):
+        out.write(np.full((HEIGHT, WIDTH, 3), i * 10, dtype=np.uint8))
+    out.release()
+    return output_path
+
+def test_command_encodes_web_compatible_mp4():
+    """Piped frames are encoded to H.264 yuv420p with faststart"""
+    cmd = build_ffmpeg_command("ffmpeg", "out.mp4", 25.0, (WIDTH, HEIGHT))
+    assert cmd[cmd.index('-f') + 1] == 'rawvideo'
+    assert cmd[cmd.index('-pix_fmt') + 1] == 'bgr24'
+    assert cmd[cmd.index('-s') + 1] == f"{WIDTH}x{HEIGHT}"
+    assert 'libx264' in cmd
+    assert 'yuv420p' in cmd
+    assert '+faststart' in cmd
+    assert '-c:a' not in cmd
+    assert cmd[-1] == "out.mp4"
+
+def test_command_audio_copy_or_reencode():
+    """MP4-compatible audio is copied, anything else becomes AAC"""
+    copied = build_ffmpeg_command("ffmpeg", "out.mp4", 25.0, (WIDTH, HEIGHT), "in.mov", "aac")
+    assert copied[copied.index('-c:a') + 1] == 'copy'
+    assert '1:a:0?' in copied
+
+    reencoded = build_ffmpeg_command("ffmpeg", "out.mp4", 25.0, (WIDTH, HEIGHT), "in.webm", "vorbis")
+    assert reencoded[reencoded.index('-c:a') + 1] == 'aac'
+
+    unknown = build_ffmpeg_command("ffmpeg", "out.mp4", 25.0, (WIDTH, HEIGHT), "in.avi", None)
+    assert unknown[unknown.index('-c:a') + 1] == 'aac'
+
+def test_writer_streams_raw_frames(tmp_path, monkeypatch):
+    """Every frame reaches ffmpeg's stdin as raw BGR bytes"""
+    install_fake_ffmpeg(str(tmp_path), FAKE_FFMPEG, monkeypatch)
+    output_path = str(tmp_path / "out.mp4")
+
+    writer = FFmpegPipeWriter(output_path, 25.0, (WIDTH, HEIGHT))
+    assert writer.isOpened()
+    for i in range(5):
+        writer.write(np.full((HEIGHT, WIDTH, 3), i, dtype=np.uint8))
+    writer.release()
+
+    with open(output_path, "rb") as f:
+        data = np.frombuffer(f.read(), dtype=np.uint8)
+    assert data.size == 5 * WIDTH * HEIGHT * 3
+    assert np.array_equal(data.reshape(5, HEIGHT, WIDTH, 3)[:, 0, 0, 0], np.arange(5))
+
+def test_writer_reports_ffmpeg_failure(tmp_path, monkeypatch):
+    """A failing ffmpeg surfaces its error output on release"""
+    install_fake_ffmpeg(str(tmp_path), FAILING_FFMPEG, monkeypatch)
+
+    writer = FFmpegPipeWriter(str(tmp_path / "out.mp4"), 25.0, (WIDTH, HEIGHT))
+    writer.write(np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8))
+    with pytest.raises(RuntimeError, match="libx264"):
+        writer.release()
+
+@pytest.mark.parametrize("script,direct", [(FAKE_FFMPEG, True), (FAILING_FFMPEG, False)])
+@pytest.mark.asyncio
+async def test_enhance_video_single_encode(sample_video, tmp_path, monkeypatch, script, direct):
+    """The worker encodes through the pipe and falls back to OpenCV if it fails"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    install_fake_ffmpeg(str(bin_dir), script, monkeypatch)
+
+    worker = VideoEnhancementWorker()
+    worker.processed_dir = str(tmp_path / "processed")
+    worker.thumbnails_dir = str(tmp_path / "thumbnails")
+    os.makedirs(worker.processed_dir)
+    os.makedirs(worker.thumbnails_dir)
+
+    async def record_status(file_id, status, progress=0, error=None):
+        pass
+    worker.update_status = record_status
+
+    result = await worker.enhance_video({"file_id": "pipe_test", "filepath": sample_video})
+
+    assert result["status"] == "completed"
+    assert result["output_path"].endswith("_enhanced.mp4")
+    assert os.path.exists(result["output_path"])
+    size = os.path.getsize(result["output_path"])
+    if direct:
+        assert size == FRAME_COUNT * WIDTH * HEIGHT * 3
+    else:
+        # OpenCV output was kept after the pipe failed
+        cap = cv2.VideoCapture(result["output_path"])
+        assert int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) == FRAME_COUNT
+        cap.release()
+    # No temporary files left behind
+    assert os.listdir(worker.processed_dir) == [os.path.basename(result["output_path"])]
@@ -0,0 +1,42 @@
+import pytest
+import numpy as np
+from app.workers.frame_enhancer import FrameEnhancer, enhance_frame_reference
+from app.workers.video_enhancement_worker import VideoEnhancementWorker
+
+@pytest.mark.parametrize("shape", [(480, 640, 3), (37, 53, 3), (64, 48), (1, 1, 3)])
+def test_matches_reference(shape):
+    """FrameEnhancer's in-place convertScaleAbs and filter2D must produce exactly the reference output"""
+    rng = np.random.default_rng(42)
+    frame = rng.integers(0, 256, shape, dtype=np.uint8)
+
+    enhancer = FrameEnhancer()
+    assert np.array_equal(enhancer.enhance(frame), enhance_frame_reference(frame))
+
+def test_extreme_values_saturate():
+    """Black and white frames saturate the same way as the reference"""
+    enhancer = FrameEnhancer()
+    for value in (0, 255):
+        frame = np.full((16, 16, 3), value, dtype=np.uint8)
+        assert np.array_equal(enhancer.enhance(frame), enhance_frame_reference(frame))
+
+def test_buffers_reused_per_resolution():
+    """Frames of the same resolution reuse the same output buffer"""
+    enhancer = FrameEnhancer()
+    first = enhancer.enhance(np.zeros((32, 32, 3), dtype=np.uint8))
+    second = enhancer.enhance(np.ones((32, 32, 3), dtype=np.uint8))
+    other = enhancer.enhance(np.zeros((16, 16, 3), dtype=np.uint8))
+
+    assert first is second
+    assert other is not first
+
+    out = np.empty((32, 32, 3), dtype=np.uint8)
+    assert enhancer.enhance(np.zeros((32, 32, 3), dtype=np.uint8), out=out) is out
+
+def test_worker_enhance_frame():
+    """The worker delegates to the engine and keeps the frame shape"""
+    worker = VideoEnhancementWorker()
+    frame = np.random.default_rng(1).integers(0, 256, (48, 64, 3), dtype=np.uint8)
+
+    enhanced = worker.enhance_frame(frame)
+    assert enhanced.shape == frame.shape
+    assert np.array_equal(enhanced, enhance_frame_reference(frame))
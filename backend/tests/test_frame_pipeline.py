@@ -0,0 +1,115 @@
+import os
+import pytest
+import cv2
+import numpy as np
+from app.workers.frame_enhancer import FrameEnhancer
+from app.workers.frame_pipeline import FramePipeline
+from app.workers.video_enhancement_worker import VideoEnhancementWorker
+
+FRAME_COUNT = 40
+WIDTH, HEIGHT = 64, 48
+
+@pytest.fixture
+def sample_video(tmp_path):
+    """Create a small video whose frames all differ"""
+    output_path = str(tmp_path / "sample.mp4")
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), 25, (WIDTH, HEIGHT))
+    for i in range(FRAME_COUNT):
+        frame = np.full((HEIGHT, WIDTH, 3), i * 5, dtype=np.uint8)
+        cv2.rectangle(frame, (i, 5), (i + 10, 20), (255, 255, 255), -1)
+        out.write(frame)
+    out.release()
+    return output_path
+
+class ListWriter:
+    """Collects written frames instead of encoding them"""
+    def __init__(self):
+        self.frames = []
+
+    def write(self, frame):
+        self.frames.append(frame.copy())
+
+def serial_enhance(path):
+    """Enhance all frames of a video one after another"""
+    enhancer = FrameEnhancer()
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(enhancer.enhance(frame).copy())
+    cap.release()
+    return frames
+
+@pytest.mark.parametrize("threads,in_flight", [(1, 1), (3, 4), (4, 32)])
+def test_pipeline_matches_serial_order(sample_video, threads, in_flight):
+    """Frames come out enhanced and in their original order"""
+    expected = serial_enhance(sample_video)
+    writer = ListWriter()
+    written_indexes = []
+
+    cap = cv2.VideoCapture(sample_video)
+    pipeline = FramePipeline(
+        cap,
+        writer,
+        enhancer_threads=threads,
+        max_frames_in_flight=in_flight,
+        on_frame_written=lambda index, frame: written_indexes.append(index)
+    )
+    assert pipeline.run() == len(expected)
+    cap.release()
+
+    assert written_indexes == list(range(len(expected)))
+    assert len(writer.frames) == len(expected)
+    for got, want in zip(writer.frames, expected):
+        assert np.array_equal(got, want)
+
+def test_pipeline_propagates_writer_errors(sample_video):
+    """A failing stage stops the pipeline and its error is raised"""
+    class FailingWriter:
+        def write(self, frame):
+            raise IOError("disk full")
+
+    cap = cv2.VideoCapture(sample_video)
+    pipeline = FramePipeline(cap, FailingWriter(), enhancer_threads=2, max_frames_in_flight=4)
+    with pytest.raises(IOError, match="disk full"):
+        pipeline.run()
+    cap.release()
+
+def test_pipeline_deadline(sample_video):
+    """An expired deadline fails the pipeline with a timeout"""
+    cap = cv2.VideoCapture(sample_video)
+    pipeline = FramePipeline(cap, ListWriter(), deadline=0)
+    with pytest.raises(TimeoutError):
+        pipeline.run()
+    cap.release()
+
+@pytest.mark.asyncio
+async def test_enhance_video_uses_pipeline(sample_video, tmp_path):
+    """enhance_video writes the enhanced video, thumbnail and progress updates"""
+    worker = VideoEnhancementWorker()
+    worker.processed_dir = str(tmp_path / "processed")
+    worker.thumbnails_dir = str(tmp_path / "thumbnails")
+    os.makedirs(worker.processed_dir)
+    os.makedirs(worker.thumbnails_dir)
+
+    updates = []
+    async def record_status(file_id, status, progress=0, error=None):
+        updates.append((status, progress))
+    worker.update_status = record_status
+
+    result = await worker.enhance_video({"file_id": "pipeline_test", "filepath": sample_video})
+
+    assert result["status"] == "completed"
+    assert os.path.exists(result["output_path"])
+    assert result["thumbnail_path"] is not None
+
+    # Frame progress (after the initial 10%) arrives in order
+    progress_values = [progress for status, progress in updates if status == "processing"][1:]
+    assert progress_values == sorted(progress_values)
+    assert updates[-1] == ("completed", 100)
+
+    cap = cv2.VideoCapture(result["output_path"])
+    assert int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) == FRAME_COUNT
+    cap.release()
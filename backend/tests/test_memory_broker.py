@@ -0,0 +1,205 @@
+import asyncio
+import pytest
+import pytest_asyncio
+import aio_pika
+from aio_pika.exceptions import ChannelPreconditionFailed, QueueEmpty
+from app.utils import memory_broker
+from app.utils.codec import make_message, decode_body
+from app.utils.rabbitmq import RabbitMQClient
+from app.utils.retry import RetryPolicy
+from app.workers.metadata_extraction_worker import MetadataExtractionWorker
+
+URL = "memory://test"
+
+@pytest_asyncio.fixture
+async def channel():
+    memory_broker.reset()
+    connection = await memory_broker.connect(URL)
+    yield await connection.channel()
+    await connection.close()
+    memory_broker.reset()
+
+def message(body, priority=None):
+    return make_message(body, priority=priority)
+
+async def drain(queue):
+    bodies = []
+    while True:
+        incoming = await queue.get(fail=False)
+        if incoming is None:
+            return bodies
+        await incoming.ack()
+        bodies.append(decode_body(incoming.body, incoming.content_type))
+
+@pytest.mark.asyncio
+async def test_direct_fanout_and_default_exchange(channel):
+    """Messages follow the exchange type and the bindings"""
+    direct = await channel.declare_exchange("tasks", aio_pika.ExchangeType.DIRECT, durable=True)
+    fanout = await channel.declare_exchange("status", aio_pika.ExchangeType.FANOUT)
+    first = await channel.declare_queue("first", durable=True)
+    second = await channel.declare_queue("second", durable=True)
+    await first.bind(direct, routing_key="a")
+    await second.bind(direct, routing_key="b")
+    await first.bind(fanout)
+    await second.bind(fanout)
+
+    await direct.publish(message({"n": 1}), routing_key="a")
+    await direct.publish(message({"n": 2}), routing_key="unbound")
+    await fanout.publish(message({"n": 3}), routing_key="")
+    await channel.default_exchange.publish(message({"n": 4}), routing_key="second")
+
+    assert await drain(first) == [{"n": 1}, {"n": 3}]
+    assert await drain(second) == [{"n": 3}, {"n": 4}]
+    assert channel.broker.stats["unroutable"] == 1
+
+@pytest.mark.asyncio
+async def test_priority_order(channel):
+    """Higher priorities are delivered first, FIFO within a priority"""
+    queue = await channel.declare_queue("jobs", arguments={"x-max-priority": 10})
+    for n, priority in enumerate([0, 5, 5, 20, None]):
+        await channel.default_exchange.publish(message({"n": n}, priority), routing_key="jobs")
+
+    assert [body["n"] for body in await drain(queue)] == [3, 1, 2, 0, 4]
+    with pytest.raises(QueueEmpty):
+        await queue.get()
+
+@pytest.mark.asyncio
+async def test_prefetch_limits_unacknowledged_deliveries(channel):
+    """A consumer holds at most prefetch_count unacknowledged messages"""
+    await channel.set_qos(prefetch_count=2)
+    queue = await channel.declare_queue("jobs")
+    received = []
+
+    async def on_message(incoming):
+        received.append(incoming)
+
+    await queue.consume(on_message)
+    for n in range(5):
+        await channel.default_exchange.publish(message({"n": n}), routing_key="jobs")
+    await asyncio.sleep(0)
+    assert len(received) == 2
+    assert queue._queue.message_count == 3
+
+    await received[0].ack()
+    await asyncio.sleep(0)
+    assert len(received) == 3
+
+@pytest.mark.asyncio
+async def test_requeue_and_channel_close_redeliver(channel):
+    """Rejected-with-requeue and unacknowledged messages come back as redelivered"""
+    queue = await channel.declare_queue("jobs")
+    await channel.default_exchange.publish(message({"n": 1}), routing_key="jobs")
+    await channel.default_exchange.publish(message({"n": 2}), routing_key="jobs")
+
+    first = await queue.get()
+    await first.nack(requeue=True)
+    again = await queue.get()
+    assert decode_body(again.body) == {"n": 1} and again.redelivered
+
+    other = await channel.connection.channel()
+    other_queue = await other.declare_queue("jobs")
+    held = await other_queue.get()
+    assert decode_body(held.body) == {"n": 2}
+    await other.close()
+
+    await again.ack()
+    redelivered = await queue.get()
+    assert decode_body(redelivered.body) == {"n": 2} and redelivered.redelivered
+
+@pytest.mark.asyncio
+async def test_process_context_acks_and_rejects(channel):
+    """message.process() acknowledges on success and dead-letters on error"""
+    await channel.declare_exchange("dlx", aio_pika.ExchangeType.FANOUT)
+    dead = await channel.declare_queue("dead")
+    await dead.bind("dlx")
+    queue = await channel.declare_queue("jobs", arguments={"x-dead-letter-exchange": "dlx"})
+    for n in range(2):
+        await channel.default_exchange.publish(message({"n": n}), routing_key="jobs")
+
+    async with (await queue.get()).process():
+        pass
+    with pytest.raises(RuntimeError):
+        async with (await queue.get()).process():
+            raise RuntimeError("boom")
+
+    rejected = await dead.get()
+    assert decode_body(rejected.body) == {"n": 1}
+    assert rejected.headers["x-death"][0]["reason"] == "rejected"
+    assert await queue.get(fail=False) is None
+
+@pytest.mark.asyncio
+async def test_ttl_dead_letters_back_to_stage(channel):
+    """Retry delay queues hand the task back to the stage queue when the TTL expires"""
+    exchange = await channel.declare_exchange("video_tasks_routed", aio_pika.ExchangeType.DIRECT, durable=True)
+    stage_queue = await channel.declare_queue("stage_queue", durable=True)
+    await stage_queue.bind(exchange, routing_key="metadata_extraction")
+    policy = RetryPolicy("metadata_extraction", max_attempts=3, base_delay=0.05, max_delay=0.05)
+    await policy.declare(channel)
+
+    await channel.default_exchange.publish(message({"file_id": "f1"}), routing_key="stage_queue")
+    failed = await stage_queue.get()
+    outcome, delay, attempts = await policy.retry_or_dead_letter(channel, failed, "boom")
+    await failed.ack()
+    assert (outcome, attempts) == ("retry", 1)
+    assert await stage_queue.get(fail=False) is None
+
+    await asyncio.sleep(0.1)
+    retried = await stage_queue.get()
+    assert decode_body(retried.body) == {"file_id": "f1"}
+    assert RetryPolicy.attempts(retried) == 1
+    assert retried.headers["x-death"][0]["reason"] == "expired"
+
+@pytest.mark.asyncio
+async def test_redeclare_with_other_arguments_fails(channel):
+    """Queues and exchanges cannot change their arguments, as in RabbitMQ"""
+    await channel.declare_queue("jobs", durable=True)
+    with pytest.raises(ChannelPreconditionFailed):
+        await channel.declare_queue("jobs", durable=True, arguments={"x-max-priority": 10})
+    await channel.declare_exchange("tasks", aio_pika.ExchangeType.FANOUT)
+    with pytest.raises(ChannelPreconditionFailed):
+        await channel.declare_exchange("tasks", aio_pika.ExchangeType.DIRECT)
+
+@pytest.mark.asyncio
+async def test_exclusive_queue_deleted_with_connection(channel):
+    """Exclusive queues live as long as the connection that declared them"""
+    connection = await memory_broker.connect(URL)
+    other = await connection.channel()
+    queue = await other.declare_queue(exclusive=True)
+    assert queue.name.startswith("amq.gen-")
+    assert queue.name in channel.broker.queues
+
+    await connection.close()
+    assert queue.name not in channel.broker.queues
+
+@pytest.mark.asyncio
+async def test_api_client_and_worker_in_one_process(channel, monkeypatch):
+    """A task published by the API reaches the worker and its status comes back"""
+    client = RabbitMQClient(URL)
+    worker = MetadataExtractionWorker(rabbitmq_url=URL)
+
+    async def fake_extract(data):
+        return {"status": "completed", "metadata": {}}
+
+    monkeypatch.setattr(worker, "extract_metadata", fake_extract)
+    statuses = []
+    done = asyncio.Event()
+
+    async def on_status(incoming):
+        async with incoming.process():
+            status = decode_body(incoming.body, incoming.content_type)
+            statuses.append(status["status"])
+            if status["status"] == "completed":
+                done.set()
+
+    await client.connect()
+    await client.start_consuming_status(on_status)
+    await worker.connect()
+    await worker.queue.consume(worker.process_message)
+
+    await client.publish_task({"file_id": "f1", "filepath": "/tmp/f1.mp4"}, stages=["metadata_extraction"])
+    await asyncio.wait_for(done.wait(), timeout=5)
+
+    assert statuses[0] == "processing" and statuses[-1] == "completed"
+    assert worker.queue._queue.message_count == 0
+    await worker.close()
+    await client.close()
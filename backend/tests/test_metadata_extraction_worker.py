@@ -2,7 +2,12 @@ import os
 import pytest
 import json
 import asyncio
+import threading
+import cv2
+import numpy as np
+from app.workers import metadata_extraction_worker
 from app.workers.metadata_extraction_worker import MetadataExtractionWorker
+from app.utils.probe import InvalidVideo
 
 # Mock test video file path
 TEST_VIDEO_PATH = os.path.join("tests", "resources", "test_video.mp4")
@@ -68,4 +73,166 @@ async def test_extract_metadata(test_message):
     
     # Clean up the created file
     if os.path.exists(result["output_path"]):
-        os.remove(result["output_path"]) 
\ No newline at end of file
+        os.remove(result["output_path"]) 
+@pytest.mark.asyncio
+async def test_extract_metadata_off_event_loop(tmp_path):
+    """Metadata extraction runs in a thread and reports progress back to the loop"""
+    video_path = str(tmp_path / "sample.mp4")
+    out = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), 25, (64, 48))
+    for i in range(10):
+        out.write(np.full((48, 64, 3), i * 20, dtype=np.uint8))
+    out.release()
+
+    worker = MetadataExtractionWorker()
+    worker.metadata_dir = str(tmp_path)
+    updates = []
+    async def record_status(file_id, status, progress=0, error=None):
+        updates.append(progress)
+    worker.update_status = record_status
+
+    result = await worker.extract_metadata({"file_id": "loop_test", "filepath": video_path})
+
+    assert result["status"] == "completed"
+    assert result["metadata"]["resolution"] == {"width": 64, "height": 48}
+    assert updates[0] == 30 and updates[-1] == 100
+    assert os.path.exists(result["output_path"])
+
+class FakeIncomingMessage:
+    """Minimal stand-in for aio_pika.IncomingMessage"""
+    def __init__(self, data, headers=None, redelivered=False):
+        self.body = json.dumps(data).encode()
+        self.content_type = "application/json"
+        self.headers = headers or {}
+        self.priority = None
+        self.redelivered = redelivered
+        self.acked = False
+
+    def process(self, requeue=False):
+        message = self
+        class Processor:
+            async def __aenter__(self):
+                return message
+            async def __aexit__(self, exc_type, exc, tb):
+                message.acked = True
+        return Processor()
+
+@pytest.mark.asyncio
+async def test_concurrency_limits_jobs_in_flight():
+    """No more than `concurrency` jobs are processed at the same time"""
+    worker = MetadataExtractionWorker(concurrency=2)
+    running = 0
+    max_running = 0
+
+    async def fake_extract(data):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        return {"status": "completed"}
+
+    async def record_status(file_id, status, progress=0, error=None):
+        pass
+
+    worker.extract_metadata = fake_extract
+    worker.update_status = record_status
+
+    messages = [FakeIncomingMessage({"file_id": f"job_{i}", "filepath": "x.mp4"}) for i in range(5)]
+    await asyncio.gather(*(worker.process_message(message) for message in messages))
+
+    assert max_running == 2
+    assert all(message.acked for message in messages)
+
+@pytest.mark.asyncio
+async def test_connect_sets_prefetch(monkeypatch):
+    """The prefetch count matches the worker's concurrency"""
+    qos = {}
+
+    class FakeQueue:
+        async def bind(self, exchange, routing_key=None):
+            pass
+
+    class FakeChannel:
+        async def set_qos(self, prefetch_count):
+            qos["prefetch_count"] = prefetch_count
+        async def declare_exchange(self, *args, **kwargs):
+            return object()
+        async def declare_queue(self, *args, **kwargs):
+            return FakeQueue()
+
+    class FakeConnection:
+        async def channel(self, **kwargs):
+            return FakeChannel()
+
+    async def fake_connect(url):
+        return FakeConnection()
+
+    monkeypatch.setattr(metadata_extraction_worker.aio_pika, "connect_robust", fake_connect)
+    worker = MetadataExtractionWorker(concurrency=3)
+    await worker.connect()
+    assert qos["prefetch_count"] == 3
+
+@pytest.mark.asyncio
+async def test_probe_runs_alongside_opencv(tmp_path, monkeypatch):
+    """Without a probe from the upload, ffprobe and the OpenCV read overlap"""
+    video_path = str(tmp_path / "sample.mp4")
+    open(video_path, "wb").close()
+
+    # Each stub waits until the other one has started before it returns,
+    # which only happens without a deadlock if they run at the same time
+    events = []
+    probe_started = threading.Event()
+    read_started = threading.Event()
+
+    async def slow_probe(path, timeout=None):
+        events.append("probe start")
+        probe_started.set()
+        await asyncio.get_running_loop().run_in_executor(None, read_started.wait, 5)
+        events.append("probe end")
+        return {"streams": [{"codec_type": "video"}], "format": {"size": "42", "bit_rate": "1000"}}
+
+    def slow_read(file_id, input_path, start_time, report_progress):
+        events.append("read start")
+        read_started.set()
+        probe_started.wait(5)
+        events.append("read end")
+        return {"file_id": file_id}, None
+
+    monkeypatch.setattr(metadata_extraction_worker, "probe_video", slow_probe)
+    worker = MetadataExtractionWorker()
+    worker.metadata_dir = str(tmp_path)
+    worker.ffprobe_available = True
+    worker._read_video_blocking = slow_read
+    async def record_status(file_id, status, progress=0, error=None):
+        pass
+    worker.update_status = record_status
+
+    result = await worker.extract_metadata({"file_id": "overlap", "filepath": video_path})
+    assert events.index("probe start") < events.index("read end")
+    assert events.index("read start") < events.index("probe end")
+    assert result["status"] == "completed"
+    assert result["metadata"]["file_size_bytes"] == 42
+    assert result["metadata"]["advanced"]["format"]["bit_rate"] == "1000"
+
+@pytest.mark.asyncio
+async def test_file_rejected_by_probe_fails(tmp_path, monkeypatch):
+    video_path = str(tmp_path / "broken.mp4")
+    with open(video_path, "wb") as f:
+        f.write(b"not a video")
+
+    async def reject(path, timeout=None):
+        raise InvalidVideo("FFprobe validation failed: moov atom not found")
+
+    monkeypatch.setattr(metadata_extraction_worker, "probe_video", reject)
+    worker = MetadataExtractionWorker()
+    worker.metadata_dir = str(tmp_path)
+    worker.ffprobe_available = True
+    updates = []
+    async def record_status(file_id, status, progress=0, error=None):
+        updates.append(progress)
+    worker.update_status = record_status
+
+    result = await worker.extract_metadata({"file_id": "broken", "filepath": video_path})
+    assert result["status"] == "failed"
+    assert result["error"] == "Invalid video file: FFprobe validation failed: moov atom not found"
+    assert not os.path.exists(tmp_path / "broken_metadata.json")
@@ -0,0 +1,106 @@
+import os
+import json
+import stat
+import pytest
+from fastapi.testclient import TestClient
+from app import main
+from app.utils import validators, capabilities
+from app.utils.probe import probe_video, audio_codec_from_probe, InvalidVideo
+
+PROBE = {
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "h264", "width": 64, "height": 48},
+        {"index": 1, "codec_type": "audio", "codec_name": "aac"},
+    ],
+    "format": {"format_name": "mov,mp4", "size": "1234", "bit_rate": "800000"},
+}
+
+def fake_ffprobe(tmp_path, monkeypatch, script):
+    """Put an ffprobe stand-in first on PATH"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    ffprobe = bin_dir / "ffprobe"
+    ffprobe.write_text('#!/bin/sh\n[ "$1" = "-version" ] && echo "ffprobe version test" && exit 0\n' + script)
+    ffprobe.chmod(ffprobe.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+    capabilities.reset()
+
+@pytest.fixture(autouse=True)
+def redetect_capabilities():
+    """Tests change the tools on PATH, so detect them again afterwards"""
+    yield
+    capabilities.reset()
+
+@pytest.mark.asyncio
+async def test_probe_returns_format_and_streams(tmp_path, monkeypatch):
+    fake_ffprobe(tmp_path, monkeypatch, f"cat <<'EOF'\n{json.dumps(PROBE)}\nEOF\n")
+    probe = await probe_video("clip.mp4")
+    assert probe == PROBE
+    assert audio_codec_from_probe(probe) == "aac"
+
+@pytest.mark.asyncio
+async def test_unreadable_file_rejected(tmp_path, monkeypatch):
+    fake_ffprobe(tmp_path, monkeypatch, "echo 'clip.mp4: Invalid data found' >&2\nexit 1\n")
+    with pytest.raises(InvalidVideo, match="Invalid data found"):
+        await probe_video("clip.mp4")
+
+@pytest.mark.asyncio
+async def test_file_without_video_stream_rejected(tmp_path, monkeypatch):
+    audio_only = {"streams": [{"codec_type": "audio", "codec_name": "mp3"}], "format": {}}
+    fake_ffprobe(tmp_path, monkeypatch, f"echo '{json.dumps(audio_only)}'\n")
+    with pytest.raises(InvalidVideo, match="video stream"):
+        await probe_video("song.mp4")
+
+@pytest.mark.asyncio
+async def test_timeout_and_missing_ffprobe_leave_probing_to_workers(tmp_path, monkeypatch):
+    fake_ffprobe(tmp_path, monkeypatch, "exec sleep 10\n")
+    assert await probe_video("clip.mp4", timeout=0.2) is None
+
+    monkeypatch.setenv("PATH", str(tmp_path / "empty"))
+    capabilities.reset()
+    assert await probe_video("clip.mp4") is None
+
+@pytest.mark.asyncio
+async def test_validation_uses_upload_probe(tmp_path, monkeypatch):
+    """With a probe from the upload, validation does not start ffprobe"""
+    def no_ffprobe():
+        raise AssertionError("ffprobe should not run")
+
+    monkeypatch.setattr(validators, "check_ffprobe_availability", no_ffprobe)
+    video = tmp_path / "clip.mp4"
+    video.write_bytes(b"data")
+
+    assert await validators.validate_video_file(str(video), PROBE) == (True, "")
+    assert (await validators.validate_video_file(str(video), {"streams": []}))[0] is False
+
+@pytest.fixture
+def upload_client(tmp_path, monkeypatch):
+    published = []
+
+    async def publish_task(message, stages=None, priority=None):
+        published.append(message)
+
+    monkeypatch.setattr(main, "PROBE_ON_UPLOAD", True)
+    monkeypatch.setattr(main.rabbitmq_client, "url", "memory://test-probe")
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(main.rabbitmq_client, "publish_task", publish_task)
+    os.makedirs(tmp_path / "uploads")
+    return TestClient(main.app), published
+
+def test_upload_carries_probe_in_task(upload_client, tmp_path, monkeypatch):
+    client, published = upload_client
+    fake_ffprobe(tmp_path, monkeypatch, f"echo '{json.dumps(PROBE)}'\n")
+
+    response = client.post("/upload", files={"file": ("clip.mp4", b"data", "video/mp4")})
+    assert response.status_code == 200
+    assert published[0]["probe"] == PROBE
+
+def test_invalid_upload_never_queued(upload_client, tmp_path, monkeypatch):
+    client, published = upload_client
+    fake_ffprobe(tmp_path, monkeypatch, "echo 'moov atom not found' >&2\nexit 1\n")
+
+    response = client.post("/upload", files={"file": ("clip.mp4", b"data", "video/mp4")})
+    assert response.status_code == 400
+    assert "moov atom not found" in response.json()["detail"]
+    assert published == []
+    assert os.listdir(tmp_path / "uploads") == []
@@ -0,0 +1,54 @@
+import os
+import time
+import asyncio
+import pytest
+from app.utils.process import ProcessTimeout, run_process, run_json
+
+@pytest.mark.asyncio
+async def test_run_process_collects_output():
+    result = await run_process(["sh", "-c", "echo out; echo err >&2; exit 3"], timeout=10)
+    assert result.returncode == 3
+    assert not result.ok
+    assert result.stdout == "out\n"
+    assert result.stderr == "err\n"
+
+@pytest.mark.asyncio
+async def test_run_json_parses_streamed_output():
+    # Printed in pieces with pauses, as ffprobe writes it
+    script = "printf '{\"streams\": ['; sleep 0.1; printf '{\"index\": 0}]}'"
+    result = await run_json(["sh", "-c", script], timeout=10)
+    assert result.data == {"streams": [{"index": 0}]}
+
+    result = await run_json(["sh", "-c", "echo not json"], timeout=10)
+    assert result.ok and result.data is None
+
+@pytest.mark.asyncio
+async def test_output_beyond_limit_is_discarded():
+    result = await run_process(["sh", "-c", "head -c 100000 /dev/zero"], timeout=10, max_output=1000)
+    assert result.ok
+    assert len(result.stdout) == 1000
+
+@pytest.mark.asyncio
+async def test_timeout_kills_process(tmp_path):
+    pid_file = tmp_path / "pid"
+    start = time.monotonic()
+    with pytest.raises(ProcessTimeout):
+        await run_process(["sh", "-c", f"echo $$ > {pid_file}; exec sleep 30"], timeout=0.3)
+    assert time.monotonic() - start < 5
+    assert_not_running(int(pid_file.read_text()))
+
+@pytest.mark.asyncio
+async def test_cancellation_kills_process(tmp_path):
+    pid_file = tmp_path / "pid"
+    task = asyncio.create_task(run_process(["sh", "-c", f"echo $$ > {pid_file}; exec sleep 30"], timeout=None))
+    while not pid_file.exists() or not pid_file.read_text().strip():
+        await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert_not_running(int(pid_file.read_text()))
+
+def assert_not_running(pid):
+    """The process was killed and reaped"""
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
@@ -0,0 +1,97 @@
+import json
+import asyncio
+import pytest
+import aio_pika
+from app.workers.progress_reporter import ProgressReporter, publish_status
+
+class Recorder:
+    def __init__(self):
+        self.sent = []
+
+    async def __call__(self, status_message, persistent):
+        self.sent.append((status_message["status"], status_message["progress"], persistent))
+
+@pytest.mark.asyncio
+async def test_start_and_terminal_are_persistent():
+    """The first and the final status of a job are sent immediately and persistently"""
+    recorder = Recorder()
+    reporter = ProgressReporter("video_enhancement_status", recorder, min_interval=10)
+
+    await reporter.report("f1", "processing", 10)
+    await reporter.report("f1", "completed", 100)
+
+    assert recorder.sent == [("processing", 10, True), ("completed", 100, True)]
+
+@pytest.mark.asyncio
+async def test_progress_is_rate_limited_and_coalesced():
+    """Progress within the interval is held back and only the latest value is sent, transiently"""
+    recorder = Recorder()
+    reporter = ProgressReporter("video_enhancement_status", recorder, min_interval=0.05)
+
+    await reporter.report("f1", "processing", 10)
+    for progress in (20, 30, 40):
+        await reporter.report("f1", "processing", progress)
+    assert recorder.sent == [("processing", 10, True)]
+
+    await asyncio.sleep(0.1)
+    assert recorder.sent == [("processing", 10, True), ("processing", 40, False)]
+    assert reporter.stats["dropped"] == 2
+
+    # After the interval has passed, the next update goes out right away
+    await reporter.report("f1", "processing", 50)
+    assert recorder.sent[-1] == ("processing", 50, False)
+
+@pytest.mark.asyncio
+async def test_terminal_status_supersedes_pending_progress():
+    """Progress still waiting when the job finishes is never sent"""
+    recorder = Recorder()
+    reporter = ProgressReporter("metadata_extraction_status", recorder, min_interval=0.05)
+
+    await reporter.report("f1", "processing", 0)
+    await reporter.report("f1", "processing", 90)
+    await reporter.report("f1", "failed", 0, "boom")
+    await asyncio.sleep(0.1)
+
+    assert recorder.sent == [("processing", 0, True), ("failed", 0, True)]
+
+@pytest.mark.asyncio
+async def test_jobs_are_limited_independently():
+    """Each file has its own interval"""
+    recorder = Recorder()
+    reporter = ProgressReporter("video_enhancement_status", recorder, min_interval=10)
+
+    await reporter.report("f1", "processing", 10)
+    await reporter.report("f2", "processing", 10)
+    assert len(recorder.sent) == 2
+    reporter.close()
+
+@pytest.mark.asyncio
+async def test_publish_status_delivery_mode():
+    """Transient progress uses non-persistent delivery"""
+    published = []
+
+    class Exchange:
+        async def publish(self, message, routing_key):
+            published.append((json.loads(message.body)["progress"], message.delivery_mode))
+
+    exchange = Exchange()
+    await publish_status(None, exchange, {"file_id": "f1", "status": "processing", "progress": 5}, False)
+    await publish_status(None, exchange, {"file_id": "f1", "status": "completed", "progress": 100}, True)
+
+    assert published == [
+        (5, aio_pika.DeliveryMode.NOT_PERSISTENT),
+        (100, aio_pika.DeliveryMode.PERSISTENT),
+    ]
+
+@pytest.mark.asyncio
+async def test_status_change_is_persistent():
+    """A retry (processing -> pending -> processing) is sent immediately, not coalesced"""
+    recorder = Recorder()
+    reporter = ProgressReporter("video_enhancement_status", recorder, min_interval=10)
+
+    await reporter.report("f1", "processing", 40)
+    await reporter.report("f1", "pending", 0, "retrying in 10s")
+    await reporter.report("f1", "processing", 0)
+
+    assert recorder.sent == [("processing", 40, True), ("pending", 0, True), ("processing", 0, True)]
+    reporter.close()
@@ -0,0 +1,308 @@
+import json
+import time
+import asyncio
+import pytest
+import pytest_asyncio
+import aio_pika
+from fastapi import HTTPException
+from app.utils import memory_broker
+from app.utils.codec import decode_body
+from app.utils.rabbitmq import RabbitMQClient, PublisherPool, LEGACY_STATUS_QUEUE, LEGACY_TASK_QUEUES
+from app.workers import video_enhancement_worker, metadata_extraction_worker
+from app.workers.video_enhancement_worker import VideoEnhancementWorker
+from app.workers.metadata_extraction_worker import MetadataExtractionWorker
+from app.main import parse_stages, resolve_priority
+
+class FakeExchange:
+    """Exchange whose confirmations take one simulated broker round trip"""
+    def __init__(self, name, channel_index, log, delay, messages):
+        self.name = name
+        self.channel_index = channel_index
+        self.log = log
+        self.delay = delay
+        self.messages = messages
+
+    async def publish(self, message, routing_key):
+        self.log.append((self.channel_index, self.name, routing_key, json.loads(message.body)))
+        self.messages.append(message)
+        await asyncio.sleep(self.delay)
+        if routing_key == "nack":
+            raise RuntimeError("message was returned")
+
+class FakeChannel:
+    is_closed = False
+
+    def __init__(self, index, log, delay, messages):
+        self.index = index
+        self.log = log
+        self.delay = delay
+        self.messages = messages
+
+    async def get_exchange(self, name, ensure=True):
+        return FakeExchange(name, self.index, self.log, self.delay, self.messages)
+
+    async def close(self):
+        self.is_closed = True
+
+class FakeConnection:
+    is_closed = False
+
+    def __init__(self, delay=0.0):
+        self.published = []
+        self.messages = []
+        self.channels = []
+        self.delay = delay
+
+    async def channel(self, publisher_confirms=True):
+        assert publisher_confirms
+        channel = FakeChannel(len(self.channels), self.published, self.delay, self.messages)
+        self.channels.append(channel)
+        return channel
+
+def message(body):
+    return aio_pika.Message(body=json.dumps(body).encode())
+
+@pytest_asyncio.fixture
+async def client():
+    client = RabbitMQClient()
+    client.connection = FakeConnection()
+    client.publisher = PublisherPool(client.connection, size=2)
+    await client.publisher.open()
+    return client
+
+@pytest.mark.asyncio
+async def test_publish_routes_to_each_stage(client):
+    """A task is published once per stage with the stage as routing key"""
+    await client.publish_task({"file_id": "f1"})
+    published = client.connection.published
+    assert [key for _, _, key, _ in published] == ["video_enhancement", "metadata_extraction"]
+    assert {exchange for _, exchange, _, _ in published} == {"video_tasks_routed"}
+
+@pytest.mark.asyncio
+async def test_publish_selected_stages_only(client):
+    """Disabled stages get no message at all"""
+    await client.publish_task({"file_id": "f1"}, ["metadata_extraction"])
+    assert [(key, body) for _, _, key, body in client.connection.published] == [
+        ("metadata_extraction", {"file_id": "f1"})
+    ]
+
+@pytest.mark.asyncio
+async def test_publish_sets_priority(client):
+    """The task priority is carried on every stage message"""
+    await client.publish_task({"file_id": "f1"}, priority=7)
+    assert [message.priority for message in client.connection.messages] == [7, 7]
+
+def test_resolve_priority():
+    """An explicit priority wins, otherwise smaller uploads rank higher"""
+    mb = 1024 * 1024
+    assert resolve_priority(3, 1 * mb) == 3
+    assert resolve_priority(None, 2 * mb) == 8
+    assert resolve_priority(None, 30 * mb) == 6
+    assert resolve_priority(None, 150 * mb) == 4
+    assert resolve_priority(None, 400 * mb) == 2
+
+@pytest.mark.asyncio
+async def test_pool_confirms_publishes_as_a_group():
+    """Publishes are pipelined, not one round trip each"""
+    pool = PublisherPool(FakeConnection(delay=0.05), size=4)
+    await pool.open()
+
+    started = time.monotonic()
+    confirms = [await pool.publish("processing_status", message({"n": i})) for i in range(40)]
+    assert pool.in_flight == 40
+    await asyncio.gather(*confirms)
+    assert time.monotonic() - started < 1.0  # 40 sequential round trips would take 2s
+    assert pool.in_flight == 0
+    await pool.close()
+
+@pytest.mark.asyncio
+async def test_pool_keeps_order_per_key():
+    """Messages sharing an ordering key go through one channel in order"""
+    connection = FakeConnection(delay=0.01)
+    pool = PublisherPool(connection, size=4)
+    await pool.open()
+
+    for progress in range(10):
+        await pool.publish("processing_status", message({"progress": progress}), ordering_key="file_1")
+    await pool.flush()
+
+    assert len({channel for channel, _, _, _ in connection.published}) == 1
+    assert [body["progress"] for _, _, _, body in connection.published] == list(range(10))
+    await pool.close()
+
+@pytest.mark.asyncio
+async def test_pool_bounds_messages_in_flight():
+    """Publishers wait once max_in_flight messages are unconfirmed"""
+    pool = PublisherPool(FakeConnection(delay=0.02), size=1, max_in_flight=2)
+    await pool.open()
+
+    highest = 0
+    for i in range(6):
+        await pool.publish("processing_status", message({"n": i}))
+        highest = max(highest, pool.in_flight)
+    await pool.flush()
+    assert highest == 2
+    await pool.close()
+
+@pytest.mark.asyncio
+async def test_pool_reports_failed_confirm():
+    """A message the broker rejects fails the caller's confirmation"""
+    pool = PublisherPool(FakeConnection(), size=1)
+    await pool.open()
+    confirm = await pool.publish("processing_status", message({}), routing_key="nack")
+    with pytest.raises(RuntimeError):
+        await confirm
+    await pool.close()
+
+def test_parse_stages():
+    """Stages default to all, keep pipeline order and reject unknown names"""
+    assert parse_stages(None) == ["video_enhancement", "metadata_extraction"]
+    assert parse_stages("metadata_extraction, video_enhancement") == ["video_enhancement", "metadata_extraction"]
+    assert parse_stages("metadata_extraction") == ["metadata_extraction"]
+    with pytest.raises(HTTPException) as exc_info:
+        parse_stages("transcode")
+    assert exc_info.value.status_code == 400
+
+@pytest.mark.parametrize("module,worker_class,stage", [
+    (video_enhancement_worker, VideoEnhancementWorker, "video_enhancement"),
+    (metadata_extraction_worker, MetadataExtractionWorker, "metadata_extraction"),
+])
+@pytest.mark.asyncio
+async def test_worker_queue_for_its_stage(monkeypatch, module, worker_class, stage):
+    """Each worker's priority queue is bound to the direct exchange with its own routing key"""
+    declared = {}
+
+    class FakeQueue:
+        async def bind(self, exchange, routing_key=None):
+            declared["binding"] = (exchange, routing_key)
+
+    class FakeChannel:
+        async def set_qos(self, prefetch_count):
+            pass
+        async def declare_exchange(self, name, exchange_type, **kwargs):
+            declared[name] = exchange_type
+            return name
+        async def declare_queue(self, name, **kwargs):
+            declared.setdefault("queue", (name, kwargs))
+            return FakeQueue()
+
+    class FakeRobustConnection:
+        async def channel(self, **kwargs):
+            return FakeChannel()
+
+    async def fake_connect(url):
+        return FakeRobustConnection()
+
+    monkeypatch.setattr(module.aio_pika, "connect_robust", fake_connect)
+    worker = worker_class()
+    await worker.connect()
+
+    exchange, routing_key = declared["binding"]
+    assert declared[exchange] == aio_pika.ExchangeType.DIRECT
+    assert routing_key == stage
+
+    # Worker queues are priority queues
+    queue_name, queue_kwargs = declared["queue"]
+    assert queue_name == f"{stage}_priority_queue"
+    assert queue_kwargs["arguments"] == {"x-max-priority": 10}
+
+@pytest.mark.asyncio
+async def test_every_api_process_receives_status_updates():
+    """Each API process has its own status queue, so all of them see every update"""
+    memory_broker.reset()
+    url = "memory://replicas"
+    connection = await memory_broker.connect(url)
+    channel = await connection.channel()
+    legacy = await channel.declare_queue(LEGACY_STATUS_QUEUE, durable=True)
+
+    replicas = [RabbitMQClient(url), RabbitMQClient(url)]
+    received = [[], []]
+    for replica, inbox in zip(replicas, received):
+        async def on_status(incoming, inbox=inbox):
+            async with incoming.process():
+                inbox.append(decode_body(incoming.body, incoming.content_type)["file_id"])
+        await replica.connect()
+        await replica.start_consuming_status(on_status)
+
+    assert replicas[0].status_queue.name != replicas[1].status_queue.name
+    assert replicas[0].status_queue.exclusive and replicas[0].status_queue.auto_delete
+    # The old shared queue is removed once nothing consumes it
+    assert legacy.name not in memory_broker.get_broker(url).queues
+
+    status_exchange = await channel.get_exchange("processing_status")
+    await status_exchange.publish(message({"file_id": "f1"}), routing_key="")
+    await asyncio.sleep(0)
+    assert received == [["f1"], ["f1"]]
+
+    # A stopped process leaves no queue behind
+    name = replicas[0].status_queue.name
+    await replicas[0].close()
+    assert name not in memory_broker.get_broker(url).queues
+    await replicas[1].close()
+    await connection.close()
+    memory_broker.reset()
+
+@pytest.mark.asyncio
+async def test_legacy_status_queue_kept_while_consumed():
+    """An older API process still reading the shared queue keeps it alive"""
+    memory_broker.reset()
+    url = "memory://rolling-upgrade"
+    connection = await memory_broker.connect(url)
+    channel = await connection.channel()
+    legacy = await channel.declare_queue(LEGACY_STATUS_QUEUE, durable=True)
+
+    async def old_consumer(incoming):
+        await incoming.ack()
+
+    await legacy.consume(old_consumer)
+    client = RabbitMQClient(url)
+    await client.connect()
+    assert LEGACY_STATUS_QUEUE in memory_broker.get_broker(url).queues
+    await client.close()
+    await connection.close()
+    memory_broker.reset()
+
+@pytest.mark.asyncio
+async def test_legacy_task_queues_drained_into_stages():
+    """Tasks queued on the old fanout exchange reach the new stage queues"""
+    memory_broker.reset()
+    url = "memory://legacy-tasks"
+    connection = await memory_broker.connect(url)
+    channel = await connection.channel()
+    old_exchange = await channel.declare_exchange("video_tasks", aio_pika.ExchangeType.FANOUT)
+    legacy = {}
+    for stage, queue_name in LEGACY_TASK_QUEUES.items():
+        legacy[stage] = await channel.declare_queue(queue_name, durable=True)
+        await legacy[stage].bind(old_exchange)
+    # The old API published each task once; the fanout copied it to both queues
+    for file_id in ("old1", "old2"):
+        await old_exchange.publish(
+            aio_pika.Message(body=json.dumps({"file_id": file_id}).encode()), routing_key=""
+        )
+
+    # An old enhancement worker is still running
+    async def old_worker(incoming):
+        pass
+    await legacy["video_enhancement"].consume(old_worker)
+
+    client = RabbitMQClient(url)
+    await client.connect()
+    queues = memory_broker.get_broker(url).queues
+    # Connecting alone leaves them to the one-off migration
+    assert queues[LEGACY_TASK_QUEUES["metadata_extraction"]].message_count == 2
+    counts = await client.migrate_legacy_task_queues()
+    assert counts["metadata_extraction"] == 2
+    # Unconsumed and drained: deleted; still consumed: kept for the next run
+    assert LEGACY_TASK_QUEUES["metadata_extraction"] not in queues
+    assert LEGACY_TASK_QUEUES["video_enhancement"] in queues
+
+    # The stage queue is declared even if no new worker has started yet
+    metadata_queue = await client.channel.declare_queue("metadata_extraction_priority_queue", passive=True)
+    moved = []
+    while (incoming := await metadata_queue.get(fail=False)) is not None:
+        await incoming.ack()
+        moved.append(decode_body(incoming.body, incoming.content_type)["file_id"])
+    assert moved == ["old1", "old2"]
+    await client.close()
+    await connection.close()
+    memory_broker.reset()
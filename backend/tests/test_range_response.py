@@ -0,0 +1,148 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+from app.utils.range_response import RangeFileResponse, RangeNotSatisfiable, parse_range_header
+
+SIZE = 10000
+
+@pytest.fixture
+def video_file(tmp_path):
+    path = str(tmp_path / "video_enhanced.mp4")
+    with open(path, "wb") as f:
+        f.write(bytes(i % 251 for i in range(SIZE)))
+    return path
+
+@pytest.fixture
+def content(video_file):
+    with open(video_file, "rb") as f:
+        return f.read()
+
+@pytest.fixture
+def client(video_file):
+    app = FastAPI()
+
+    @app.get("/video")
+    async def video(request: Request):
+        return RangeFileResponse(video_file, request.headers, "video/mp4", chunk_size=1024)
+
+    return TestClient(app)
+
+@pytest.mark.parametrize("header,expected", [
+    (None, []),
+    ("bytes=0-99", [(0, 99)]),
+    ("bytes=9990-", [(9990, 9999)]),
+    ("bytes=-100", [(9900, 9999)]),
+    ("bytes=-20000", [(0, 9999)]),
+    ("bytes=5000-999999", [(5000, 9999)]),
+    ("bytes=200-299, 0-99", [(0, 99), (200, 299)]),
+    ("bytes=0-99,50-150,151-160", [(0, 160)]),
+    ("bytes=abc", []),
+    ("bytes=10-5", []),
+    ("items=0-10", []),
+])
+def test_parse_range_header(header, expected):
+    """Ranges are parsed, clamped, sorted and merged; bad headers are ignored"""
+    assert parse_range_header(header, SIZE) == expected
+
+def test_parse_unsatisfiable():
+    """Ranges entirely past the end cannot be satisfied"""
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header("bytes=20000-", SIZE)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header("bytes=-0", SIZE)
+
+def test_suffix_range_of_empty_file_unsatisfiable(tmp_path):
+    """An empty file has no suffix to send, so the request gets a 416"""
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header("bytes=-5", 0)
+
+    path = str(tmp_path / "empty.mp4")
+    open(path, "wb").close()
+    app = FastAPI()
+
+    @app.get("/video")
+    async def video(request: Request):
+        return RangeFileResponse(path, request.headers, "video/mp4")
+
+    response = TestClient(app).get("/video", headers={"Range": "bytes=-5"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */0"
+
+def test_full_file(client, content):
+    """Without a Range header the whole file is sent with 200"""
+    response = client.get("/video")
+    assert response.status_code == 200
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-length"] == str(SIZE)
+    assert response.content == content
+
+def test_single_range(client, content):
+    """A single range returns only those bytes"""
+    response = client.get("/video", headers={"Range": "bytes=1000-3999"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 1000-3999/{SIZE}"
+    assert response.headers["content-type"] == "video/mp4"
+    assert response.content == content[1000:4000]
+
+def test_suffix_range(client, content):
+    """A suffix range returns the end of the file"""
+    response = client.get("/video", headers={"Range": "bytes=-500"})
+    assert response.status_code == 206
+    assert response.content == content[-500:]
+
+def test_multiple_ranges(client, content):
+    """Several ranges come back as multipart/byteranges"""
+    response = client.get("/video", headers={"Range": "bytes=0-9,5000-5009"})
+    assert response.status_code == 206
+    content_type = response.headers["content-type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    boundary = content_type.split("boundary=")[1]
+    assert int(response.headers["content-length"]) == len(response.content)
+
+    parts = response.content.split(f"--{boundary}".encode())
+    assert parts[0] == b""
+    assert parts[-1] == b"--\r\n"
+    first, second = parts[1], parts[2]
+    assert f"Content-Range: bytes 0-9/{SIZE}".encode() in first
+    assert first.endswith(b"\r\n\r\n" + content[0:10] + b"\r\n")
+    assert second.endswith(b"\r\n\r\n" + content[5000:5010] + b"\r\n")
+
+def test_unsatisfiable_range(client):
+    """A range past the end gets 416 with the file size"""
+    response = client.get("/video", headers={"Range": f"bytes={SIZE}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{SIZE}"
+
+def test_if_range_mismatch_sends_full_file(client, content):
+    """A stale If-Range validator ignores the Range header"""
+    etag = client.get("/video").headers["etag"]
+    response = client.get("/video", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206
+
+    response = client.get("/video", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == content
+
+@pytest.mark.asyncio
+async def test_zero_copy_when_server_supports_it(video_file):
+    """Servers with the zerocopysend extension get the file descriptor, not bytes"""
+    messages = []
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopysend":
+            message = dict(message, file=message["file"].fileno() >= 0)
+        messages.append(message)
+
+    response = RangeFileResponse(video_file, {"range": "bytes=100-199"}, "video/mp4")
+    scope = {"type": "http", "method": "GET", "extensions": {"http.response.zerocopysend": {}}}
+    await response(scope, None, send)
+
+    assert messages[0]["status"] == 206
+    assert messages[1] == {
+        "type": "http.response.zerocopysend",
+        "file": True,
+        "offset": 100,
+        "count": 100,
+        "more_body": False,
+    }
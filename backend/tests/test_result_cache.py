@@ -0,0 +1,201 @@
+import os
+import json
+import hashlib
+import pytest
+from fastapi.testclient import TestClient
+from app import main
+from app.utils.probe import InvalidVideo
+from app.utils.result_cache import ResultCache
+
+CONTENT_HASH = hashlib.sha256(b"same video").hexdigest()
+
+@pytest.fixture
+def dirs(tmp_path):
+    paths = {name: tmp_path / name for name in ("processed", "thumbnails", "metadata")}
+    for path in paths.values():
+        path.mkdir()
+    return paths
+
+def make_cache(tmp_path, dirs, version="1"):
+    return ResultCache(
+        db_path=str(tmp_path / "state.db"),
+        version=version,
+        processed_dir=str(dirs["processed"]),
+        thumbnails_dir=str(dirs["thumbnails"]),
+        metadata_dir=str(dirs["metadata"])
+    )
+
+def write_results(dirs, file_id):
+    """Outputs as the workers name them"""
+    (dirs["processed"] / f"{file_id}_enhanced.mp4").write_bytes(b"enhanced")
+    (dirs["thumbnails"] / f"{file_id}_thumbnail.jpg").write_bytes(b"thumbnail")
+    (dirs["metadata"] / f"{file_id}_metadata.json").write_text(
+        json.dumps({"file_id": file_id, "filename": f"{file_id}.mp4", "fps": 25.0})
+    )
+
+def test_duplicate_reuses_completed_results(tmp_path, dirs):
+    cache = make_cache(tmp_path, dirs)
+    write_results(dirs, "first")
+    cache.record_upload("first", CONTENT_HASH)
+    cache.record_completions([("first", "video_enhancement"), ("first", "metadata_extraction")])
+
+    reused = cache.reuse_results(CONTENT_HASH, "second", ["video_enhancement", "metadata_extraction"])
+
+    assert reused == {"video_enhancement": "first", "metadata_extraction": "first"}
+    enhanced = dirs["processed"] / "second_enhanced.mp4"
+    # Linked, not copied
+    assert os.stat(enhanced).st_ino == os.stat(dirs["processed"] / "first_enhanced.mp4").st_ino
+    assert (dirs["thumbnails"] / "second_thumbnail.jpg").read_bytes() == b"thumbnail"
+    metadata = json.loads((dirs["metadata"] / "second_metadata.json").read_text())
+    assert metadata == {"file_id": "second", "filename": "second.mp4", "fps": 25.0}
+
+    stats = cache.get_stats()
+    assert stats["hits"] == 2 and stats["hit_rate"] == 1.0
+    assert stats["entries"] == 2
+
+def test_only_completed_stages_of_recorded_uploads_are_indexed(tmp_path, dirs):
+    cache = make_cache(tmp_path, dirs)
+    write_results(dirs, "first")
+    write_results(dirs, "unrecorded")
+    cache.record_upload("first", CONTENT_HASH)
+    cache.record_completions([("first", "metadata_extraction"), ("unrecorded", "video_enhancement")])
+
+    reused = cache.reuse_results(CONTENT_HASH, "second", ["video_enhancement", "metadata_extraction"])
+    assert reused == {"metadata_extraction": "first"}
+    assert not (dirs["processed"] / "second_enhanced.mp4").exists()
+
+    stats = cache.get_stats()
+    assert stats["stages"]["video_enhancement"] == {"hits": 0, "misses": 1, "hit_rate": 0.0}
+    assert stats["hit_rate"] == 0.5
+
+def test_other_pipeline_version_and_removed_results_miss(tmp_path, dirs):
+    cache = make_cache(tmp_path, dirs)
+    write_results(dirs, "first")
+    cache.record_upload("first", CONTENT_HASH)
+    cache.record_completions([("first", "video_enhancement")])
+
+    assert make_cache(tmp_path, dirs, version="2").lookup(CONTENT_HASH, "video_enhancement") is None
+
+    os.remove(dirs["processed"] / "first_enhanced.mp4")
+    assert cache.reuse_results(CONTENT_HASH, "second", ["video_enhancement"]) == {}
+    # The stale entry is gone
+    assert cache.get_stats()["entries"] == 0
+
+@pytest.fixture
+def api(tmp_path, dirs, monkeypatch):
+    published = []
+
+    async def publish_task(message, stages=None, priority=None):
+        published.append((message, list(stages)))
+
+    cache = make_cache(tmp_path, dirs)
+    monkeypatch.setattr(main, "result_cache", cache)
+    monkeypatch.setattr(main, "RESULT_CACHE_ENABLED", True)
+    monkeypatch.setattr(main, "PROBE_ON_UPLOAD", False)
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(main.rabbitmq_client, "url", "memory://test-result-cache")
+    monkeypatch.setattr(main.rabbitmq_client, "publish_task", publish_task)
+    os.makedirs(tmp_path / "uploads")
+    return TestClient(main.app), cache, published
+
+def upload(client):
+    return client.post("/upload", files={"file": ("clip.mp4", b"same video", "video/mp4")})
+
+def test_duplicate_upload_completes_without_tasks(api, dirs, tmp_path):
+    client, cache, published = api
+
+    first = upload(client).json()
+    assert first["cached_stages"] == []
+    assert published[0][1] == ["video_enhancement", "metadata_extraction"]
+
+    # The workers finish the first upload
+    write_results(dirs, first["file_id"])
+    cache.record_completions([(first["file_id"], "video_enhancement"), (first["file_id"], "metadata_extraction")])
+
+    second = upload(client).json()
+    assert second["cached_stages"] == ["video_enhancement", "metadata_extraction"]
+    assert len(published) == 1
+    state = main.processing_state.get_state(second["file_id"])
+    assert state["video_enhancement"]["status"] == "completed"
+    assert state["metadata_extraction"]["status"] == "completed"
+    # Only the first upload's file is kept
+    assert os.listdir(tmp_path / "uploads") == [f"{first['file_id']}.mp4"]
+
+    assert client.get("/internal/result-cache").json()["hits"] == 2
+
+def test_partial_hit_queues_remaining_stage(api, dirs):
+    client, cache, published = api
+
+    first = upload(client).json()
+    write_results(dirs, first["file_id"])
+    cache.record_completions([(first["file_id"], "metadata_extraction")])
+
+    second = upload(client).json()
+    assert second["cached_stages"] == ["metadata_extraction"]
+    assert published[1][1] == ["video_enhancement"]
+    assert published[1][0]["stages"] == ["video_enhancement"]
+
+def test_invalid_duplicate_gets_no_results(api, dirs, tmp_path, monkeypatch):
+    """A duplicate the probe rejects is refused before any result is linked to it"""
+    client, cache, published = api
+    first = upload(client).json()
+    write_results(dirs, first["file_id"])
+    cache.record_completions([(first["file_id"], "video_enhancement"), (first["file_id"], "metadata_extraction")])
+
+    async def probe_video(path):
+        raise InvalidVideo("no video stream")
+
+    monkeypatch.setattr(main, "PROBE_ON_UPLOAD", True)
+    monkeypatch.setattr(main, "probe_video", probe_video)
+    assert upload(client).status_code == 400
+
+    for directory in dirs.values():
+        assert all(name.startswith(first["file_id"]) for name in os.listdir(directory))
+    assert os.listdir(tmp_path / "uploads") == [f"{first['file_id']}.mp4"]
+    assert client.get("/internal/result-cache").json()["hits"] == 0
+
+class StatusMessage:
+    def __init__(self, data):
+        self.body = json.dumps(data).encode()
+        self.content_type = "application/json"
+
+@pytest.mark.asyncio
+async def test_completed_status_indexes_results(api, dirs):
+    client, cache, published = api
+    cache.record_upload("worked", CONTENT_HASH)
+    write_results(dirs, "worked")
+
+    await main.handle_status_batch([
+        StatusMessage({"type": "video_enhancement_status", "file_id": "worked", "status": "completed", "progress": 100}),
+        StatusMessage({"type": "metadata_extraction_status", "file_id": "worked", "status": "processing", "progress": 30}),
+    ])
+
+    assert cache.lookup(CONTENT_HASH, "video_enhancement") == "worked"
+    assert cache.lookup(CONTENT_HASH, "metadata_extraction") is None
+
+@pytest.mark.asyncio
+async def test_stale_and_repeated_completions_not_indexed(api, dirs, monkeypatch):
+    """Only a completion the state store applied is indexed and counted"""
+    client, cache, published = api
+    cache.record_upload("retried", CONTENT_HASH)
+    write_results(dirs, "retried")
+    indexed = []
+    monkeypatch.setattr(cache, "record_completions", lambda completions: indexed.append(list(completions)))
+    completions_before = len(main.admission._completions.get("video_enhancement", []))
+
+    def completed(timestamp):
+        return StatusMessage({"type": "video_enhancement_status", "file_id": "retried", "status": "completed",
+                              "progress": 100, "timestamp": timestamp})
+
+    # A retry has started; a late completion of the earlier attempt is stale
+    main.processing_state.update_state("retried", "processing", 10, None, "video_enhancement",
+                                       event_time="2024-01-01T00:00:02")
+    await main.handle_status_batch([completed("2024-01-01T00:00:01")])
+    assert indexed == []
+
+    # The retry completes; the same message delivered again changes nothing
+    await main.handle_status_batch([completed("2024-01-01T00:00:03")])
+    await main.handle_status_batch([completed("2024-01-01T00:00:03")])
+    assert indexed == [[("retried", "video_enhancement")]]
+    assert len(main.admission._completions["video_enhancement"]) == completions_before + 1
+
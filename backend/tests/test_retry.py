@@ -0,0 +1,193 @@
+import json
+import pytest
+from app.utils.retry import RetryPolicy, dead_letter_queue_name, retry_queue_name
+from app.utils.rabbitmq import RabbitMQClient
+from app.workers.metadata_extraction_worker import MetadataExtractionWorker
+from tests.test_metadata_extraction_worker import FakeIncomingMessage
+
+class FakeExchange:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key):
+        self.published.append((routing_key, message))
+
+class FakeChannel:
+    def __init__(self):
+        self.default_exchange = FakeExchange()
+        self.queues = {}
+
+    async def declare_queue(self, name, durable=False, arguments=None):
+        self.queues[name] = arguments
+        return name
+
+def test_backoff_schedule():
+    """Delays double per attempt and are capped"""
+    policy = RetryPolicy("video_enhancement", max_attempts=5, base_delay=10, max_delay=50)
+    assert [policy.delay_for(attempt) for attempt in range(1, 5)] == [10, 20, 40, 50]
+    assert policy.delays() == [10, 20, 40, 50]
+
+@pytest.mark.asyncio
+async def test_declare_delay_and_dead_letter_queues():
+    """Delay queues expire back into the task exchange for their stage"""
+    channel = FakeChannel()
+    policy = RetryPolicy("metadata_extraction", max_attempts=3, base_delay=5)
+    await policy.declare(channel)
+
+    assert channel.queues[retry_queue_name("metadata_extraction", 5)] == {
+        "x-message-ttl": 5000,
+        "x-dead-letter-exchange": "video_tasks_routed",
+        "x-dead-letter-routing-key": "metadata_extraction",
+    }
+    assert retry_queue_name("metadata_extraction", 10) in channel.queues
+    assert dead_letter_queue_name("metadata_extraction") in channel.queues
+
+@pytest.mark.asyncio
+async def test_retry_then_dead_letter():
+    """Failures go to increasing delay queues, then to the dead-letter queue"""
+    channel = FakeChannel()
+    policy = RetryPolicy("metadata_extraction", max_attempts=3, base_delay=5)
+    message = FakeIncomingMessage({"file_id": "f1"})
+
+    outcome, delay, attempts = await policy.retry_or_dead_letter(channel, message, "boom")
+    assert (outcome, delay, attempts) == ("retry", 5, 1)
+    routing_key, retried = channel.default_exchange.published[-1]
+    assert routing_key == "metadata_extraction_retry_5s"
+    assert retried.headers["x-attempts"] == 1
+    assert retried.body == message.body
+
+    outcome, delay, attempts = await policy.retry_or_dead_letter(channel, FakeIncomingMessage({"file_id": "f1"}, {"x-attempts": 1}), "boom")
+    assert (outcome, delay) == ("retry", 10)
+
+    outcome, delay, attempts = await policy.retry_or_dead_letter(channel, FakeIncomingMessage({"file_id": "f1"}, {"x-attempts": 2}), "boom")
+    assert (outcome, attempts) == ("dead_letter", 3)
+    routing_key, dead = channel.default_exchange.published[-1]
+    assert routing_key == "metadata_extraction_dead_letter"
+    assert dead.headers["x-last-error"] == "boom"
+    assert "x-failed-at" in dead.headers
+
+@pytest.fixture
+def worker():
+    worker = MetadataExtractionWorker()
+    worker.channel = FakeChannel()
+    worker.statuses = []
+
+    async def record_status(file_id, status, progress=0, error=None):
+        worker.statuses.append((file_id, status, error))
+    worker.update_status = record_status
+    return worker
+
+@pytest.mark.asyncio
+async def test_failed_task_is_retried(worker):
+    """A failed extraction is scheduled for retry and reported as pending"""
+    async def failing_extract(data):
+        return {"status": "failed", "error": "ffprobe crashed"}
+    worker.extract_metadata = failing_extract
+
+    message = FakeIncomingMessage({"file_id": "f1", "filepath": "x.mp4"})
+    await worker.process_message(message)
+
+    assert message.acked
+    routing_key, _ = worker.channel.default_exchange.published[0]
+    assert routing_key.startswith("metadata_extraction_retry_")
+    assert worker.statuses[-1][1] == "pending"
+    assert "ffprobe crashed" in worker.statuses[-1][2]
+
+@pytest.mark.asyncio
+async def test_retried_task_not_tracked_by_progress_reporter():
+    """A task sent back for a retry may run elsewhere, so its progress state is dropped"""
+    worker = MetadataExtractionWorker()
+    worker.channel = FakeChannel()
+    sent = []
+
+    async def send(status_message, persistent):
+        sent.append(status_message["status"])
+    worker.progress_reporter.send = send
+
+    async def failing_extract(data):
+        await worker.update_status(data["file_id"], "processing", 10)
+        await worker.update_status(data["file_id"], "processing", 50)
+        return {"status": "failed", "error": "ffprobe crashed"}
+    worker.extract_metadata = failing_extract
+
+    await worker.process_message(FakeIncomingMessage({"file_id": "f1", "filepath": "x.mp4"}))
+
+    assert sent[-1] == "pending"
+    assert worker.progress_reporter._jobs == {}
+    worker.progress_reporter.close()
+
+@pytest.mark.asyncio
+async def test_redelivered_task_backs_off(worker):
+    """A task redelivered after a crash is delayed instead of run again immediately"""
+    calls = []
+
+    async def extract(data):
+        calls.append(data)
+        return {"status": "completed"}
+    worker.extract_metadata = extract
+
+    message = FakeIncomingMessage({"file_id": "f1", "filepath": "x.mp4"}, redelivered=True)
+    await worker.process_message(message)
+
+    assert calls == []
+    routing_key, retried = worker.channel.default_exchange.published[0]
+    assert routing_key.startswith("metadata_extraction_retry_")
+    assert retried.headers["x-attempts"] == 1
+
+@pytest.mark.asyncio
+async def test_invalid_message_is_dead_lettered(worker):
+    """Messages that can never be processed go straight to the dead-letter queue"""
+    message = FakeIncomingMessage({"filepath": "x.mp4"})
+    await worker.process_message(message)
+
+    routing_key, _ = worker.channel.default_exchange.published[0]
+    assert routing_key == "metadata_extraction_dead_letter"
+
+class FakeQueuedMessage(FakeIncomingMessage):
+    def __init__(self, data, headers=None):
+        super().__init__(data, headers)
+        self.processed = False
+        self.requeued = False
+
+    async def ack(self):
+        self.processed = True
+
+    async def nack(self, requeue=True):
+        self.processed = True
+        self.requeued = requeue
+
+class FakeDeadLetterQueue:
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    async def get(self, no_ack=False, fail=True):
+        return self.messages.pop(0) if self.messages else None
+
+@pytest.mark.asyncio
+async def test_requeue_dead_letters():
+    """Requeued tasks go back to their stage with a fresh attempt count"""
+    dead = [
+        FakeQueuedMessage({"file_id": "f1"}, {"x-attempts": 3, "x-last-error": "boom", "trace": "keep"}),
+        FakeQueuedMessage({"file_id": "f2"}, {"x-attempts": 3}),
+    ]
+    client = RabbitMQClient()
+
+    class Connection:
+        is_closed = False
+
+    class Channel:
+        async def declare_queue(self, name, durable=False):
+            assert name == "video_enhancement_dead_letter"
+            return FakeDeadLetterQueue(dead)
+
+    client.connection = Connection()
+    client.channel = Channel()
+    client.task_exchange = FakeExchange()
+
+    assert await client.requeue_dead_letters("video_enhancement", file_id="f1") == ["f1"]
+    routing_key, requeued = client.task_exchange.published[0]
+    assert routing_key == "video_enhancement"
+    assert requeued.headers == {"trace": "keep"}
+    assert json.loads(requeued.body) == {"file_id": "f1"}
+    # The other task stays dead-lettered
+    assert dead[1].requeued
@@ -0,0 +1,287 @@
+import os
+import hashlib
+import subprocess
+import pytest
+import cv2
+import numpy as np
+from app.utils import capabilities
+from app.utils.capabilities import Capabilities, get_capabilities
+from app.utils.probe import probe_video, video_stream_from_probe
+from app.workers import segment_parallel
+from app.workers import video_enhancement_worker
+from app.workers.frame_enhancer import FrameEnhancer
+from app.workers.segment_parallel import (
+    plan_segments,
+    enhance_segment,
+    concat_segments,
+    has_constant_frame_rate,
+    probe_keyframe_times,
+    stream_start_time
+)
+from app.workers.video_enhancement_worker import VideoEnhancementWorker
+
+FRAME_COUNT = 60
+WIDTH, HEIGHT = 64, 48
+
+# ffprobe result of a constant 25 fps stream, as the upload probe sends it
+CONSTANT_RATE_PROBE = {
+    "streams": [{
+        "codec_type": "video",
+        "r_frame_rate": "25/1",
+        "avg_frame_rate": "25/1",
+        "start_time": "0.000000"
+    }]
+}
+
+@pytest.fixture
+def sample_video(tmp_path):
+    """Create a small video whose frames all differ"""
+    output_path = str(tmp_path / "sample.mp4")
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), 25, (WIDTH, HEIGHT))
+    for i in range(FRAME_COUNT):
+        frame = np.full((HEIGHT, WIDTH, 3), i * 4, dtype=np.uint8)
+        cv2.rectangle(frame, (i % 50, 5), (i % 50 + 10, 20), (255, 255, 255), -1)
+        out.write(frame)
+    out.release()
+    return output_path
+
+class ListWriter:
+    """Collects written frames instead of encoding them"""
+    def __init__(self):
+        self.frames = []
+
+    def write(self, frame):
+        self.frames.append(frame.copy())
+
+    def release(self):
+        pass
+
+def test_plan_segments_snaps_to_keyframes():
+    """Boundaries land on the keyframes closest to an even split"""
+    keyframe_times = [i * 2.0 for i in range(50)]  # every 2s at 25fps = every 50 frames
+    segments = plan_segments(2500, 25.0, keyframe_times, 4, 250)
+    assert segments == [(0, 600), (600, 1250), (1250, 1850), (1850, None)]
+
+def test_plan_segments_without_split():
+    """Short videos, missing keyframes or a single process give one segment"""
+    assert plan_segments(100, 25.0, [0.0, 2.0], 4, 250) == [(0, None)]
+    assert plan_segments(2500, 25.0, [], 4, 250) == [(0, None)]
+    assert plan_segments(2500, 25.0, [0.0, 40.0], 1, 250) == [(0, None)]
+
+def test_plan_segments_subtracts_start_time():
+    """Keyframe times count from the stream's first timestamp"""
+    keyframe_times = [1.4 + i * 2.0 for i in range(50)]
+    segments = plan_segments(2500, 25.0, keyframe_times, 4, 250, start_time=1.4)
+    assert segments == [(0, 600), (600, 1250), (1250, 1850), (1850, None)]
+
+def test_constant_frame_rate_and_start_time():
+    """Streams whose base and average rates differ are not split"""
+    assert has_constant_frame_rate({"r_frame_rate": "30000/1001", "avg_frame_rate": "30000/1001"})
+    assert not has_constant_frame_rate({"r_frame_rate": "30/1", "avg_frame_rate": "2997/100"})
+    assert not has_constant_frame_rate({"r_frame_rate": "0/0", "avg_frame_rate": "0/0"})
+    assert not has_constant_frame_rate({})
+    assert stream_start_time({"start_time": "1.400000"}) == 1.4
+    assert stream_start_time({"start_time": "N/A"}) == 0.0
+    assert stream_start_time({}) == 0.0
+
+class OffsetCapture:
+    """Capture whose seeks land one frame early"""
+    def __init__(self, fps):
+        self.fps = fps
+        self.position = 0
+
+    def set(self, prop, value):
+        self.position = value - 1
+        return True
+
+    def get(self, prop):
+        return self.position * 1000 / self.fps
+
+    def read(self):
+        return True, np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+
+def test_seek_checked_against_decoded_timestamp():
+    """A seek is judged by the decoded frame, not the position set"""
+    with pytest.raises(RuntimeError, match="landed on 23"):
+        segment_parallel._seek(OffsetCapture(25.0), 24, 25.0)
+
+def test_last_segment_frame_count_checked(sample_video, monkeypatch):
+    """The open-ended last segment must yield the frames the plan expects"""
+    monkeypatch.setattr(segment_parallel, "open_video_writer", lambda path, fps, size: ListWriter())
+    assert enhance_segment(sample_video, "unused.mp4", 48, None, 25.0, (WIDTH, HEIGHT),
+                           expected_frames=FRAME_COUNT - 48) == FRAME_COUNT - 48
+    with pytest.raises(RuntimeError, match="instead of 20"):
+        enhance_segment(sample_video, "unused.mp4", 48, None, 25.0, (WIDTH, HEIGHT), expected_frames=20)
+
+def test_segments_match_serial_frames(sample_video, monkeypatch):
+    """Enhancing each segment gives exactly the serial frames when joined"""
+    enhancer = FrameEnhancer()
+    cap = cv2.VideoCapture(sample_video)
+    expected = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        expected.append(enhancer.enhance(frame).copy())
+    cap.release()
+
+    writers = []
+    def list_writer(output_path, fps, frame_size):
+        writers.append(ListWriter())
+        return writers[-1]
+    monkeypatch.setattr(segment_parallel, "open_video_writer", list_writer)
+
+    # mp4v from OpenCV puts a keyframe every 12 frames
+    segments = [(0, 24), (24, 48), (48, None)]
+    counts = [
+        enhance_segment(sample_video, "unused.mp4", start, end, 25.0, (WIDTH, HEIGHT))
+        for start, end in segments
+    ]
+
+    assert counts == [24, 24, len(expected) - 48]
+    joined = [frame for writer in writers for frame in writer.frames]
+    assert len(joined) == len(expected)
+    for got, want in zip(joined, expected):
+        assert np.array_equal(got, want)
+
+@pytest.mark.asyncio
+async def test_enhance_video_falls_back_when_segments_cannot_be_joined(sample_video, tmp_path, monkeypatch):
+    """Without ffmpeg to join segments the video is enhanced in one piece"""
+    async def probe_keyframe_times(path):
+        return [0.48, 0.96, 1.44]
+
+    async def concat_segments(paths, output):
+        return False
+
+    monkeypatch.setattr(video_enhancement_worker, "probe_keyframe_times", probe_keyframe_times)
+    monkeypatch.setattr(video_enhancement_worker, "concat_segments", concat_segments)
+
+    worker = VideoEnhancementWorker()
+    worker.segment_processes = 2
+    worker.processed_dir = str(tmp_path / "processed")
+    worker.thumbnails_dir = str(tmp_path / "thumbnails")
+    os.makedirs(worker.processed_dir)
+    os.makedirs(worker.thumbnails_dir)
+
+    async def record_status(file_id, status, progress=0, error=None):
+        pass
+    worker.update_status = record_status
+
+    try:
+        monkeypatch.setattr(video_enhancement_worker, "SEGMENT_MIN_SECONDS", 0.4)
+        result = await worker.enhance_video({
+            "file_id": "segment_test",
+            "filepath": sample_video,
+            "probe": CONSTANT_RATE_PROBE
+        })
+    finally:
+        await worker.close()
+
+    assert result["status"] == "completed"
+    assert os.path.exists(result["output_path"])
+    # Segment files are cleaned up
+    assert not [name for name in os.listdir(worker.processed_dir) if "_part" in name]
+
+@pytest.mark.asyncio
+async def test_variable_frame_rate_not_split(sample_video, tmp_path, monkeypatch):
+    """Variable frame rate video is enhanced in one piece"""
+    async def probe_keyframe_times(path):
+        raise AssertionError("keyframes probed for a variable frame rate video")
+
+    monkeypatch.setattr(video_enhancement_worker, "probe_keyframe_times", probe_keyframe_times)
+    worker = VideoEnhancementWorker()
+    worker.segment_processes = 2
+    probe = {"streams": [dict(CONSTANT_RATE_PROBE["streams"][0], avg_frame_rate="2491/100")]}
+    try:
+        joined = await worker.enhance_video_segments(
+            "vfr_test", sample_video, str(tmp_path / "out.mp4"), FRAME_COUNT, 25.0,
+            (WIDTH, HEIGHT), str(tmp_path / "thumb.jpg"), float("inf"), probe
+        )
+    finally:
+        await worker.close()
+    assert joined is False
+
+@pytest.mark.asyncio
+async def test_keyframes_not_probed_without_ffprobe(monkeypatch):
+    """Without a detected ffprobe no process is started and no keyframes are returned"""
+    async def run_process(cmd, timeout):
+        raise AssertionError(f"{cmd[0]} started without being detected")
+
+    monkeypatch.setattr(segment_parallel, "run_process", run_process)
+    capabilities.install(Capabilities({}, {}, None, cv2.__version__, None))
+    try:
+        assert await probe_keyframe_times("missing.mp4") == []
+    finally:
+        capabilities.reset()
+
+def frame_hashes(path):
+    """MD5 of every decoded frame of a video"""
+    cap = cv2.VideoCapture(path)
+    hashes = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        hashes.append(hashlib.md5(frame.tobytes()).hexdigest())
+    cap.release()
+    return hashes
+
+class HashWriter:
+    """Records the MD5 of every frame written instead of encoding it"""
+    def __init__(self):
+        self.hashes = []
+
+    def write(self, frame):
+        self.hashes.append(hashlib.md5(frame.tobytes()).hexdigest())
+
+    def release(self):
+        pass
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not (get_capabilities().has("ffmpeg") and get_capabilities().has("ffprobe")),
+                    reason="ffmpeg and ffprobe are required")
+async def test_segmented_output_matches_serial(tmp_path, monkeypatch):
+    """Planned, joined segments give the serial frames of an encoded video with a start offset"""
+    source = str(tmp_path / "source.mp4")
+    subprocess.run([
+        "ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=duration=6:size=160x120:rate=25",
+        "-c:v", "libx264", "-g", "25", "-pix_fmt", "yuv420p", "-output_ts_offset", "1.4", "-y", source
+    ], check=True)
+
+    probe = await probe_video(source)
+    stream = video_stream_from_probe(probe)
+    assert has_constant_frame_rate(stream)
+    assert stream_start_time(stream) > 0
+
+    cap = cv2.VideoCapture(source)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    segments = plan_segments(total_frames, fps, await probe_keyframe_times(source), 3, 25,
+                             stream_start_time(stream))
+    assert len(segments) == 3
+
+    # The enhanced frames handed to the encoders, serial and per segment
+    writers = {}
+    def hash_writer(output_path, fps, frame_size):
+        writers[output_path] = HashWriter()
+        return writers[output_path]
+    with monkeypatch.context() as patch:
+        patch.setattr(segment_parallel, "open_video_writer", hash_writer)
+        enhance_segment(source, "serial", 0, None, fps, (160, 120), expected_frames=total_frames)
+        for i, (start, end) in enumerate(segments):
+            enhance_segment(source, f"part{i}", start, end, fps, (160, 120),
+                            expected_frames=(end if end is not None else total_frames) - start)
+    serial = writers["serial"].hashes
+    assert len(serial) == total_frames
+    assert [h for i in range(len(segments)) for h in writers[f"part{i}"].hashes] == serial
+
+    # Encoded and joined with the concat demuxer, the frame count still matches
+    serial_path = str(tmp_path / "serial.mp4")
+    enhance_segment(source, serial_path, 0, None, fps, (160, 120))
+    part_paths = [str(tmp_path / f"part{i}.mp4") for i in range(len(segments))]
+    for path, (start, end) in zip(part_paths, segments):
+        enhance_segment(source, path, start, end, fps, (160, 120))
+    joined_path = str(tmp_path / "joined.mp4")
+    assert await concat_segments(part_paths, joined_path)
+    assert len(frame_hashes(joined_path)) == len(frame_hashes(serial_path)) == total_frames
@@ -0,0 +1,241 @@
+import time
+import json
+import sqlite3
+import pytest
+from datetime import datetime, timedelta
+from app.utils.state import ProcessingState, APPLIED, DUPLICATE, STALE
+
+@pytest.fixture
+def state_store(tmp_path):
+    """A state store backed by a temporary database"""
+    store = ProcessingState(
+        db_path=str(tmp_path / "states.db"),
+        legacy_states_file=str(tmp_path / "missing.json")
+    )
+    yield store
+    store.close()
+
+def test_create_and_get_state(state_store):
+    """Created states come back in the same shape as before"""
+    created = state_store.create_state("file_1", "client_1")
+    state = state_store.get_state("file_1")
+
+    assert state == created
+    assert state["client_id"] == "client_1"
+    for task in ("video_enhancement", "metadata_extraction"):
+        assert state[task]["status"] == "pending"
+        assert state[task]["progress"] == 0
+        assert state[task]["error"] is None
+
+    assert state_store.get_state("missing") is None
+
+def test_update_state_touches_one_task(state_store):
+    """Updating one task leaves the other task untouched"""
+    state_store.create_state("file_1", "client_1")
+    updated = state_store.update_state("file_1", "processing", 40, None, "metadata_extraction")
+
+    assert updated["metadata_extraction"]["status"] == "processing"
+    assert updated["metadata_extraction"]["progress"] == 40
+    assert updated["video_enhancement"]["status"] == "pending"
+    assert updated["client_id"] == "client_1"
+
+def test_update_unknown_file_creates_state(state_store):
+    """Status for an unknown file creates its state, like the JSON store did"""
+    state = state_store.update_state("new_file", "failed", 0, "boom", "bogus_task")
+    assert state["video_enhancement"]["status"] == "failed"
+    assert state["video_enhancement"]["error"] == "boom"
+    assert state["client_id"].startswith("unknown_client_")
+
+def test_states_persist_across_instances(tmp_path):
+    """A new store instance sees rows written by a previous one"""
+    db_path = str(tmp_path / "states.db")
+    first = ProcessingState(db_path=db_path, legacy_states_file=None)
+    first.create_state("file_1", "client_1")
+    first.update_state("file_1", "completed", 100)
+    first.close()
+
+    second = ProcessingState(db_path=db_path, legacy_states_file=None)
+    assert second.get_state("file_1")["video_enhancement"]["status"] == "completed"
+    second.close()
+
+def test_uses_wal_mode(state_store):
+    """The database runs in write-ahead logging mode"""
+    mode = state_store._conn.execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode.lower() == "wal"
+
+def test_legacy_json_migrated_once(tmp_path):
+    """The old JSON store is imported on first start only"""
+    legacy_file = str(tmp_path / "processing_states.json")
+    now = datetime.utcnow().isoformat()
+    with open(legacy_file, "w") as f:
+        json.dump({
+            "old_file": {
+                "client_id": "old_client",
+                "created_at": now,
+                "video_enhancement": {"status": "completed", "progress": 100, "error": None, "last_updated": now},
+                "metadata_extraction": {"status": "failed", "progress": 0, "error": "bad", "last_updated": now}
+            }
+        }, f)
+
+    db_path = str(tmp_path / "states.db")
+    store = ProcessingState(db_path=db_path, legacy_states_file=legacy_file)
+    state = store.get_state("old_file")
+    assert state["client_id"] == "old_client"
+    assert state["video_enhancement"]["status"] == "completed"
+    assert state["metadata_extraction"]["error"] == "bad"
+
+    # Later changes are not overwritten by re-importing the JSON file
+    store.update_state("old_file", "processing", 10)
+    store.close()
+    store = ProcessingState(db_path=db_path, legacy_states_file=legacy_file)
+    assert store.get_state("old_file")["video_enhancement"]["status"] == "processing"
+    store.close()
+
+def test_lookup_by_client_and_cleanup(state_store):
+    """States can be listed per client and old ones are removed"""
+    state_store.create_state("file_1", "client_1")
+    state_store.create_state("file_2", "client_1")
+    state_store.create_state("file_3", "client_2")
+    assert list(state_store.get_states_for_client("client_1").keys()) == ["file_1", "file_2"]
+
+    old = (datetime.utcnow() - timedelta(hours=48)).isoformat()
+    state_store._conn.execute("UPDATE processing_states SET created_at = ? WHERE file_id = 'file_1'", (old,))
+    state_store.cleanup_old_states(max_age_hours=24)
+
+    assert state_store.get_state("file_1") is None
+    assert state_store.get_state("file_2") is not None
+
+def test_progress_updates_are_coalesced(tmp_path):
+    """Intermediate progress stays in memory until flushed, keeping only the latest value"""
+    store = ProcessingState(db_path=str(tmp_path / "states.db"), legacy_states_file=None, flush_interval=60)
+    store.create_state("file_1", "client_1")
+    for progress in (10, 20, 30):
+        state = store.update_state("file_1", "processing", progress)
+    assert state["video_enhancement"]["progress"] == 30
+
+    row = store._conn.execute(
+        "SELECT video_enhancement_progress FROM processing_states WHERE file_id = 'file_1'"
+    ).fetchone()
+    assert row[0] == 0
+
+    assert store.flush() == 1
+    row = store._conn.execute(
+        "SELECT video_enhancement_progress FROM processing_states WHERE file_id = 'file_1'"
+    ).fetchone()
+    assert row[0] == 30
+
+    stats = store.get_stats()
+    assert stats["buffered_updates"] == 3
+    assert stats["writes_saved"] == 2
+    assert stats["flushes"] == 1
+    assert stats["pending_updates"] == 0
+    store.close()
+
+def test_terminal_status_written_immediately(tmp_path):
+    """Completed and failed are on disk when update_state returns and drop buffered progress"""
+    db_path = str(tmp_path / "states.db")
+    store = ProcessingState(db_path=db_path, legacy_states_file=None, flush_interval=60)
+    store.create_state("file_1", "client_1")
+    store.update_state("file_1", "processing", 90)
+    store.update_state("file_1", "completed", 100)
+    store.update_state("file_1", "failed", 0, "bad", "metadata_extraction")
+
+    # Another connection sees both transitions without a flush
+    other = ProcessingState(db_path=db_path, legacy_states_file=None, flush_interval=0)
+    state = other.get_state("file_1")
+    assert state["video_enhancement"]["status"] == "completed"
+    assert state["video_enhancement"]["progress"] == 100
+    assert state["metadata_extraction"]["error"] == "bad"
+    other.close()
+
+    assert store.get_stats()["pending_updates"] == 0
+    assert store.get_stats()["sync_writes"] == 2
+    store.close()
+
+def test_background_flush(tmp_path):
+    """Buffered progress reaches the database on the flush interval"""
+    db_path = str(tmp_path / "states.db")
+    store = ProcessingState(db_path=db_path, legacy_states_file=None, flush_interval=0.05)
+    store.create_state("file_1", "client_1")
+    store.update_state("file_1", "processing", 55, None, "metadata_extraction")
+
+    deadline = time.time() + 5
+    while store.get_stats()["pending_updates"] and time.time() < deadline:
+        time.sleep(0.05)
+
+    other = ProcessingState(db_path=db_path, legacy_states_file=None, flush_interval=0)
+    assert other.get_state("file_1")["metadata_extraction"]["progress"] == 55
+    other.close()
+    store.close()
+
+def test_unselected_stages_are_skipped(state_store):
+    """Stages not requested at upload are marked skipped"""
+    state = state_store.create_state("file_1", "client_1", ["metadata_extraction"])
+    assert state["video_enhancement"]["status"] == "skipped"
+    assert state["metadata_extraction"]["status"] == "pending"
+    assert state_store.get_state("file_1")["video_enhancement"]["status"] == "skipped"
+
+def test_repeated_and_stale_updates_are_ignored(tmp_path):
+    """Two API processes applying the same broadcast updates end in the newest state"""
+    db_path = str(tmp_path / "states.db")
+    first = ProcessingState(db_path=db_path, legacy_states_file=None, flush_interval=60)
+    second = ProcessingState(db_path=db_path, legacy_states_file=None, flush_interval=60)
+    first.create_state("file_1", "client_1")
+
+    # Both processes buffer the same progress update; one of them sees completion first
+    for store in (first, second):
+        store.update_state("file_1", "processing", 50, None, "metadata_extraction", event_time="2024-01-01T00:00:01")
+    second.update_state("file_1", "completed", 100, None, "metadata_extraction", event_time="2024-01-01T00:00:02")
+    first.flush()
+    first.update_state("file_1", "completed", 100, None, "metadata_extraction", event_time="2024-01-01T00:00:02")
+
+    state = second.get_state("file_1")["metadata_extraction"]
+    assert (state["status"], state["progress"]) == ("completed", 100)
+    assert first.get_stats()["stale_updates"] == 1
+
+    # An update older than the stored one is dropped before it is buffered
+    stale = second.update_state("file_1", "processing", 10, None, "metadata_extraction", event_time="2024-01-01T00:00:00")
+    assert stale["metadata_extraction"]["status"] == "completed"
+    assert second.get_stats()["pending_updates"] == 0
+    first.close()
+    second.close()
+
+def test_apply_updates_reports_outcomes(tmp_path):
+    """Of two processes applying the same terminal update, only one applies it"""
+    db_path = str(tmp_path / "states.db")
+    first = ProcessingState(db_path=db_path, legacy_states_file=None, flush_interval=60)
+    second = ProcessingState(db_path=db_path, legacy_states_file=None, flush_interval=60)
+    first.create_state("file_1", "client_1")
+    update = ("file_1", "video_enhancement", "completed", 100, None, "2024-01-01T00:00:02")
+
+    assert first.apply_updates([update])[1] == {("file_1", "video_enhancement"): APPLIED}
+    assert second.apply_updates([update])[1] == {("file_1", "video_enhancement"): DUPLICATE}
+    assert first.apply_updates([update])[1] == {("file_1", "video_enhancement"): DUPLICATE}
+    states, outcomes = second.apply_updates([
+        ("file_1", "video_enhancement", "failed", 0, "late", "2024-01-01T00:00:01"),
+        ("file_1", "metadata_extraction", "processing", 40, None, "2024-01-01T00:00:01"),
+    ])
+    assert outcomes == {("file_1", "video_enhancement"): STALE, ("file_1", "metadata_extraction"): APPLIED}
+    assert states["file_1"]["video_enhancement"]["status"] == "completed"
+    assert second.get_stats()["stale_updates"] == 1
+    first.close()
+    second.close()
+
+def test_event_time_column_added_to_existing_database(tmp_path):
+    """Databases from before event times are upgraded in place"""
+    db_path = str(tmp_path / "states.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE processing_states (file_id TEXT PRIMARY KEY, client_id TEXT, created_at TEXT NOT NULL, "
+        "video_enhancement_status TEXT NOT NULL DEFAULT 'pending', video_enhancement_progress INTEGER NOT NULL DEFAULT 0, "
+        "video_enhancement_error TEXT, video_enhancement_last_updated TEXT NOT NULL, "
+        "metadata_extraction_status TEXT NOT NULL DEFAULT 'pending', metadata_extraction_progress INTEGER NOT NULL DEFAULT 0, "
+        "metadata_extraction_error TEXT, metadata_extraction_last_updated TEXT NOT NULL)"
+    )
+    conn.commit()
+    conn.close()
+
+    store = ProcessingState(db_path=db_path, legacy_states_file=None, flush_interval=0)
+    store.update_state("file_1", "completed", 100, None, "video_enhancement", event_time="2024-01-01T00:00:01")
+    assert store.get_state("file_1")["video_enhancement"]["status"] == "completed"
+    store.close()
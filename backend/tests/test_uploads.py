@@ -0,0 +1,80 @@
+import os
+import hashlib
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+from app.utils.uploads import stream_upload
+
+MAX_BYTES = 1024 * 1024
+
+@pytest.fixture
+def upload_dir(tmp_path):
+    return str(tmp_path)
+
+@pytest.fixture
+def client(upload_dir):
+    """A minimal app that streams uploads with a small chunk size"""
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        upload = await stream_upload(request, upload_dir, "file_1", MAX_BYTES, chunk_size=4096)
+        return {"filename": upload.filename, "size": upload.size, "content_type": upload.content_type,
+                "sha256": upload.sha256}
+
+    return TestClient(app)
+
+def test_upload_written_to_disk(client, upload_dir):
+    """The file part lands on disk under the file id with its original extension"""
+    content = os.urandom(300 * 1024)
+    response = client.post(
+        "/upload",
+        files={"file": ("clip.mp4", content, "video/mp4")},
+        data={"note": "ignored"}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"filename": "file_1.mp4", "size": len(content), "content_type": "video/mp4",
+                               "sha256": hashlib.sha256(content).hexdigest()}
+    with open(os.path.join(upload_dir, "file_1.mp4"), "rb") as f:
+        assert f.read() == content
+    assert os.listdir(upload_dir) == ["file_1.mp4"]
+
+def test_oversized_upload_rejected(client, upload_dir):
+    """An upload over the limit gets 413 and leaves nothing behind"""
+    response = client.post("/upload", files={"file": ("big.mp4", b"x" * (MAX_BYTES + 1), "video/mp4")})
+    assert response.status_code == 413
+    assert os.listdir(upload_dir) == []
+
+def test_oversized_upload_rejected_while_streaming(client, upload_dir):
+    """Without Content-Length the limit is enforced while the body is read"""
+    boundary = "testboundary"
+    head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.mp4\"\r\n"
+            f"Content-Type: video/mp4\r\n\r\n").encode()
+
+    def body():
+        yield head
+        for _ in range(40):
+            yield b"x" * 64 * 1024
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+    response = client.post(
+        "/upload",
+        content=body(),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    )
+    assert response.status_code == 413
+    assert os.listdir(upload_dir) == []
+
+def test_non_video_rejected(client, upload_dir):
+    """Only video content types are accepted"""
+    response = client.post("/upload", files={"file": ("notes.txt", b"hello", "text/plain")})
+    assert response.status_code == 400
+    assert os.listdir(upload_dir) == []
+
+def test_missing_file_field(client, upload_dir):
+    """A form without the file field is a bad request"""
+    response = client.post("/upload", files={"other": ("clip.mp4", b"data", "video/mp4")})
+    assert response.status_code == 400
+    assert os.listdir(upload_dir) == []
@@ -3,12 +3,28 @@ import asyncio
 import os
 import cv2
 import numpy as np
+import pytest_asyncio
+from app.utils import memory_broker
 from app.workers.video_enhancement_worker import VideoEnhancementWorker
 
+# The in-process broker keeps these tests independent of RabbitMQ
+URL = "memory://test-enhancement"
+
+@pytest_asyncio.fixture
+async def worker(tmp_path):
+    """A worker on the in-process broker writing its results to tmp_path"""
+    memory_broker.reset()
+    worker = VideoEnhancementWorker(URL)
+    worker.processed_dir = str(tmp_path)
+    worker.thumbnails_dir = str(tmp_path)
+    yield worker
+    await worker.close()
+    memory_broker.reset()
+
 @pytest.fixture
-def sample_video():
+def sample_video(tmp_path):
     """Create a sample video file for testing"""
-    output_path = "test_video.mp4"
+    output_path = str(tmp_path / "test_video.mp4")
     fps = 30
     width, height = 640, 480
     duration = 2  # seconds
@@ -32,16 +48,14 @@ def sample_video():
         os.remove(output_path)
 
 @pytest.mark.asyncio
-async def test_video_enhancement_worker(sample_video):
+async def test_video_enhancement_worker(worker, sample_video):
     """Test the video enhancement worker"""
-    worker = VideoEnhancementWorker()
-    
     # Test connection
     await worker.connect()
     assert worker.connection is not None
     assert worker.channel is not None
     assert worker.queue is not None
-    assert worker.exchange is not None
+    assert worker.task_exchange is not None
     
     # Test video processing
     message = {
@@ -49,7 +63,7 @@ async def test_video_enhancement_worker(sample_video):
         "filepath": sample_video
     }
     
-    result = await worker.process_video(message)
+    result = await worker.enhance_video(message)
     assert result["status"] == "completed"
     assert "output_path" in result
     assert os.path.exists(result["output_path"])
@@ -64,29 +78,19 @@ async def test_video_enhancement_worker(sample_video):
     assert frame.shape == (480, 640, 3)
     
     cap.release()
-    
-    # Cleanup
-    if os.path.exists(result["output_path"]):
-        os.remove(result["output_path"])
-    
-    await worker.close()
 
 @pytest.mark.asyncio
-async def test_status_updates():
+async def test_status_updates(worker):
     """Test status update functionality"""
-    worker = VideoEnhancementWorker()
     await worker.connect()
     
     # Test status update
     await worker.update_status("test_123", "processing", 50)
     await worker.update_status("test_123", "completed", 100)
-    
-    await worker.close()
 
 @pytest.mark.asyncio
-async def test_error_handling():
+async def test_error_handling(worker):
     """Test error handling in video processing"""
-    worker = VideoEnhancementWorker()
     await worker.connect()
     
     # Test with non-existent file
@@ -95,8 +99,6 @@ async def test_error_handling():
         "filepath": "non_existent.mp4"
     }
     
-    result = await worker.process_video(message)
+    result = await worker.enhance_video(message)
     assert result["status"] == "failed"
     assert "error" in result
-    
-    await worker.close() 
\ No newline at end of file